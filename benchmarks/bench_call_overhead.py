@@ -0,0 +1,219 @@
+"""Benchmark the overhead of heasoftpy itself, without a HEASoft install
+
+A synthetic $HEADAS tree is built in a temporary directory, with generated
+.par files of various sizes in syspfiles, and stub executables in bin that
+print their arguments, or emit a given number of MB of output. The time of
+the steps of a task call is measured on it:
+
+    import       : `import heasoftpy` in a new interpreter, minus `python -c pass`
+    construct    : HSPTask(name), with the parsed .par file cached or not
+    build_params : HSPTask.build_params with a value for every parameter
+    write_pfile  : writing the user .par file, changed or unchanged
+    read_pfile   : HSPTask.read_pfile
+    exec_task    : HSPTask.exec_task, and a full task call, of a stub printing
+                   its arguments
+    io_stream    : throughput of HSPTask.handle_io_stream, for a stub emitting
+                   SIZE MB
+
+The results are printed, and written as json with -o, so they can be compared
+with those of another version (or machine) with -c.
+
+Usage:
+    python benchmarks/bench_call_overhead.py [-o OUT.json] [-c OLD.json]
+                        [--repeat N] [--size SIZE_MB]
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# number of parameters of the generated .par files
+PAR_SIZES = [10, 100, 1000]
+
+
+def make_headas(hdir):
+    """Build a synthetic HEADAS tree in hdir
+
+    Args:
+        hdir: an empty directory
+
+    Returns:
+        dict of the environment variables to use it
+
+    """
+    for sub in ['syspfiles', 'bin', 'pfiles']:
+        os.makedirs(os.path.join(hdir, sub))
+
+    # echoN: a task with N parameters, of the usual types, printing its arguments
+    templates = ['infile{i},f,a,"in{i}.fits",,,"Name of input file {i}"',
+                 'chatter{i},i,h,2,0,5,"Chatter level, from 0 to 5"',
+                 'columns{i},s,h,"TIME,RATE",,,"List of columns, or -"',
+                 'scale{i},r,h,1.5,,,"Scale factor"',
+                 'clobber{i},b,h,no,,,"Overwrite existing output?"']
+    for npar in PAR_SIZES:
+        lines = [templates[i % len(templates)].format(i=i) for i in range(npar - 1)]
+        lines.append('mode,s,h,"ql",,,""')
+        _write(f'{hdir}/syspfiles/echo{npar}.par', '\n'.join(lines) + '\n')
+        _write(f'{hdir}/bin/echo{npar}', '#!/bin/sh\nfor a in "$@"; do echo "$a"; done\n', 0o755)
+
+    # emit: print size MB of lines
+    _write(f'{hdir}/syspfiles/emit.par', 'size,r,a,1,,,"Output size in MB"\nmode,s,h,"ql",,,""\n')
+    _write(f'{hdir}/bin/emit', '#!/bin/sh\nsize=${1#size=}\n'
+           'yes "heasoftpy benchmark output line" | head -c $(( size * 1048576 ))\n', 0o755)
+
+    return {'HEADAS': hdir, 'PFILES': f'{hdir}/pfiles;{hdir}/syspfiles',
+            'PATH': f'{hdir}/bin' + os.pathsep + os.environ.get('PATH', '')}
+
+
+def _write(filename, text, mode=None):
+    with open(filename, 'w') as fp:
+        fp.write(text)
+    if mode is not None:
+        os.chmod(filename, mode)
+
+
+def best_time(func, repeat, number=1):
+    """The best time per call of func, in seconds, out of repeat runs of number calls"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t0) / number)
+    return min(times)
+
+
+def bench_import(repeat):
+    """Time of `import heasoftpy` in a new interpreter"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    def _run(code):
+        return lambda: subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    base = best_time(_run('pass'), repeat)
+    full = best_time(_run('import heasoftpy'), repeat)
+    return {'import': full - base, 'python_startup': base}
+
+
+def bench_task(repeat, heasoftpy, hdir):
+    """Time the steps of a task call, for each .par file size"""
+    from heasoftpy.core import _pfile_cache
+    HSPTask = heasoftpy.HSPTask
+
+    results = {}
+    for npar in PAR_SIZES:
+        name  = f'echo{npar}'
+        task  = HSPTask(name)
+        res   = {}
+        number = max(1, 2000 // npar)
+
+        # the cache of parsed .par files is emptied before every call
+        res['construct_cold'] = best_time(lambda: (_pfile_cache.clear(), HSPTask(name)),
+                                          repeat, number)
+        res['construct'] = best_time(lambda: HSPTask(name), repeat, number)
+
+        # build_params and exec_task need the state set by a call; a first call leaves it
+        task(noprompt=True)
+        user_pars = {pname: getattr(task, pname).value for pname in task.par_names}
+        res['build_params'] = best_time(lambda: task.build_params(dict(user_pars)),
+                                        repeat, number)
+
+        pfile = f'{hdir}/pfiles/{name}.par'
+        par   = task.par_names[0]
+        values = iter(range(10**9))
+        def _write_changed():
+            setattr(task, par, f'in{next(values)}.fits')
+            task.write_pfile(pfile)
+        res['write_pfile'] = best_time(_write_changed, repeat, number)
+        res['write_pfile_unchanged'] = best_time(lambda: task.write_pfile(pfile), repeat, number)
+        res['read_pfile'] = best_time(lambda: HSPTask.read_pfile(pfile), repeat, number)
+
+        number = max(1, number // 10)
+        res['exec_task'] = best_time(task.exec_task, repeat, number)
+        res['call'] = best_time(lambda: task(noprompt=True), repeat, number)
+        results[name] = res
+    return results
+
+
+def bench_io_stream(repeat, size, heasoftpy, hdir):
+    """Throughput of handle_io_stream for a task printing size MB"""
+    HSPTask = heasoftpy.HSPTask
+    res = {}
+    for stderr in [False, True]:
+        def _run():
+            proc = subprocess.Popen([f'{hdir}/bin/emit', f'size={size}'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE if stderr else subprocess.STDOUT)
+            HSPTask.handle_io_stream(proc, stderr, 20, None)
+            proc.wait()
+        dt = best_time(_run, repeat)
+        res['stderr' if stderr else 'stdout'] = {'seconds': dt, 'MB/s': size / dt}
+    return res
+
+
+def compare(new, old, prefix=''):
+    """Print the ratio new/old of the times in two results"""
+    for key, value in new.items():
+        if not key in old:
+            continue
+        if isinstance(value, dict):
+            compare(value, old[key], f'{prefix}{key}.')
+        elif isinstance(value, float) and old[key]:
+            ratio = value / old[key]
+            flag  = '  <--' if ratio > 1.2 and key != 'MB/s' else ''
+            print(f'{prefix+key:>40}: {ratio:6.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='json file where the results are written')
+    parser.add_argument('-c', '--compare', help='json file of previous results to compare to')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each measurement')
+    parser.add_argument('--size', type=int, default=50, help='output size in MB for io_stream')
+    args = parser.parse_args()
+
+    hdir = tempfile.mkdtemp(prefix='bench_headas.')
+    try:
+        os.environ.update(make_headas(hdir))
+        t0 = time.perf_counter()
+        import heasoftpy
+        first_import = time.perf_counter() - t0
+
+        results = {
+            'meta': {'heasoftpy': heasoftpy.__version__, 'python': platform.python_version(),
+                     'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'repeat': args.repeat, 'size_MB': args.size},
+            'import': dict(bench_import(args.repeat), in_process=first_import),
+            'task': bench_task(args.repeat, heasoftpy, hdir),
+            'io_stream': bench_io_stream(args.repeat, args.size, heasoftpy, hdir),
+        }
+    finally:
+        shutil.rmtree(hdir)
+
+    print(f'import heasoftpy: {results["import"]["import"]*1e3:8.1f} ms')
+    names = list(results['task'][f'echo{PAR_SIZES[0]}'].keys())
+    print(f'{"(us per call)":>22}' + ''.join([f'{f"echo{n}":>12}' for n in PAR_SIZES]))
+    for key in names:
+        print(f'{key:>22}' + ''.join([f'{results["task"][f"echo{n}"][key]*1e6:12.1f}'
+                                      for n in PAR_SIZES]))
+    for key, res in results['io_stream'].items():
+        print(f'io_stream {key:>12}: {res["MB/s"]:8.1f} MB/s')
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            old = json.load(fp)
+        print(f'\nratio of times to {args.compare} (>1 is slower; for MB/s, >1 is faster)')
+        compare({k: v for k, v in results.items() if k != 'meta'}, old)
+
+
+if __name__ == '__main__':
+    main()
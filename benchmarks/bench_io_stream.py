@@ -0,0 +1,108 @@
+"""Benchmark the throughput of HSPTask.handle_io_stream
+
+A child process writes SIZE MB to stdout (and a tenth of it to stderr), and
+its output is captured with the per-chunk decode/StringIO implementation used
+before heasoftpy 1.2, and with the current handle_io_stream. The output is
+ascii; the legacy implementation fails on multi-byte characters split
+between chunks.
+
+Usage:
+    python benchmarks/bench_io_stream.py [SIZE_MB] [REPEAT]
+
+"""
+import os
+import sys
+import io
+import time
+import selectors
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from heasoftpy.core import HSPTask
+
+
+CHILD = '''
+import sys
+size = int(sys.argv[1])
+block = (('heasoftpy output ' * 8 + '\\n') * 8192).encode()
+out, err = sys.stdout.buffer, sys.stderr.buffer
+for i in range(size // len(block)):
+    out.write(block)
+    if i % 10 == 0:
+        err.write(block)
+'''
+
+
+def legacy_handle_io_stream(proc, stderr, verbose, logfile):
+    # the implementation of handle_io_stream before 1.2, for reference
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+    outBuf = io.StringIO()
+    if stderr:
+        selector.register(proc.stderr, selectors.EVENT_READ)
+        errBuf = io.StringIO()
+    file = None
+    if not logfile is None:
+        file = open(logfile, 'a')
+    done = False
+    while not done:
+        for key, _ in selector.select():
+            line = key.fileobj.read1().decode()
+            if not line:
+                done = True
+            if not stderr or key.fileobj is proc.stdout:
+                if verbose != 20: sys.stdout.write(line)
+                outBuf.write(line)
+                if file: file.write(line)
+            else:
+                if verbose != 20: sys.stderr.write(line)
+                errBuf.write(line)
+                if file: file.write(line)
+    proc_out = outBuf.getvalue()
+    proc_err = errBuf.getvalue() if stderr else None
+    if file:
+        file.close()
+    # the legacy loop stops at the first EOF; drain what is left
+    proc.communicate()
+    return proc_out, proc_err
+
+
+def run(handler, size, verbose, logfile):
+    """Time one run of handler; return (seconds, captured bytes)"""
+    proc = subprocess.Popen([sys.executable, '-c', CHILD, str(size)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # the screen output goes to /dev/null
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            t0 = time.perf_counter()
+            out, err = handler(proc, True, verbose, logfile)
+            proc.wait()
+            dt = time.perf_counter() - t0
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+    if logfile:
+        os.remove(logfile)
+    return dt, len(out.encode()) + len(err.encode())
+
+
+def main():
+    size   = int(float(sys.argv[1]) * 1024**2) if len(sys.argv) > 1 else 100 * 1024**2
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    logfile = f'bench_io_stream.{os.getpid()}.log'
+    
+    print(f'{"handler":>10} {"verbose":>8} {"MB/s":>10} {"best (s)":>10}')
+    for verbose, log in [(1, None), (2, logfile)]:
+        for name, handler in [('legacy', legacy_handle_io_stream), 
+                              ('current', HSPTask.handle_io_stream)]:
+            times = []
+            for _ in range(repeat):
+                dt, nbytes = run(handler, size, verbose, log)
+                times.append(dt)
+            best = min(times)
+            print(f'{name:>10} {verbose:>8} {nbytes/best/1024**2:10.1f} {best:10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark the parsing of .par file lines by HSPParam
+
+All the lines of $HEADAS/syspfiles/*.par are parsed with the regex
+split-and-rejoin parser used before heasoftpy 1.2, and with the current
+single-pass HSPParam.split_line. Lines where the two disagree are counted
+(and printed with -v). If $HEADAS is not defined, a synthetic set of
+lines is used.
+
+Usage:
+    python benchmarks/bench_param_parse.py [-v] [REPEAT]
+
+"""
+import os
+import sys
+import re
+import glob
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from heasoftpy.core import HSPParam
+
+
+def legacy_split(line):
+    # the parser of HSPParam.__init__ before 1.2, for reference
+    line = line.replace('\n', '')
+    info = line.strip().split(',')
+    if len(info) > 6:
+        if line.count('"') % 2 != 0:
+             line += '"'
+        parts = re.split("('.*?'|\\\".*?\\\")", line)
+        parts = [p.replace(',', '^|_') if ('"' in p or "'" in p) else p.strip()
+                  for p in parts]
+        info  = [p.replace('^|_', ',') for p in ''.join(parts).split(',')]
+    return info
+
+
+def current_split(line):
+    return HSPParam.split_line(line.replace('\n', '').strip())
+
+
+def read_lines():
+    """Return the .par lines to parse, and where they come from"""
+    headas = os.environ.get('HEADAS', None)
+    files  = glob.glob(os.path.join(headas, 'syspfiles', '*.par')) if headas else []
+    lines  = []
+    for pfile in files:
+        with open(pfile, errors='replace') as fp:
+            lines += [line for line in fp
+                      if not line.startswith('#') and len(line.split(',')) >= 6]
+    if lines:
+        return lines, f'{len(files)} files in {headas}/syspfiles'
+    
+    base = ['infile,f,a,"event.fits",,,"Name of the input file"',
+            'chatter,i,h,2,0,5,"Chatter level, from 0 to 5"',
+            'columns,s,h,"TIME,RATE,ERROR",,,"Comma-separated list of columns, or -"',
+            'clobber,b,h,no,,,"Overwrite the output file, if it exists?"',
+            "prompt,s,h,'a,b',,,\"Don't use 'quotes', or commas\"",
+            'mode,s,h,"ql",,,""']
+    return base * 20000, 'a synthetic set of lines'
+
+
+def fields(info):
+    # the fields as used by HSPParam
+    return [info[0].strip()] + [f.strip().strip('"') for f in info[1:7]]
+
+
+def main():
+    verbose = '-v' in sys.argv
+    args    = [a for a in sys.argv[1:] if a != '-v']
+    repeat  = int(args[0]) if args else 5
+    lines, source = read_lines()
+    print(f'parsing {len(lines)} lines from {source}')
+    
+    for name, split in [('legacy', legacy_split), ('current', current_split)]:
+        best = min([_time(split, lines) for _ in range(repeat)])
+        print(f'{name:>10}: {best*1e3:8.2f} ms  {best/len(lines)*1e9:8.1f} ns/line')
+    
+    ndiff = 0
+    for line in lines:
+        old, new = legacy_split(line), current_split(line)
+        if len(old) >= 7 and fields(old) != fields(new):
+            ndiff += 1
+            if verbose:
+                print(f'{line.strip()}\n    legacy : {fields(old)}\n    current: {fields(new)}')
+    print(f'lines parsed differently: {ndiff}')
+
+
+def _time(split, lines):
+    t0 = time.perf_counter()
+    for line in lines:
+        split(line)
+    return time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    main()
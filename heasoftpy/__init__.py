@@ -24,7 +24,9 @@ EXAMPLE USAGE:
 --------------
 Using tasks in heasoftpy offer flexibility in usage.
 
-- Built-in tasks can be called directly (if installed in heasoftpy/fcn):
+- Built-in tasks can be called directly. The wrappers are loaded the first
+    time they are used, from heasoftpy/fcn if installed there, or from the 
+    task's .par file in $HEADAS/syspfiles otherwise:
 >>> result = hsp.ftlist(infile='input.fits', option='T')
 
 
@@ -48,6 +50,27 @@ The input to the functions is also flexible:
 >>> ftlist.option = 'T'
 >>> result = ftlist()
 
+- A task can be run for many sets of parameters concurrently, with each run
+    using its own pfiles directory:
+>>> ftlist = hsp.HSPTask('ftlist')
+>>> results = ftlist.map([{'infile':'in1.fits'}, {'infile':'in2.fits'}], option='T')
+
+- From asyncio code, tasks can be awaited with acall:
+>>> result = await hsp.HSPTask('ftlist').acall(infile='input.fits', option='T')
+
+- The output lines of a running task can be iterated over as they are printed:
+>>> with hsp.HSPTask('ftlist').stream(infile='input.fits', option='T') as stream:
+>>>     for source, line in stream:
+>>>         print(source, line)
+>>> result = stream.result
+
+- Callbacks can be run before and after every task call (see core.HSPHooks). 
+    metrics.HSPMetrics uses them to count the calls and their duration per task:
+>>> from heasoftpy.metrics import HSPMetrics
+>>> metrics = HSPMetrics().install()
+>>> ...
+>>> metrics.dump('heasoftpy_metrics.prom')
+
 
 All tasks take additional optional parameters:
 - verbose: This can take several values. In all cases, the text printed by the
@@ -66,6 +89,18 @@ All tasks take additional optional parameters:
     the parameters. Default is False.
 - stderr: If True, make `stderr` separate from `stdout`. The default
     is False, so stderr is written to stdout.
+- output_policy: How the captured output is stored. 'memory' (default) keeps
+    it all in memory; 'spill' keeps up to max_output bytes in memory and writes
+    the rest to a temporary file; 'head_tail' keeps only the first and last
+    max_output/2 bytes.
+- max_output: The number of bytes kept in memory by output_policy (default 64 MB).
+- incremental: If True, skip running the task when all its output files (parameters
+    of type fw, or f named out*) exist and are newer than its input files (other
+    parameters of type f or fr), and were produced with the same parameters. Default is False.
+- timing: If True, record the time of the phases of the call (reading the .par file,
+    building the parameters, writing the user .par file, starting the process, first
+    output, exit) and the resource usage of the task process in HSPResult.timing.
+    Default is False.
 
 
 
@@ -104,10 +139,22 @@ installation of HEASoft is therefore required.
 
 """
 import os
-from .core import HSPTask, HSPTaskException, HSPResult, HSPParam, HSPLogger
+from .core import HSPTask, HSPTaskException, HSPResult, HSPParam, HSPLogger, HSPStream, HSPTiming, hooks
 from . import utils
+from . import fcn
+
+
+# task wrappers in heasoftpy.fcn are loaded on first access
+def __getattr__(name):
+    try:
+        value = getattr(fcn, name)
+    except AttributeError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    globals()[name] = value
+    return value
 
-from .fcn import *
+def __dir__():
+    return sorted(set(globals()) | set(dir(fcn)))
 
 # help function
 def help(): print(__doc__)
@@ -0,0 +1,230 @@
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+
+
+def cache_dir():
+    """Return the directory where heasoftpy keeps its persistent caches
+
+    This is $HEASOFTPY_CACHE_DIR if defined, or ~/.cache/heasoftpy otherwise.
+
+    """
+    cdir = os.environ.get('HEASOFTPY_CACHE_DIR', None)
+    if cdir is None:
+        cdir = os.path.join(os.path.expanduser('~'), '.cache', 'heasoftpy')
+    return cdir
+
+
+class HSPDiskCache:
+    """A size-bounded on-disk key-value store with LRU eviction.
+
+    Each value is stored as bytes in a file named after the hash of its key.
+    Reading a value updates the mtime of its file, so when the total size
+    goes above max_size, the least recently used files are removed first.
+    Writes are atomic (a temporary file that is renamed), so the cache can be
+    shared by concurrent threads and processes.
+
+    If the cache directory cannot be created or written to, the cache
+    silently behaves as if it were empty.
+
+    """
+
+    def __init__(self, name, max_size=50*1024**2, directory=None):
+        """Create a cache
+
+        Args:
+            name: name of the cache; also the sub-directory under cache_dir()
+            max_size: maximum size of the cache in bytes
+            directory: use this directory instead of the default cache_dir()/name
+
+        """
+        self.name      = name
+        self.max_size  = max_size
+        self._dir      = directory
+        self._size     = None
+        self._lock     = threading.Lock()
+
+
+    @property
+    def directory(self):
+        """The directory of the cache"""
+        return os.path.join(cache_dir(), self.name) if self._dir is None else self._dir
+
+
+    def _path(self, key):
+        """The file holding the value of key"""
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+
+    def get(self, key):
+        """Return the value stored for key as bytes, or None if not found"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                value = fp.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+
+    def put(self, key, value):
+        """Store the bytes value for key, and evict old entries if needed"""
+        directory = self.directory
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmpfile = tempfile.mkstemp(dir=directory, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(value)
+            os.replace(tmpfile, self._path(key))
+        except OSError:
+            return
+
+        # keep a running estimate of the size, and only scan the
+        # directory when it may be above max_size
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(value)
+            if self._size > self.max_size:
+                self._evict()
+
+
+    def _scan(self):
+        """Return a list of (mtime, size, path) of the entries, and their total size"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith('.tmp'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        except OSError:
+            pass
+        return entries, sum([e[1] for e in entries])
+
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is within 90% of max_size"""
+        entries, size = self._scan()
+        for mtime, fsize, path in sorted(entries):
+            if size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= fsize
+        self._size = size
+
+
+    def info(self):
+        """Return a dict with the directory, number of entries and size of the cache"""
+        entries, size = self._scan()
+        return {'directory': self.directory, 'entries': len(entries),
+                'size': size, 'max_size': self.max_size}
+
+
+    def clear(self):
+        """Remove all the entries in the cache"""
+        with self._lock:
+            for _, _, path in self._scan()[0]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+
+class HSPResultCache(HSPDiskCache):
+    """A persistent cache of task results, used by HSPTask when set as 
+    HSPTask.result_cache.
+    
+    A result is stored under a key made of the task name, its parameters and 
+    a fingerprint of its input files (parameters of type f and fr), so it is
+    returned without running the task when it is called again with the same 
+    parameters on unchanged files. Only successful runs (returncode=0) are
+    stored, and only tasks in the allowlist `tasks` are cached, so tasks with 
+    side effects are never skipped.
+    
+    >>> import heasoftpy as hsp
+    >>> from heasoftpy.cache import HSPResultCache
+    >>> hsp.HSPTask.result_cache = HSPResultCache()
+    
+    """
+    
+    # tasks that only read their input; a value can also be a function that
+    # takes the task parameters and returns whether that call can be cached
+    default_tasks = {
+        'ftlist': True, 'fdump': True, 'fstruct': True, 'fkeyprint': True,
+        'fkeypar': True, 'ftkeypar': True, 'ftstat': True, 'fstatistic': True,
+        'ftverify': True, 'fverify': True,
+        'fthedit': lambda params: str(params.get('operation', '')).lower() == 'read',
+    }
+    
+    def __init__(self, tasks=None, hash_files=False, name='results', 
+                 max_size=200*1024**2, directory=None):
+        """Create a result cache
+        
+        Args:
+            tasks: dict of {taskname: True or function(params)} of the tasks 
+                that can be cached, or a list of task names. Default is default_tasks.
+            hash_files: if True, input files are identified by the sha256 of their
+                content, otherwise by their path, size and modification time.
+            name, max_size, directory: passed to HSPDiskCache
+        
+        """
+        super().__init__(name, max_size=max_size, directory=directory)
+        if tasks is None:
+            tasks = self.default_tasks
+        elif not isinstance(tasks, dict):
+            tasks = {task: True for task in tasks}
+        self.tasks      = dict(tasks)
+        self.hash_files = hash_files
+    
+    
+    def allows(self, taskname, params):
+        """Check if a call of taskname with params can be cached"""
+        allowed = self.tasks.get(taskname, False)
+        if callable(allowed):
+            allowed = allowed(params)
+        return bool(allowed)
+    
+    
+    def file_fingerprint(self, path):
+        """Return a str identifying the content of the file at path"""
+        st = os.stat(path)
+        if self.hash_files:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as fp:
+                for block in iter(lambda: fp.read(1024**2), b''):
+                    sha.update(block)
+            return f'{os.path.realpath(path)}:{sha.hexdigest()}'
+        return f'{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}'
+    
+    
+    def get_result(self, key):
+        """Return the dict stored for key, or None"""
+        value = self.get(key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    
+    
+    def put_result(self, key, value):
+        """Store a json-serializable dict for key; very large values are not stored"""
+        data = json.dumps(value, default=str).encode()
+        if len(data) <= self.max_size // 10:
+            self.put(key, data)
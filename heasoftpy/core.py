@@ -1,5 +1,5 @@
 
-from collections import OrderedDict
+from collections import OrderedDict, deque, namedtuple
 import subprocess
 import os
 import re
@@ -7,6 +7,20 @@ import sys
 import io
 import selectors
 import logging
+import threading
+import time
+import shutil
+import tempfile
+import concurrent.futures
+import contextlib
+import contextvars
+import atexit
+import codecs
+import json
+import hashlib
+
+from .cache import HSPDiskCache
+from . import parsers
 
 
 
@@ -19,6 +33,21 @@ class HSPTaskException(Exception):
 
 class HSPTask:
     """A class for handling a Heasoftpy (HSP) task"""
+    
+    # persistent cache of the fhelp text used by task_docs; None to disable
+    docs_cache = HSPDiskCache('docs', max_size=50*1024**2)
+    
+    # executor for python tasks run as $HEADAS/bin/{task}.py, e.g. 
+    # workers.HSPWorkerPool; None to run them as a new python process
+    python_executor = None
+    
+    # persistent cache of results for tasks that only read their input,
+    # e.g. cache.HSPResultCache; None (default) to always run the task
+    result_cache = None
+    
+    # hashes of the parameters that produced the output files, used by 
+    # incremental=True; None to only compare the file times
+    outputs_cache = HSPDiskCache('outputs', max_size=10*1024**2)
 
     def __init__(self, name=None):
         """Initialize an HSPTask with a given name.
@@ -45,23 +74,53 @@ class HSPTask:
         self.pytaskname = name.replace('-', '_')
             
         
-        # first read the parameter file
+        # first read the parameter file; parsed .par files are shared
+        # through _pfile_cache, so we get a fresh copy of the parameters
+        t0     = time.perf_counter()
         pfile  = HSPTask.find_pfile(name)
-        params = HSPTask.read_pfile(pfile)
+        t1     = time.perf_counter()
+        source = _pfile_source(pfile)
+        params = _pfile_cache.get(pfile)
+        # the timing of the construction, added to the HSPTiming of calls
+        self._init_phases = {'find_pfile': (t0, t1), 'read_pfile': (t1, time.perf_counter())}
+        
+        # (path, content, lines) of the last .par file written, and (path, stat 
+        # key, content, trusted) of the last .par file seen; see _pfile_unchanged
+        self._pfile_written = None
+        self._pfile_state   = None
+        self._set_params(pfile, source, params)
+        self.__doc__ = self._generate_fcn_docs()
+    
+    
+    def _set_params(self, pfile, source, params):
+        """Set the task parameters, as read from a .par file
         
+        Args:
+            pfile: the .par file
+            source: (pfile, stat key) of the .par file when it was read, or
+                None if the file may have changed while reading; see reset
+            params: list of HSPParam, used by the task
+        
+        """
         # par_names: holds a list of the parameter names as strings
         # make each parameter accessible as: task.par_name
+        # this bypasses __setattr__, which would set the value of an existing parameter
         par_names = []
         for par in params:
-            setattr(self, par.pname, par)
+            super(HSPTask, self).__setattr__(par.pname, par)
             par_names.append(par.pname)
         
         # if no mode, assume ql
         if not 'mode' in par_names:
             params.append(HSPParam('mode,s,h,"ql",,,'))
-            setattr(self, 'mode', params[-1])
+            super(HSPTask, self).__setattr__('mode', params[-1])
             par_names.append('mode')
         
+        # parameters of a previous .par file that are gone
+        old_names = getattr(self, 'par_names', None)
+        if old_names is not None and old_names != par_names:
+            for pname in set(old_names).difference(par_names):
+                super(HSPTask, self).__delattr__(pname)
      
         # add extra useful keys to parameters
         default_mode = self.mode.value if hasattr(self, 'mode') else 'h'
@@ -78,7 +137,53 @@ class HSPTask:
         self.params = {}
         self.default_params = {pname:getattr(self, pname).value for pname in par_names}
         self.pfile = pfile
-        self.__doc__ = self._generate_fcn_docs()
+        
+        # a private pfiles directory for the user .par file. If None, the 
+        # directory of the active utils.pfiles_scope, if any, is used
+        self._pfiles_dir = None
+        
+        # the .par file the parameters were read from; see reset
+        self._pfile_source = source
+        # the lines written by write_pfile that params were parsed from, if any
+        self._pfile_base = None
+    
+    
+    def reset(self):
+        """Reset the task to the state of a new instance, ready for a new call
+        
+        The parameters are set to their defaults, from the .par file that a 
+        new instance would read. It is parsed again only if it changed, and if
+        it is the user .par file as written by the last call, only its lines 
+        that changed are parsed. This is used to reuse task instances in the 
+        wrappers in heasoftpy.fcn. As in a new instance, the time taken is 
+        added to the HSPTiming of the next call.
+        
+        """
+        t0     = time.perf_counter()
+        pfile  = HSPTask.find_pfile(self.taskname)
+        t1     = time.perf_counter()
+        source = _pfile_source(pfile)
+        written = self._pfile_written
+        
+        if source is not None and source == self._pfile_source:
+            # the file is the one read before
+            params = [HSPParam(schema=getattr(self, pname).schema) for pname in self.par_names]
+            base   = self._pfile_base
+        elif written is not None and written[0] == pfile and self._pfile_unchanged(*written[:2]):
+            # the file is what write_pfile wrote; parse the lines that changed
+            base, lines = self._pfile_base, written[2]
+            params = [HSPParam(schema=getattr(self, pname).schema)
+                      if base is not None and line == base[ipar] else HSPParam(line)
+                      for ipar, (pname, line) in enumerate(zip(self.par_names, lines))]
+            base   = lines
+        else:
+            params = _pfile_cache.get(pfile)
+            base   = None
+            # the lines written follow the old parameters
+            self._pfile_written = None
+        self._set_params(pfile, source, params)
+        self._pfile_base = base
+        self._init_phases = {'find_pfile': (t0, t1), 'read_pfile': (t1, time.perf_counter())}
 
         
     def __setattr__(self, attr, val):
@@ -133,11 +238,173 @@ class HSPTask:
                 the parameters. Default is False.
             - stderr: If True, make stderr separate from stdout. The default
                 is False, so stderr is written to stdout.
+            - output_policy: How the captured output is stored in HSPResult. This is
+                useful for tasks that print large amounts of text:
+                - 'memory': the default; all the output is kept in memory.
+                - 'spill': keep up to max_output bytes in memory, and write the rest
+                    to a temporary file. HSPResult.stdout/output read the file when 
+                    accessed, and HSPResult.iter_output reads it line by line.
+                - 'head_tail': keep only the first and last max_output/2 bytes.
+            - max_output: The number of bytes kept in memory by output_policy. 
+                The default is 64 MB.
+            - incremental: If True, the task is not run when all its output files 
+                (parameters of type fw, or f named out*) exist and are newer than 
+                its input files (see file_params), as in make, and were produced 
+                with the same parameters (see HSPTask.outputs_cache). A result 
+                with returncode=0, no output, and cached=True is returned instead. 
+                Default is False.
+            - timing: If True, record the time of the phases of the call, and 
+                the resource usage of the task process, in HSPResult.timing 
+                (an HSPTiming). Default is False.
             
         Returns:
             HSPResult
         """
         
+        if not self._setup_call(args, kwargs):
+            return None
+        start = self._start_call()
+        try:
+            result = self._run_call()
+        except BaseException:
+            # the post_call hooks see the failed call, with result=None
+            self._end_call(None, start)
+            raise
+        return self._end_call(result, start)
+    
+    
+    def _run_call(self):
+        """Run the task for the parameters set by _setup_call; see __call__
+        
+        Returns:
+            HSPResult
+        """
+        # a stored result from HSPTask.result_cache, if any
+        cache_key, result = self._lookup_result()
+        if result is None and self._incremental:
+            result = self._skip_up_to_date()
+        if not result is None:
+            return result
+        
+        # write the user .par file, call the task, and sync the .par file #
+        with self._phase('write_pfile'):
+            usr_pfile = self._write_user_pfile()
+        result = self.exec_task()
+        with self._phase('sync_pfile'):
+            result = self._sync_user_pfile(result, usr_pfile)
+        self._store_result(cache_key, result)
+        if self._incremental:
+            self._store_outputs(result)
+        return result
+    
+    
+    async def acall(self, args=None, **kwargs):
+        """Call the task from an asyncio event loop.
+        
+        This takes the same input and returns the same HSPResult as calling the task.
+        For heasoft tasks, the process is run with asyncio.create_subprocess_exec
+        and its output is streamed as in handle_io_stream, so many tasks can run
+        on one event loop. Python-only tasks that override exec_task are run
+        in the default executor of the loop.
+        
+        Querying parameters blocks the loop, so all the required parameters
+        should be given, or noprompt=True used. An HSPTask instance should
+        not be used by more than one call at a time.
+        
+        Like any call, acall writes the user .par file of the task, so concurrent
+        calls of the same task (e.g. with asyncio.gather) overwrite each other's
+        parameters, unless each is inside its own utils.pfiles_scope. The scope 
+        is kept per asyncio task:
+        
+        Example:
+            >>> result = await hsp.HSPTask('ftlist').acall(infile='input.fits', option='T')
+            >>> 
+            >>> async def ftlist(infile):
+            >>>     with hsp.utils.pfiles_scope():
+            >>>         return await hsp.HSPTask('ftlist').acall(infile=infile, option='T')
+            >>> results = await asyncio.gather(*[ftlist(f) for f in files])
+        
+        Returns:
+            HSPResult
+        """
+        if not self._setup_call(args, kwargs):
+            return None
+        start = self._start_call()
+        try:
+            result = await self._arun_call()
+        except BaseException:
+            self._end_call(None, start)
+            raise
+        return self._end_call(result, start)
+    
+    
+    async def _arun_call(self):
+        """asyncio version of _run_call; see acall"""
+        import asyncio
+        cache_key, result = self._lookup_result()
+        if result is None and self._incremental:
+            result = self._skip_up_to_date()
+        if not result is None:
+            return result
+        
+        with self._phase('write_pfile'):
+            usr_pfile = self._write_user_pfile()
+        if type(self).exec_task is HSPTask.exec_task:
+            result = await self.aexec_task()
+        else:
+            # copy the context, so an active pfiles scope is seen by the executor
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, contextvars.copy_context().run, self.exec_task)
+        with self._phase('sync_pfile'):
+            result = self._sync_user_pfile(result, usr_pfile)
+        self._store_result(cache_key, result)
+        if self._incremental:
+            self._store_outputs(result)
+        return result
+    
+    
+    def stream(self, args=None, **kwargs):
+        """Call the task and iterate over its output lines as they are printed.
+        
+        This takes the same input as calling the task, and returns an HSPStream,
+        which yields (source, line) tuples, where source is 'stdout' or 'stderr',
+        and line is without the new line character. The output is also captured,
+        printed and logged as in a call, and when the iteration is done, the 
+        HSPResult is available in HSPStream.result.
+        
+        Leaving the iteration early (e.g. on a known error) and closing the 
+        stream kills the task. Using the stream as a context manager ensures 
+        this is done:
+        
+        Example:
+            >>> with hsp.HSPTask('nupipeline').stream(indir=indir, noprompt=True) as stream:
+            >>>     for source, line in stream:
+            >>>         if 'ERROR' in line:
+            >>>             break
+            >>> print(stream.result.returncode)
+        
+        The call options (e.g. timing, incremental, python_executor) work as in
+        a call. Python-only tasks that override exec_task, and python scripts 
+        run by python_executor, do not stream; their output lines are yielded 
+        once they return. So are those of a stored result (see result_cache) 
+        or of a call skipped by incremental.
+        
+        Returns:
+            HSPStream
+        """
+        return HSPStream(self, args, kwargs)
+    
+    
+    def _setup_call(self, args, kwargs):
+        """Process the input to a call of the task, and set self.params
+        
+        Args:
+            args, kwargs: the input to __call__
+        
+        Returns:
+            do_exec: whether the task should be executed
+        """
+        
         # assemble the user input, if any, into a dict
         if args is None:
             user_pars = {}
@@ -165,6 +432,23 @@ class HSPTask:
                       or isinstance(stderr, int) and stderr > 0)
         self.stderr = stderr
         
+        # incremental?
+        incremental = user_pars.get('incremental', False)
+        if not isinstance(incremental, bool):
+            incremental = ((isinstance(incremental, str) and incremental.strip().lower() in ['y', 'yes', 'true'])
+                           or isinstance(incremental, int) and incremental > 0)
+        self._incremental = incremental
+        
+        # timing?
+        timing = user_pars.get('timing', False)
+        if 'timing' in self.par_names:
+            # in case timing is task parameter, we look for py_timing
+            timing = user_pars.get('py_timing', False)
+        if not isinstance(timing, bool):
+            timing = ((isinstance(timing, str) and timing.strip().lower() in ['y', 'yes', 'true'])
+                      or isinstance(timing, int) and timing > 0)
+        self._timing = HSPTiming(getattr(self, '_init_phases', None)) if timing else None
+        
         # noprompt?
         noprompt = user_pars.get('noprompt', False)
         if 'noprompt' in self.par_names:
@@ -200,6 +484,15 @@ class HSPTask:
         if not isinstance(verbose, int):
             raise HSPTaskException(f'confusing verbose value. Allowed types are: bool, str or int')
         self._verbose = verbose
+        
+        # output policy?
+        output_policy = user_pars.get('output_policy', 'memory')
+        max_output    = user_pars.get('max_output', None)
+        if not output_policy in _OutputBuffer.policies:
+            raise HSPTaskException(f'output_policy has to be one of {_OutputBuffer.policies}')
+        if max_output is None:
+            max_output = _OutputBuffer.max_size
+        self._output_policy = (output_policy, int(max_output))
         # ----------------------------- #
         
         # prepare the logger #
@@ -235,7 +528,8 @@ class HSPTask:
         
         
         # now check the user input against expectations, and query if incomplete
-        usr_params = self.build_params(user_pars)
+        with self._phase('build_params'):
+            usr_params = self.build_params(user_pars)
         
         # create a dict for all model parameters
         params = {p:getattr(self, p).value for p in self.par_names}
@@ -244,35 +538,335 @@ class HSPTask:
         
         # do_exec is a hidden parameter used for debugging and testing
         # Set to True, unless we are testing and debugging.
-        do_exec = kwargs.get('do_exec', True)
-        if do_exec:
-            # disable prompt: https://heasarc.gsfc.nasa.gov/lheasoft/scripting.html
-            os.environ['HEADASNOQUERY'] = ''
-            os.environ['HEADASPROMPT'] = '/dev/null'
-            
-            # write new params to the user .par file
-            # do this before calling in case the task also updates the .par file
-            usr_pfile = HSPTask.find_pfile(self.taskname, return_user=True)
-            self.write_pfile(usr_pfile)
-            
-            # now call the task #
-            result = self.exec_task()
-            
-            # ensure we are returning the correct type
-            if not isinstance(result, HSPResult):
-                raise HSPTaskException(f'Returned result type {type(result)} is not HSPResult')
-            
-            
-            # re-read the pfile in case it has been modified by the task
-            # update only the the values in the HSPTask instance, not
-            #  result.params that will be returned to the user
-            if os.path.exists(usr_pfile):
-                params_after = HSPTask.read_pfile(usr_pfile)
-                for ipar, par_name in enumerate(self.par_names):
-                    setattr(self, par_name, params_after[ipar].value)
-                #result.params.update(self.params)
-                        
+        return kwargs.get('do_exec', True)
+    
+    
+    def _phase(self, name):
+        """A context manager recording a phase of the call in self._timing, if any"""
+        timing = getattr(self, '_timing', None)
+        return _no_timing if timing is None else timing.phase(name)
+    
+    
+    def _start_call(self):
+        """Run the pre_call hooks; see HSPHooks
+        
+        Returns:
+            the start time of the call, for _end_call
+        """
+        hooks.run('pre_call', self.taskname, self.params)
+        return time.perf_counter()
+    
+    
+    def _end_call(self, result, start):
+        """Attach the HSPTiming of the call to the result, if timing was 
+        requested, and run the post_call hooks
+        
+        Args:
+            result: the HSPResult of the call, or None if it raised an exception
+            start: the start time returned by _start_call
+        
+        Returns:
+            result
+        """
+        timing = getattr(self, '_timing', None)
+        if timing is not None and isinstance(result, HSPResult):
+            result.timing = timing
+        hooks.run('post_call', self.taskname, self.params, result, time.perf_counter() - start)
+        return result
+    
+    
+    def _write_user_pfile(self):
+        """Write the parameters to the user .par file before executing the task
+        
+        Returns:
+            the path to the user .par file
+        """
+        # disable prompt: https://heasarc.gsfc.nasa.gov/lheasoft/scripting.html
+        os.environ['HEADASNOQUERY'] = ''
+        os.environ['HEADASPROMPT'] = '/dev/null'
+        
+        # write new params to the user .par file
+        # do this before calling in case the task also updates the .par file
+        usr_pfile = self._user_pfile()
+        self.write_pfile(usr_pfile)
+        return usr_pfile
+    
+    
+    def _sync_user_pfile(self, result, usr_pfile):
+        """Check the result of exec_task and read back the user .par file
+        
+        Args:
+            result: the returned value of exec_task
+            usr_pfile: the user .par file written before executing the task
+        
+        Returns:
+            result
+        """
+        
+        # ensure we are returning the correct type
+        if not isinstance(result, HSPResult):
+            raise HSPTaskException(f'Returned result type {type(result)} is not HSPResult')
+        
+        
+        # re-read the pfile in case it has been modified by the task
+        # update only the the values in the HSPTask instance, not
+        #  result.params that will be returned to the user.
+        # This is skipped if the file is still what was written before the task
+        written = getattr(self, '_pfile_written', None)
+        if written is not None and written[0] == usr_pfile and self._pfile_unchanged(*written[:2]):
             return result
+        if os.path.exists(usr_pfile):
+            params_after = HSPTask.read_pfile(usr_pfile)
+            for ipar, par_name in enumerate(self.par_names):
+                setattr(self, par_name, params_after[ipar].value)
+            #result.params.update(self.params)
+                    
+        return result
+    
+    
+    def file_params(self, output=False):
+        """Return the input or output file parameters of the task
+        
+        In .par files, parameters of type f and fr are input files, and 
+        parameters of type fw are output files. Parameters of type f with a
+        name starting with out (e.g. outfile of ftlist, which is - for the 
+        screen) are output files too.
+        
+        Args:
+            output: If True, return the output files, otherwise the input files.
+        
+        Returns:
+            dict of {par_name: value}
+        """
+        params = {}
+        for par_name in self.par_names:
+            par = getattr(self, par_name)
+            if par.type in ('f', 'fr', 'fw') and _is_output_file(par) == output:
+                params[par_name] = par.value
+        return params
+    
+    
+    def outputs_up_to_date(self):
+        """Check if the output files of the task are newer than its input files
+        
+        The output and input files are given by file_params.
+        
+        Returns:
+            True if there is at least one output file, all the output files 
+            exist, and they are all newer than all the input files.
+        """
+        outputs, inputs = [], []
+        for files, output in [(outputs, True), (inputs, False)]:
+            for value in self.file_params(output).values():
+                paths = _file_paths(value)
+                if paths is None:
+                    return False
+                files += paths
+        if len(outputs) == 0:
+            return False
+        try:
+            oldest_output = min([os.stat(path).st_mtime_ns for path in outputs])
+            newest_input  = max([os.stat(path).st_mtime_ns for path in inputs], default=0)
+        except OSError:
+            return False
+        return newest_input < oldest_output
+    
+    
+    def _skip_up_to_date(self):
+        """Return a result without running the task if its outputs are up to date
+        
+        The outputs are up to date if they are newer than the inputs (see
+        outputs_up_to_date), and, unless HSPTask.outputs_cache is None, were
+        produced by a run of the task with the same parameter values.
+        
+        Returns:
+            HSPResult with cached=True, or None if the task needs to run
+        """
+        self._params_before = self._params_hash()
+        if not self.outputs_up_to_date():
+            return None
+        if self.outputs_cache is not None:
+            for path in self._output_paths():
+                value = self.outputs_cache.get(os.path.realpath(path))
+                try:
+                    stored = [] if value is None else json.loads(value)['params']
+                except (ValueError, KeyError, TypeError):
+                    stored = []
+                if not self._params_before in stored:
+                    return None
+        
+        # the .par file is written as in a run
+        self.write_pfile(self._user_pfile())
+        result = HSPResult(0, '', '' if self.stderr else None, self.params,
+                           {'skipped': 'output files are up to date'})
+        result.cached = True
+        return result
+    
+    
+    def _store_outputs(self, result):
+        """Store the hash of the parameters with the outputs of a successful run
+        
+        Both the parameters before the run and after it (a task may update
+        its own parameters) are stored, so either matches in the next call.
+        """
+        if self.outputs_cache is None or result.returncode != 0:
+            return
+        params = sorted({self._params_before, self._params_hash()})
+        value  = json.dumps({'task': self.taskname, 'params': params}).encode()
+        for path in self._output_paths():
+            self.outputs_cache.put(os.path.realpath(path), value)
+    
+    
+    def _output_paths(self):
+        """The local output files of the call; see file_params"""
+        paths = []
+        for value in self.file_params(output=True).values():
+            paths += _file_paths(value) or []
+        return paths
+    
+    
+    def _params_hash(self):
+        """A hash of the task name and the values of all its parameters"""
+        values = [self.taskname] + [(par_name, str(getattr(self, par_name).value))
+                                    for par_name in self.par_names]
+        return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+    
+    
+    def _lookup_result(self):
+        """Look for the result of the current call in HSPTask.result_cache
+        
+        The key is built from the task name, the parameter values, and a 
+        fingerprint of the input files (see file_params). Calls of tasks that
+        are not allowed by the cache, with input files that cannot be 
+        identified, or that write output files (other than to the screen, 
+        e.g. outfile='-'), are not cached.
+        
+        Returns:
+            (key, result): key is None if the call cannot be cached, and 
+                result is None if it was not found
+        """
+        cache = self.result_cache
+        if cache is None or not cache.allows(self.taskname, self.params):
+            return None, None
+        output_policy = getattr(self, '_output_policy', None)
+        if output_policy and output_policy[0] != 'memory':
+            return None, None
+        # a stored result would not write the output files
+        for value in self.file_params(output=True).values():
+            if _file_paths(value) != []:
+                return None, None
+        
+        files = []
+        for value in self.file_params().values():
+            paths = _file_paths(value)
+            if paths is None:
+                return None, None
+            for path in paths:
+                try:
+                    # recently modified files may change again within the same mtime
+                    if _is_racy(os.stat(path)):
+                        return None, None
+                    files.append(cache.file_fingerprint(path))
+                except OSError:
+                    return None, None
+        
+        key = json.dumps({
+            'task'   : self.taskname,
+            'headas' : os.path.realpath(os.environ.get('HEADAS', '')),
+            'stderr' : self.stderr,
+            'params' : [(par_name, str(getattr(self, par_name).value)) 
+                        for par_name in self.par_names],
+            'files'  : files
+        })
+        
+        value = cache.get_result(key)
+        if value is None or value.get('key') != key:
+            return key, None
+        
+        # restore the state after the stored run: parameters and user .par file
+        for par_name, par_value in value['params_after'].items():
+            if par_name in self.par_names:
+                setattr(self, par_name, par_value)
+        self.write_pfile(self._user_pfile())
+        
+        # print and log the output as if the task ran
+        capture = _OutputCapture(self.stderr, self._verbose, self._logfile)
+        try:
+            capture.add(value['stdout'].encode())
+            if value['stderr']:
+                capture.add(value['stderr'].encode(), True)
+        finally:
+            capture.close()
+        
+        result = HSPResult(value['returncode'], value['stdout'], value['stderr'], value['params'])
+        result.cached = True
+        return key, result
+    
+    
+    def _store_result(self, key, result):
+        """Store a successful result in HSPTask.result_cache under key (from _lookup_result)"""
+        if key is None or self.result_cache is None or result.returncode != 0:
+            return
+        self.result_cache.put_result(key, {
+            'key'          : key,
+            'returncode'   : result.returncode,
+            'stdout'       : result.stdout,
+            'stderr'       : result.stderr,
+            'params'       : result.params,
+            'params_after' : {par_name: getattr(self, par_name).value 
+                              for par_name in self.par_names}
+        })
+    
+    
+    def map(self, params_list, max_workers=None, raise_errors=False, **kwargs):
+        """Run the task for many sets of parameters concurrently.
+        
+        Each set of parameters is run by a new instance of the task, and the
+        instances run in a pool of threads, each calling exec_task. Every run
+        is inside its own utils.pfiles_scope, so concurrent runs do not 
+        overwrite each other's parameters.
+        
+        Parameters are not queried in the threads, so params_list should have
+        all the required parameters, or noprompt=True should be used.
+        
+        
+        Args:
+            params_list: a list of dict, each with the task parameters of one run.
+            max_workers: the maximum number of concurrent runs. Default is 
+                the number of CPUs.
+            raise_errors: If True, raise the first exception from any of the runs,
+                after all the runs are done. If False (default), a failed run returns 
+                an HSPResult with returncode=-1, the error message in stderr, and 
+                the exception in custom['exception'].
+            **kwargs: parameters common to all runs (e.g. verbose, noprompt). The 
+                values in params_list take priority.
+        
+        Returns:
+            A list of HSPResult in the same order as params_list
+        
+        """
+        
+        def _run(params):
+            task = type(self)(name=self.taskname)
+            user_pars = dict(kwargs)
+            user_pars.update(params)
+            with _pfiles_pool.scope():
+                return task(dict(self.params), **user_pars)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_run, params) for params in params_list]
+            concurrent.futures.wait(futures)
+        
+        results = []
+        for params, future in zip(params_list, futures):
+            exc = future.exception()
+            if exc is None:
+                results.append(future.result())
+            elif raise_errors:
+                raise exc
+            else:
+                results.append(HSPResult(-1, '', str(exc), params, {'exception': exc}))
+        return results
     
     
     def exec_task(self):
@@ -291,14 +885,114 @@ class HSPTask:
         
         """
         
-        # Get the task parameters
-        usr_params = self.params
-        
         verbose = self._verbose
         
         # do we have stderr?
         stderr = subprocess.PIPE if self.stderr else subprocess.STDOUT
         
+        cmd_list, usr_params = self._exec_command()
+        if self.python_executor is not None and cmd_list[0] == 'python':
+            return self._exec_python_executor(cmd_list, usr_params)
+        timing = getattr(self, '_timing', None)
+        with self._phase('popen'):
+            proc = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=stderr, env=self._task_env())
+        
+        # ---------------------------------------------------- #
+        # if verbose, we need to both print and capture output #
+        # keeping track of stdout and stderr                   #
+        # pass this to handle_io_stream to deal with it        #
+        # ---------------------------------------------------- #
+        # the output is also streamed when it is not all kept in memory,
+        # or when timing, to see the first output
+        output_policy = getattr(self, '_output_policy', None)
+        if verbose > 0 or (output_policy and output_policy[0] != 'memory') or timing is not None:
+            proc_out, proc_err = HSPTask.handle_io_stream(proc, self.stderr, verbose, 
+                                                          self._logfile, output_policy, timing)
+            if timing is None:
+                proc.wait() # needed to ensure the returncode is set correctly
+            else:
+                timing.wait(proc)
+        else:
+            proc_out, proc_err = proc.communicate()
+            if isinstance(proc_out, bytes): proc_out = proc_out.decode()
+            if isinstance(proc_err, bytes): proc_err = proc_err.decode()
+        # ---------------------------------------------------- #
+        
+        return HSPResult(proc.returncode, proc_out, proc_err, usr_params)
+    
+    
+    async def aexec_task(self):
+        """asyncio version of exec_task for heasoft tasks; used by acall
+        
+        Returns:
+            HSPResult
+        
+        """
+        
+        # asyncio is slow to import, so it is only imported by acall
+        import asyncio
+        
+        # do we have stderr?
+        stderr = asyncio.subprocess.PIPE if self.stderr else asyncio.subprocess.STDOUT
+        
+        cmd_list, usr_params = self._exec_command()
+        if self.python_executor is not None and cmd_list[0] == 'python':
+            loop = asyncio.get_running_loop()
+            # copy the context, so an active pfiles scope is seen by _task_env
+            return await loop.run_in_executor(None, contextvars.copy_context().run,
+                                              self._exec_python_executor, cmd_list, usr_params)
+        timing = getattr(self, '_timing', None)
+        with self._phase('popen'):
+            proc = await asyncio.create_subprocess_exec(*cmd_list, stdout=asyncio.subprocess.PIPE, 
+                                                        stderr=stderr, env=self._task_env())
+        proc_out, proc_err = await HSPTask.ahandle_io_stream(proc, self.stderr, self._verbose, 
+                                                             self._logfile, self._output_policy, timing)
+        await proc.wait()
+        if timing is not None:
+            # the process is reaped by asyncio, so there is no resource usage
+            timing.mark('exit')
+        
+        return HSPResult(proc.returncode, proc_out, proc_err, usr_params)
+    
+    
+    def _exec_python_executor(self, cmd_list, usr_params):
+        """Run a python task script with self.python_executor
+        
+        The output is returned once the script is done, and is then printed 
+        and logged as requested by verbose.
+        
+        Args:
+            cmd_list, usr_params: the output of _exec_command
+        
+        Returns:
+            HSPResult
+        
+        """
+        returncode, out, err = self.python_executor.run(
+            cmd_list[1], cmd_list[2:], env=self._task_env(), stderr=self.stderr)
+        
+        capture = _OutputCapture(self.stderr, self._verbose, self._logfile, 
+                                 getattr(self, '_output_policy', None))
+        try:
+            capture.add(out)
+            if err:
+                capture.add(err, True)
+        finally:
+            capture.close()
+        proc_out, proc_err = capture.result()
+        return HSPResult(returncode, proc_out, proc_err, usr_params)
+    
+    
+    def _exec_command(self):
+        """Construct the command line of a heasoft task from self.params
+        
+        Returns:
+            (cmd_list, usr_params): the command as a list, and the parameters
+        
+        """
+        # Get the task parameters
+        usr_params = self.params
+        
         # construct a parameter list
         for par in usr_params.keys():
             if isinstance(usr_params[par], bool):
@@ -325,23 +1019,41 @@ class HSPTask:
             
         
         cmd_list = exec_cmd + cmd_params
-        proc = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=stderr, env=os.environ.copy())
+        return cmd_list, usr_params
+    
+    
+    def _private_pfiles_dir(self):
+        """The private pfiles directory of the task or of the active pfiles scope, or None"""
+        if self._pfiles_dir is None:
+            return _active_pfiles_dir.get()
+        return self._pfiles_dir
+    
+    
+    def _user_pfile(self):
+        """The user .par file where the task parameters are written"""
+        pfiles_dir = self._private_pfiles_dir()
+        if pfiles_dir is None:
+            return HSPTask.find_pfile(self.taskname, return_user=True)
+        return os.path.join(pfiles_dir, f'{self.taskname}.par')
+    
+    
+    def _task_env(self):
+        """The environment of the task subprocess
         
-        # ---------------------------------------------------- #
-        # if verbose, we need to both print and capture output #
-        # keeping track of stdout and stderr                   #
-        # pass this to handle_io_stream to deal with it        #
-        # ---------------------------------------------------- #
-        if verbose > 0:
-            proc_out, proc_err = HSPTask.handle_io_stream(proc, self.stderr, verbose, self._logfile)
-            proc.wait() # needed to ensure the returncode is set correctly
-        else:
-            proc_out, proc_err = proc.communicate()
-            if isinstance(proc_out, bytes): proc_out = proc_out.decode()
-            if isinstance(proc_err, bytes): proc_err = proc_err.decode()
-        # ---------------------------------------------------- #
+        If the task has a private pfiles directory, it is used for the user 
+        part of PFILES, followed by the system pfiles. os.environ is not modified.
         
-        return HSPResult(proc.returncode, proc_out, proc_err, usr_params)
+        """
+        env = os.environ.copy()
+        pfiles_dir = self._private_pfiles_dir()
+        if not pfiles_dir is None:
+            pfiles = env.get('PFILES', '')
+            if ';' in pfiles:
+                sys_pfiles = pfiles.split(';')[-1]
+            else:
+                sys_pfiles = os.path.join(env['HEADAS'], 'syspfiles')
+            env['PFILES'] = f'{pfiles_dir};{sys_pfiles}'
+        return env
     
     
     def task_docs(self):
@@ -352,6 +1064,10 @@ class HSPTask:
         provide a task_docs method that return a string with the
         docs.
         
+        The fhelp text is kept in HSPTask.docs_cache, a persistent cache 
+        (see heasoftpy.cache), so fhelp runs only once per task and help file.
+        Set HSPTask.docs_cache to None to always call fhelp.
+        
         
         Return:
             str of documentation
@@ -359,6 +1075,15 @@ class HSPTask:
         """
         name = self.taskname
         
+        # check the cache first #
+        docs_cache = HSPTask.docs_cache
+        if not docs_cache is None:
+            cache_key = HSPTask._docs_cache_key(name)
+            fhelp = docs_cache.get(cache_key)
+            if not fhelp is None:
+                return fhelp.decode()
+        # ---------------------- #
+        
         # call fhelp; assume HEADAS is defined #
         cmd  = os.path.join(os.environ['HEADAS'], 'bin/fhelp')
         try:
@@ -385,12 +1110,45 @@ class HSPTask:
         except:
             # we can be more specific in trapping
             fhelp = f'No fhelp text was generated for {name}'
+            docs_cache = None
         fhelp.replace('"""', '')
         # ------------------------------------- #
         
+        # failures are not cached
+        if not docs_cache is None:
+            docs_cache.put(cache_key, fhelp.encode())
+        
         return fhelp
     
     
+    @staticmethod
+    def _docs_cache_key(name):
+        """Key of the fhelp text of a task in the docs cache
+        
+        The key includes the HEASoft installation and, if found, the mtime
+        and size of the help file of the task, so the cached text is 
+        refreshed when either changes. Workers without a help tree fall
+        back to the installation only.
+        
+        """
+        headas = os.path.realpath(os.environ['HEADAS'])
+        help_dirs = [os.environ.get('LHEA_HELP', None), os.path.join(headas, 'help')]
+        stamp = ''
+        for hdir in help_dirs:
+            if hdir is None:
+                continue
+            for ext in ['.html', '.txt', '.hlp', '.py.html', '.py.txt']:
+                try:
+                    st = os.stat(os.path.join(hdir, f'{name}{ext}'))
+                except OSError:
+                    continue
+                stamp = f'{hdir}/{name}{ext}:{st.st_mtime_ns}:{st.st_size}'
+                break
+            if stamp:
+                break
+        return f'fhelp:{name}:{headas}:{stamp}'
+    
+    
     def build_params(self, user_pars):
         """Check the user given parameters agains the expectation from the .par file.
 
@@ -464,7 +1222,7 @@ class HSPTask:
         
         # write the updated parameter list #
         defaults = self.default_params
-        ptxt = ''
+        lines = []
         for par_name in self.par_names:
             par = getattr(self, par_name)
             
@@ -477,12 +1235,63 @@ class HSPTask:
                 val = f'"{val}"'
             
             # write #
-            ptxt += (f'{par.pname},{par.type},{par.mode},'
-                     f'{val},{par.min},{par.max},\"{par.prompt}\"\n')
-            
-        with open(pfile, 'w') as pf:
-            pf.write(ptxt)
+            lines.append(f'{par.pname},{par.type},{par.mode},'
+                         f'{val},{par.min},{par.max},\"{par.prompt}\"\n')
+        ptxt = ''.join(lines)
+        self._pfile_written = (pfile, ptxt, lines)
+        
+        # nothing to do if the file has this content already
+        if self._pfile_unchanged(pfile, ptxt):
+            return
+        
+        # write a temporary file and rename it, so readers never see a partial file
+        tmpfile = f'{pfile}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmpfile, 'w') as pf:
+                pf.write(ptxt)
+            os.replace(tmpfile, pfile)
+        except BaseException:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+        st = os.stat(pfile)
+        self._pfile_state = (pfile, _stat_key(st), ptxt, not _is_racy(st))
         # -------------------------------- #
+    
+    
+    def _pfile_unchanged(self, pfile, ptxt):
+        """Check if pfile has the content ptxt
+        
+        When the file has not changed since it was last written or checked 
+        by this task (same mtime, size and inode), its content is known, and 
+        the file is not read. This is trusted only if the file was already 
+        older than _RACY_WINDOW_NS then, as a write in the same mtime tick 
+        (e.g. by the task, just after write_pfile) may keep the stat; the 
+        content is compared otherwise.
+        
+        Args:
+            pfile: path to the .par file
+            ptxt: the expected content
+        
+        Returns:
+            True if the content of pfile is ptxt
+        """
+        try:
+            st = os.stat(pfile)
+        except OSError:
+            return False
+        
+        state = getattr(self, '_pfile_state', None)
+        if state is not None and state[:2] == (pfile, _stat_key(st)) and state[3]:
+            return state[2] == ptxt
+        
+        try:
+            with open(pfile) as fp:
+                content = fp.read()
+        except OSError:
+            return False
+        self._pfile_state = (pfile, _stat_key(st), content, not _is_racy(st))
+        return content == ptxt
         
         
     @staticmethod
@@ -516,103 +1325,189 @@ class HSPTask:
     
     
     @staticmethod
-    def find_pfile(name, return_user=False):
-        """search for an return the .par file for the task
-        
-        Args:
-            name: Name of the task, so the pfile is {name}.par
-            return_user: return the user pfile, even if it doesn't exist
-                User pfile is the taken from the first entry to PFILES
+    def pfile_cache_info():
+        """Return information about the cache of parsed .par files
         
         Returns:
-            the path to the {name}.par pfile
+            dict with the number of hits, misses, the cached files and
+            the maximum size of the cache.
         
         """
+        return _pfile_cache.info()
+    
+    
+    @staticmethod
+    def clear_pfile_cache(maxsize=None):
+        """Clear the cache of parsed .par files
         
-        if 'HEADAS' in os.environ:
-            sys_pfile = os.path.join(os.environ['HEADAS'], 'syspfiles', f'{name}.par')
-        else:
-            raise HSPTaskException('HEADAS not defined. Please initialize Heasoft!')
-            
-        # split on both (:,;)
-        pfiles = re.split(';|:', os.environ['PFILES'])
+        Args:
+            maxsize: if not None, also set the maximum number of .par files
+                to keep in the cache. 0 disables the cache.
         
-        # check a .par file exists anywhere
-        found = False
-        for pf in pfiles:
-            if os.path.exists(os.path.join(pf, f'{name}.par')):
-                found = True
-                break
-        if not found:
-            raise HSPTaskException(f'No .par file found for task {name}')
+        """
+        _pfile_cache.clear(maxsize)
+    
+    
+    @staticmethod
+    def find_pfile(name, return_user=False):
+        """search for an return the .par file for the task
         
-        # parameter file to read
-        pfile_to_read = os.path.join(pf, f'{name}.par')
+        Args:
+            name: Name of the task, so the pfile is {name}.par
+            return_user: return the user pfile, even if it doesn't exist
+                User pfile is the taken from the first entry to PFILES
         
-        # parameter file where to save the task parameters
-        if pfiles[0] == sys_pfile:
-            # use ~/pfiles 
-            out_pdir = os.path.expanduser('~/pfiles')
-        else:
-            # use the first entry (other than sys_pfile) in PFILES
-            out_pdir = pfiles[0]
-
-        if not os.path.isdir(out_pdir):
-            os.mkdir(out_pdir)
-        pfile_to_write = f'{out_pdir}/{name}.par'
-    
+        Returns:
+            the path to the {name}.par pfile
+        
+        """
+        pfile_to_read, pfile_to_write = _pfile_resolver.resolve(name)
         
         # if return_user, we should never return sys_pfile because, now we preparing to write
         pfile = pfile_to_write if return_user else pfile_to_read        
         return pfile
     
+    
     @staticmethod
-    def handle_io_stream(proc, stderr, verbose, logfile):
+    def resolve_pfile(name):
+        """Return both the .par file to read and the user .par file to write
+        
+        This is the same as calling find_pfile with return_user=False and
+        return_user=True, but with a single lookup.
+        
+        Args:
+            name: Name of the task, so the pfile is {name}.par
+        
+        Returns:
+            (pfile_to_read, pfile_to_write)
+        
         """
+        return _pfile_resolver.resolve(name)
+    
+    
+    @staticmethod
+    def handle_io_stream(proc, stderr, verbose, logfile, output_policy=None, timing=None):
+        """Capture the output of a running task, printing it to the screen 
+        and logfile as requested by verbose.
+        
+        The output is kept as raw bytes chunks and decoded once at the end;
+        text printed to the screen is decoded incrementally, and screen and 
+        logfile writes are batched (see _OutputCapture).
 
         Args:
             proc: proc from subprocess or sys; i.e. it has proc.stdout and proc.stderr
             stderr: bool user input of whether to use stderr or not
+            verbose: the verbose value of the task call
+            logfile: a log file name, or None
+            output_policy: (policy, max_output) to store the output; see __call__.
+                None to keep it all in memory
+            timing: an HSPTiming where the time of the first output is marked, or None
+        
+        Returns:
+            (proc_out, proc_err): str output, or _OutputBuffer if the output is
+                not all kept in memory; proc_err is None if not stderr
 
+        """
+        capture = _OutputCapture(stderr, verbose, logfile, output_policy)
+        try:
+            chunks = HSPTask._read_io_stream(proc, stderr, capture)
+            if timing is not None:
+                for _ in chunks:
+                    timing.mark('first_output')
+                    break
+            for _ in chunks:
+                pass
+        finally:
+            capture.close()
+        return capture.result()
+    
+    
+    @staticmethod
+    def _read_io_stream(proc, stderr, capture):
+        """Read the output of a running task until all its streams are closed
+        
+        This is a generator that yields (is_err, chunk) for every chunk of bytes
+        read, after it is added to capture.
+        
+        Args:
+            proc: proc from subprocess or sys; i.e. it has proc.stdout and proc.stderr
+            stderr: bool user input of whether to use stderr or not
+            capture: an _OutputCapture instance
+        
         """
         # selectors handle multiple io streams
         # https://stackoverflow.com/questions/31833897/python-read-from-subprocess-stdout-and-stderr-separately-while-preserving-order
         selector = selectors.DefaultSelector()
-        selector.register(proc.stdout, selectors.EVENT_READ)
-        outBuf = io.StringIO()
-        if stderr:
-            selector.register(proc.stderr, selectors.EVENT_READ)
-            errBuf = io.StringIO()
-        file = None
-        if not logfile is None:
-            file = open(logfile, 'a')
-
-        # while task is running, print/capture output #
-        done = False
-        while not done:
-            for key, _ in selector.select():
-                line = key.fileobj.read1().decode()
-                if not line:
-                    done = True
-                if not stderr or key.fileobj is proc.stdout:
-                    if verbose != 20: sys.stdout.write(line)
-                    outBuf.write(line)
-                    if file: file.write(line)
-                else:
-                    if verbose != 20: sys.stderr.write(line)
-                    errBuf.write(line)
-                    if file: file.write(line)
-        proc_out = outBuf.getvalue()
-        outBuf.close()
-        proc_err = None
+        selector.register(proc.stdout, selectors.EVENT_READ, False)
         if stderr:
-            proc_err = errBuf.getvalue()
-            errBuf.close()
-        if file:
-            file.close()
-        return proc_out, proc_err    
+            selector.register(proc.stderr, selectors.EVENT_READ, True)
+        
+        try:
+            # while task is running, print/capture output #
+            # a stream is done when it reaches EOF; wait for all of them
+            while selector.get_map():
+                events = selector.select(capture.flush_timeout())
+                if not events:
+                    # nothing new; print what is pending
+                    capture.flush()
+                for key, _ in events:
+                    chunk = os.read(key.fileobj.fileno(), _OutputCapture.chunk_size)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    capture.add(chunk, key.data)
+                    yield key.data, chunk
+        finally:
+            selector.close()
     
         
+    @staticmethod
+    async def ahandle_io_stream(proc, stderr, verbose, logfile, output_policy=None, timing=None):
+        """asyncio version of handle_io_stream
+        
+        Capture the output of an asyncio subprocess, printing it to the screen 
+        and logfile as requested by verbose, as in handle_io_stream.
+        
+        Args:
+            proc: an asyncio.subprocess.Process
+            stderr: bool user input of whether to use stderr or not
+            verbose: the verbose value of the task call
+            logfile: a log file name, or None
+            output_policy: (policy, max_output) to store the output; see __call__
+            timing: an HSPTiming where the time of the first output is marked, or None
+        
+        Returns:
+            (proc_out, proc_err): as in handle_io_stream
+        
+        """
+        import asyncio
+        capture = _OutputCapture(stderr, verbose, logfile, output_policy)
+        
+        async def _read(stream, is_err):
+            while True:
+                timeout = capture.flush_timeout()
+                try:
+                    chunk = await asyncio.wait_for(stream.read(_OutputCapture.chunk_size), timeout)
+                except asyncio.TimeoutError:
+                    # nothing new; print what is pending
+                    capture.flush()
+                    continue
+                if not chunk:
+                    break
+                if timing is not None and not 'first_output' in timing.marks:
+                    timing.mark('first_output')
+                capture.add(chunk, is_err)
+        
+        readers = [_read(proc.stdout, False)]
+        if stderr:
+            readers.append(_read(proc.stderr, True))
+        try:
+            await asyncio.gather(*readers)
+        finally:
+            capture.close()
+        return capture.result()
+    
+    
     def _generate_fcn_docs(self, fhelp=False):
         """Generation standard function docstring from .par file
 
@@ -663,7 +1558,7 @@ import sys
 import os
 import subprocess
 
-from ..core import HSPTask, HSPTaskException
+from ..core import HSPTask, HSPTaskException, _task_pool
 
 
 def {task_pyname}(args=None, **kwargs):
@@ -671,8 +1566,8 @@ def {task_pyname}(args=None, **kwargs):
 {docs}
     \"""
 
-    {task_pyname}_task = HSPTask(name="{task_name}")
-    return {task_pyname}_task(args, **kwargs)
+    with _task_pool.task("{task_name}") as {task_pyname}_task:
+        return {task_pyname}_task(args, **kwargs)
 
         """
 
@@ -680,6 +1575,772 @@ def {task_pyname}(args=None, **kwargs):
     
     
 
+class _PfileCache:
+    """A process-wide LRU cache of parsed .par files.
+    
+    The parsed parameters are stored by path, and validated against the
+    (mtime, size) of the file. A .par file modified within the last
+    _RACY_WINDOW_NS is parsed but not cached, because on file systems with 
+    coarse time stamps, two quick writes are not distinguishable.
+    
+    """
+    
+    def __init__(self, maxsize=256):
+        self.maxsize  = maxsize
+        self._entries = OrderedDict()
+        self._lock    = threading.Lock()
+        self.hits     = 0
+        self.misses   = 0
+        
+    
+    def get(self, pfile):
+        """Return a fresh copy of the parameters in pfile
+        
+        Args:
+            pfile: full path to .par file
+            
+        Returns:
+            a list of HSPParam
+        
+        """
+        path = os.path.abspath(pfile)
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise IOError(f'parameter file {pfile} not found')
+        key = (st.st_mtime_ns, st.st_size)
+        
+        with self._lock:
+            entry = self._entries.get(path, None)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return [par.copy() for par in entry[1]]
+            self.misses += 1
+        
+        # parse outside the lock; the template is a copy of the returned list
+        params = HSPTask.read_pfile(path)
+        if self.maxsize > 0 and not _is_racy(st):
+            with self._lock:
+                self._entries[path] = (key, [par.copy() for par in params])
+                self._entries.move_to_end(path)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return params
+    
+    
+    def info(self):
+        """Return a dict summarizing the cache content"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 
+                    'maxsize': self.maxsize, 'files': list(self._entries.keys())}
+    
+    
+    def clear(self, maxsize=None):
+        """Empty the cache, and reset its counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits   = 0
+            self.misses = 0
+            if not maxsize is None:
+                self.maxsize = maxsize
+
+
+class _PfileResolver:
+    """Resolve the .par files of tasks from the directories in PFILES.
+    
+    The .par files in every directory in PFILES are listed once into an index.
+    The index of a directory is re-built when its mtime changes, and the whole
+    resolver is reset when PFILES or HEADAS change. Directories modified too
+    recently for their mtime to be trusted (e.g. the user pfiles directory,
+    written by every call) are not listed; the file is looked up directly.
+    
+    """
+    
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._env      = None
+        self._pdirs    = []
+        self._out_pdir = None
+        self._out_ready = False
+        self._index    = {}
+    
+    
+    def resolve(self, name):
+        """Find the .par file to read and the user .par file to write for a task
+        
+        Args:
+            name: Name of the task, so the pfile is {name}.par
+        
+        Returns:
+            (pfile_to_read, pfile_to_write)
+        
+        """
+        if not 'HEADAS' in os.environ:
+            raise HSPTaskException('HEADAS not defined. Please initialize Heasoft!')
+        if not 'PFILES' in os.environ:
+            raise HSPTaskException('PFILES not defined. Please initialize Heasoft!')
+        
+        env = (os.environ['HEADAS'], os.environ['PFILES'])
+        with self._lock:
+            if env != self._env:
+                self._reset(env)
+            pdirs, out_pdir = self._pdirs, self._out_pdir
+        
+        # check a .par file exists anywhere; only directories up to the 
+        # first match are checked, as later ones cannot change the result
+        fname = f'{name}.par'
+        for pdir in pdirs:
+            if self._contains(pdir, fname):
+                break
+        else:
+            raise HSPTaskException(f'No .par file found for task {name}')
+        
+        # parameter file to read
+        pfile_to_read = os.path.join(pdir, fname)
+        
+        # parameter file where to save the task parameters
+        # the output directory is created once per PFILES value
+        if not self._out_ready:
+            # lookups may run concurrently, from several threads
+            os.makedirs(out_pdir, exist_ok=True)
+            self._out_ready = True
+        pfile_to_write = f'{out_pdir}/{fname}'
+        
+        return pfile_to_read, pfile_to_write
+    
+    
+    def _reset(self, env):
+        """Split PFILES and find the output directory for a new environment"""
+        headas, pfiles = env
+        sys_pdir = os.path.join(headas, 'syspfiles')
+        
+        # split on both (:,;)
+        pdirs = re.split(';|:', pfiles)
+        
+        # parameter file where to save the task parameters
+        if os.path.normpath(pdirs[0]) == os.path.normpath(sys_pdir):
+            # use ~/pfiles 
+            out_pdir = os.path.expanduser('~/pfiles')
+        else:
+            # use the first entry (other than sys_pfile) in PFILES
+            out_pdir = pdirs[0]
+        
+        self._env      = env
+        self._pdirs    = pdirs
+        self._out_pdir = out_pdir
+        self._out_ready = False
+        self._index    = {}
+    
+    
+    def _contains(self, pdir, fname):
+        """Check if the .par file fname is in pdir, re-listing pdir if it changed"""
+        try:
+            st = os.stat(pdir)
+            mtime = st.st_mtime_ns
+        except OSError:
+            return False
+        
+        entry = self._index.get(pdir, None)
+        if entry is not None and entry[0] == mtime:
+            return fname in entry[1]
+        
+        # a directory that is still changing would be listed on every lookup
+        if _is_racy(st):
+            return os.path.exists(os.path.join(pdir, fname))
+        try:
+            names = frozenset(f for f in os.listdir(pdir) if f.endswith('.par'))
+        except OSError:
+            return False
+        self._index[pdir] = (mtime, names)
+        return fname in names
+    
+    
+class _PfilesPool:
+    """A pool of private pfiles directories used by utils.pfiles_scope.
+    
+    Directories are emptied and kept for reuse when a scope ends, to avoid
+    creating and removing directories under high concurrency. All directories
+    are under one temporary directory that is removed at exit. A forked child
+    process starts with a new pool.
+    
+    """
+    
+    def __init__(self, max_free=32):
+        self.max_free  = max_free
+        self._lock     = threading.Lock()
+        self._base_dir = None
+        self._free     = []
+    
+    
+    def acquire(self):
+        """Return an empty pfiles directory"""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            if self._base_dir is None:
+                self._base_dir = tempfile.mkdtemp(prefix='heasoftpy.pfiles.')
+                atexit.register(shutil.rmtree, self._base_dir, True)
+            base_dir = self._base_dir
+        return tempfile.mkdtemp(dir=base_dir)
+    
+    
+    def release(self, pdir):
+        """Empty pdir and return it to the pool"""
+        for entry in os.scandir(pdir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, True)
+            else:
+                os.remove(entry.path)
+        with self._lock:
+            if len(self._free) < self.max_free and pdir.startswith(str(self._base_dir)):
+                self._free.append(pdir)
+                return
+        shutil.rmtree(pdir, True)
+    
+    
+    @contextlib.contextmanager
+    def scope(self):
+        """Context manager that makes a pfiles directory from the pool active"""
+        pdir  = self.acquire()
+        token = _active_pfiles_dir.set(pdir)
+        try:
+            yield pdir
+        finally:
+            _active_pfiles_dir.reset(token)
+            self.release(pdir)
+    
+    
+    def _after_fork(self):
+        """The child of a fork does not share directories with its parent"""
+        self._lock     = threading.Lock()
+        self._base_dir = None
+        self._free     = []
+
+
+class _TaskPool:
+    """Per-thread HSPTask instances reused by the task wrappers in heasoftpy.fcn.
+    
+    Creating an HSPTask finds and copies its parameters and builds its 
+    docstring; a wrapper instead takes the instance of its task kept for the 
+    current thread, reset to its defaults (see HSPTask.reset). An instance 
+    is taken out of the pool while it is used, so a nested call of the same 
+    task (e.g. from a hook) gets a new one.
+    
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+    
+    
+    @contextlib.contextmanager
+    def task(self, name):
+        """Context manager that returns an HSPTask for name, ready for a call"""
+        tasks = self._local.__dict__.setdefault('tasks', {})
+        task  = tasks.pop(name, None)
+        if task is None:
+            task = HSPTask(name=name)
+        else:
+            task.reset()
+        try:
+            yield task
+        finally:
+            tasks[name] = task
+
+
+# files modified more recently than this (in ns) are not trusted by the caches 
+_RACY_WINDOW_NS = 2 * 10**9
+
+def _is_racy(st):
+    """Check if a file stat is too recent for its mtime to identify the content"""
+    return time.time_ns() - st.st_mtime_ns < _RACY_WINDOW_NS
+
+def _stat_key(st):
+    """The part of a file stat that changes when the file is modified"""
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _pfile_source(pfile):
+    """(pfile, stat key) identifying the content of a .par file, or None if
+    the file was modified too recently for its stat to identify it"""
+    try:
+        st = os.stat(pfile)
+    except OSError:
+        return None
+    return None if _is_racy(st) else (pfile, _stat_key(st))
+
+def _is_output_file(par):
+    """True if the file parameter par is an output file; see HSPTask.file_params"""
+    return par.type == 'fw' or (par.type == 'f' and par.pname.lower().startswith('out'))
+
+def _file_names(value):
+    """Parse the names of the local files in the value of a file parameter
+    
+    This handles cfitsio extension and filter specifications (file.fits[1], 
+    file.fits+1), the clobber prefix (!file.fits) and list files (@files.txt, 
+    and the files listed in it if it exists). The files are not required to
+    exist, e.g. for the outputs of the steps of a pipeline.
+    
+    Args:
+        value: the value of a file parameter
+    
+    Returns:
+        a list of names, empty for no file (e.g. NONE, or - and STDOUT for 
+        the screen), or None if the value is not a local file (e.g. a URL)
+    """
+    value = str(value).strip()
+    if value.upper() in ['', 'NONE', 'INDEF', '-', 'STDIN', 'STDOUT'] or value == '$( )':
+        return []
+    if value.startswith('!'):
+        value = value[1:]
+    if '://' in value:
+        return None
+    
+    if value.startswith('@'):
+        list_file = value[1:]
+        names = [list_file]
+        try:
+            with open(list_file) as fp:
+                lines = [line.strip() for line in fp if line.strip()]
+        except OSError:
+            return names
+        for line in lines:
+            sub_names = _file_names(line)
+            if sub_names is None:
+                return None
+            names += sub_names
+        return names
+    
+    return [_ext_re.sub('', value.split('[', 1)[0])]
+
+_ext_re = re.compile(r'\+\d+$')
+
+def _file_paths(value):
+    """Return the existing local files in the value of a file parameter
+    
+    Args:
+        value: the value of a file parameter; see _file_names
+    
+    Returns:
+        a list of paths, empty for no file, or None if the value is not a 
+        local file (e.g. a URL), or one of its files does not exist
+    """
+    paths = _file_names(value)
+    if paths is None or not all([os.path.exists(path) for path in paths]):
+        return None
+    return paths
+
+class _OutputCapture:
+    """Collect the output streams of a task, echoing them to the screen and a log file
+    
+    The output is kept as a list of bytes chunks per stream, and only joined 
+    and decoded once when the task is done. Text for the screen is decoded 
+    with an incremental decoder, so multi-byte characters split between 
+    chunks are handled. Screen and log writes are batched: pending output 
+    is written when it reaches flush_size bytes, or when flush_interval 
+    seconds have passed since the last write.
+    
+    """
+    
+    chunk_size     = 65536
+    flush_size     = 256 * 1024
+    flush_interval = 0.05
+    
+    def __init__(self, stderr, verbose, logfile, output_policy=None):
+        """
+        
+        Args:
+            stderr: bool; whether stderr is captured separately
+            verbose: the verbose value of the task call
+            logfile: a log file name, or None
+            output_policy: (policy, max_output) for _OutputBuffer, or None
+        
+        """
+        self.stderr   = stderr
+        self._chunks  = ([], [])
+        if output_policy and output_policy[0] != 'memory':
+            self._chunks = (_OutputBuffer(*output_policy), _OutputBuffer(*output_policy))
+        self._screens = None
+        if verbose > 0 and verbose != 20:
+            self._screens = (sys.stdout, sys.stderr)
+            self._decoders = (codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                              codecs.getincrementaldecoder('utf-8')(errors='replace'))
+        self._file    = None if logfile is None else open(logfile, 'ab')
+        # chunks not yet written to the screen and the log file, in order
+        self._pending = []
+        self._pending_size = 0
+        self._last_flush   = time.monotonic()
+    
+    
+    def add(self, chunk, is_err=False):
+        """Add a chunk of bytes read from stdout, or stderr if is_err"""
+        self._chunks[is_err].append(chunk)
+        if self._screens is None and self._file is None:
+            return
+        self._pending.append((is_err, chunk))
+        self._pending_size += len(chunk)
+        if (self._pending_size >= self.flush_size or 
+            time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+    
+    
+    def flush_timeout(self):
+        """How long to wait for new output before pending output has to be written"""
+        if not self._pending:
+            return None
+        return max(0, self.flush_interval - (time.monotonic() - self._last_flush))
+    
+    
+    def flush(self, final=False):
+        """Write pending output to the screen and the log file"""
+        pending = self._pending
+        self._pending = []
+        self._pending_size = 0
+        self._last_flush   = time.monotonic()
+        
+        if self._file and pending:
+            self._file.write(b''.join([chunk for _, chunk in pending]))
+            self._file.flush()
+        
+        if self._screens is None:
+            return
+        
+        # group consecutive chunks of the same stream to reduce the number of writes
+        groups = []
+        for is_err, chunk in pending:
+            if groups and groups[-1][0] == is_err:
+                groups[-1][1].append(chunk)
+            else:
+                groups.append((is_err, [chunk]))
+        for is_err, chunks in groups:
+            self._screens[is_err].write(self._decoders[is_err].decode(b''.join(chunks)))
+        if final:
+            for is_err in (False, True):
+                text = self._decoders[is_err].decode(b'', final=True)
+                if text:
+                    self._screens[is_err].write(text)
+    
+    
+    def close(self):
+        """Write any pending output and close the log file"""
+        try:
+            self.flush(final=True)
+        finally:
+            if self._file:
+                self._file.close()
+                self._file = None
+    
+    
+    def result(self):
+        """Return (stdout, stderr) as str, or _OutputBuffer with an output policy;
+        stderr is None if it is not captured"""
+        out, err = self._chunks
+        if isinstance(out, list):
+            out = b''.join(out).decode()
+            err = b''.join(err).decode()
+        return out, (err if self.stderr else None)
+
+
+class _OutputBuffer:
+    """Storage for the output of a task that is not all kept in memory
+    
+    policy is one of:
+    - 'spill': keep up to max_size bytes in memory, and write the rest to a
+        temporary file; the file is removed when the buffer is garbage-collected.
+    - 'head_tail': keep only the first and last max_size/2 bytes.
+    
+    The text is only decoded when requested with getvalue or iter_lines.
+    
+    """
+    
+    policies = ('memory', 'spill', 'head_tail')
+    max_size = 64 * 1024**2
+    
+    def __init__(self, policy='spill', max_size=None):
+        self.policy   = policy
+        self.max_size = self.max_size if max_size is None else max_size
+        self.size     = 0
+        self._chunks  = []
+        self._file    = None
+        # for head_tail
+        self._head    = bytearray()
+        self._tail    = deque()
+        self._tail_size = 0
+    
+    
+    def write(self, chunk):
+        """Add a chunk of bytes"""
+        self.size += len(chunk)
+        if self.policy == 'head_tail':
+            half = self.max_size // 2
+            if len(self._head) < half:
+                nhead = half - len(self._head)
+                self._head += chunk[:nhead]
+                chunk = chunk[nhead:]
+            if chunk:
+                self._tail.append(chunk)
+                self._tail_size += len(chunk)
+                while len(self._tail) > 1 and self._tail_size - len(self._tail[0]) >= half:
+                    self._tail_size -= len(self._tail.popleft())
+        elif self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+            if self.size > self.max_size:
+                # spill what we have to a file
+                self._file = tempfile.TemporaryFile(prefix='heasoftpy.output.')
+                self._file.writelines(self._chunks)
+                self._file.flush()
+                self._chunks = []
+    
+    # allow the buffer to be used like a list of chunks by _OutputCapture
+    append = write
+    
+    
+    def _head_tail(self):
+        """Return (head, tail, skipped) for the head_tail policy"""
+        tail = b''.join(self._tail)
+        tail = tail[max(0, len(tail) - self.max_size // 2):]
+        skipped = self.size - len(self._head) - len(tail)
+        if skipped:
+            # the tail may start in the middle of a line
+            tail = tail[tail.find(b'\n') + 1:]
+            skipped = self.size - len(self._head) - len(tail)
+        return bytes(self._head), tail, skipped
+    
+    
+    @property
+    def skipped(self):
+        """The number of bytes dropped by the head_tail policy"""
+        return self._head_tail()[2] if self.policy == 'head_tail' else 0
+    
+    
+    def _blocks(self, block_size=1024**2):
+        """Iterate over the stored output in blocks of bytes"""
+        if self.policy == 'head_tail':
+            head, tail, skipped = self._head_tail()
+            yield head
+            if skipped:
+                yield f'\n[... {skipped} bytes skipped ...]\n'.encode()
+            yield tail
+        elif self._file is not None:
+            self._file.flush()
+            fd, offset = self._file.fileno(), 0
+            while True:
+                # pread does not move the file position, so readers do not interfere
+                block = os.pread(fd, block_size, offset)
+                if not block:
+                    break
+                offset += len(block)
+                yield block
+        else:
+            yield from self._chunks
+    
+    
+    def getvalue(self):
+        """Return the stored output as str"""
+        return b''.join(self._blocks()).decode(errors='replace')
+    
+    
+    def iter_lines(self):
+        """Iterate over the lines of the stored output, without reading it all in memory
+        
+        As in str.split('\\n'), the last line is '' if the output ends with a new line.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        rest = ''
+        for block in self._blocks():
+            lines = (rest + decoder.decode(block)).split('\n')
+            rest  = lines.pop()
+            yield from lines
+        yield rest + decoder.decode(b'', final=True)
+    
+    
+    def __str__(self):
+        return self.getvalue()
+
+
+_pfile_cache = _PfileCache()
+_pfile_resolver = _PfileResolver()
+_pfiles_pool = _PfilesPool()
+_task_pool = _TaskPool()
+_active_pfiles_dir = contextvars.ContextVar('heasoftpy_pfiles_dir', default=None)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_pfiles_pool._after_fork)
+
+
+
+class HSPHooks:
+    """Registry of callbacks run before and after every task call
+    
+    The callbacks of the 'pre_call' event are called, after the parameters 
+    are checked, as func(taskname, params), and those of 'post_call', 
+    when the task is done, as func(taskname, params, result, elapsed); where
+    params is the dict of the parameters of the call, result the HSPResult,
+    and elapsed the duration of the call in seconds. When the call raises an
+    exception, the post_call callbacks are called with result=None, from
+    the except clause, so sys.exc_info() gives the exception.
+    
+    Exceptions raised by the callbacks are logged, and do not stop the call.
+    The global registry is heasoftpy.hooks:
+    
+    >>> def report(taskname, params, result, elapsed):
+    >>>     print(f'{taskname} returned {result.returncode} in {elapsed:.1f} s')
+    >>> hsp.hooks.add('post_call', report)
+    
+    """
+    
+    events = ('pre_call', 'post_call')
+    
+    def __init__(self):
+        # tuples replaced when changed, so run does not need the lock
+        self._hooks = {event: () for event in self.events}
+        self._lock  = threading.Lock()
+    
+    
+    def _check(self, event):
+        if not event in self.events:
+            raise HSPTaskException(f'Unknown hook event {event}. Use one of {self.events}')
+    
+    
+    def add(self, event, func):
+        """Add a callback to an event
+        
+        Args:
+            event: 'pre_call' or 'post_call'
+            func: the callback
+        
+        Returns:
+            func
+        """
+        self._check(event)
+        with self._lock:
+            self._hooks[event] += (func,)
+        return func
+    
+    
+    def remove(self, event, func):
+        """Remove a callback from an event, if it is there"""
+        self._check(event)
+        with self._lock:
+            hooks = list(self._hooks[event])
+            if func in hooks:
+                hooks.remove(func)
+            self._hooks[event] = tuple(hooks)
+    
+    
+    def clear(self, event=None):
+        """Remove all the callbacks of an event, or of all events if None"""
+        with self._lock:
+            for name in self.events:
+                if event is None or event == name:
+                    self._hooks[name] = ()
+    
+    
+    def run(self, event, *args):
+        """Call the callbacks of an event with args"""
+        for func in self._hooks[event]:
+            try:
+                func(*args)
+            except Exception:
+                _hook_logger.exception(f'Error in the {event} hook {func!r}')
+
+
+# the global hooks, and where their errors are logged; the logger is created
+# here, before HSPLogger may be set as the logger class
+hooks = HSPHooks()
+_hook_logger = logging.getLogger('heasoftpy.hooks')
+
+
+class HSPTiming:
+    """Timing of the phases of a task call, recorded when called with timing=True
+    
+    All times are from time.perf_counter, which is monotonic. The phases, in 
+    phases as {name: (start, end)}, are:
+        - find_pfile, read_pfile: finding and parsing the .par file, when the 
+            HSPTask was created (possibly well before the call).
+        - build_params: checking (and querying) the parameters.
+        - write_pfile: writing the user .par file.
+        - popen: starting the task process.
+        - sync_pfile: reading back the user .par file after the task.
+    
+    The instants in marks as {name: time} are:
+        - first_output: the first output of the task was read.
+        - exit: the task process exited.
+    
+    For tasks run as a process by exec_task or stream, rusage has the 
+    resource usage of the process: maxrss (bytes), utime and stime (seconds 
+    of user and system CPU time). It is None for python tasks and for acall.
+    
+    """
+    
+    def __init__(self, phases=None):
+        self.phases = dict(phases) if phases else {}
+        self.marks  = {}
+        self.rusage = None
+    
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Record the start and end of a phase in a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (start, time.perf_counter())
+    
+    
+    def mark(self, name):
+        """Record the time of an instant"""
+        self.marks[name] = time.perf_counter()
+    
+    
+    def wait(self, proc):
+        """Wait for a subprocess.Popen to exit, and record its exit and resource usage"""
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            # already reaped
+            proc.wait()
+        else:
+            proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            # ru_maxrss is in kB on linux, but in bytes on macOS
+            maxrss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            self.rusage = {'maxrss': maxrss, 'utime': usage.ru_utime, 'stime': usage.ru_stime}
+        self.mark('exit')
+    
+    
+    @property
+    def durations(self):
+        """The duration of each phase in seconds, and of the task run, from the
+        start of popen: time_to_first_output and run (until exit)"""
+        res = {name: end - start for name, (start, end) in self.phases.items()}
+        if 'popen' in self.phases:
+            start = self.phases['popen'][0]
+            if 'first_output' in self.marks:
+                res['time_to_first_output'] = self.marks['first_output'] - start
+            if 'exit' in self.marks:
+                res['run'] = self.marks['exit'] - start
+        return res
+    
+    
+    def to_dict(self):
+        """The timing as a json-serializable dict"""
+        return {'phases': {name: list(times) for name, times in self.phases.items()},
+                'marks': dict(self.marks), 'durations': self.durations, 'rusage': self.rusage}
+    
+    
+    def __repr__(self):
+        text = ', '.join([f'{name}={dt*1e3:.3f}ms' for name, dt in self.durations.items()])
+        if self.rusage is not None:
+            text += (f', maxrss={self.rusage["maxrss"]/1024**2:.1f}MB, '
+                     f'utime={self.rusage["utime"]:.3f}s, stime={self.rusage["stime"]:.3f}s')
+        return f'HSPTiming({text})'
+
+
+# the context manager used for phases when there is no timing
+_no_timing = contextlib.nullcontext()
+
+
 class HSPResult:
     """Container for the result of a task execution"""
     
@@ -701,6 +2362,41 @@ class HSPResult:
         self.stderr     = stderr
         self.params     = dict(params) if isinstance(params, dict) else params
         self.custom     = dict(custom) if isinstance(custom, dict) else custom
+        # True if the task did not run, and the result is from HSPTask.result_cache
+        self.cached     = False
+        # an HSPTiming, when the task is called with timing=True
+        self.timing     = None
+    
+    # stdout and stderr may be stored in an _OutputBuffer when the task is called 
+    # with an output_policy; they are then read from the buffer when accessed.
+    @property
+    def stdout(self):
+        """The standard output as str"""
+        return self._stdout.getvalue() if isinstance(self._stdout, _OutputBuffer) else self._stdout
+    
+    @stdout.setter
+    def stdout(self, value):
+        self._stdout = value
+        # parsed views of stdout; see output, table and keywords
+        self._parsed = {}
+    
+    @property
+    def stderr(self):
+        """The standard error as str, or None"""
+        return self._stderr.getvalue() if isinstance(self._stderr, _OutputBuffer) else self._stderr
+    
+    @stderr.setter
+    def stderr(self, value):
+        self._stderr = value
+    
+    def __getstate__(self):
+        # output in a temporary file is read, so results can be pickled
+        # (e.g. to return them from a process pool)
+        state = dict(self.__dict__)
+        for key in ['_stdout', '_stderr']:
+            if isinstance(state[key], _OutputBuffer):
+                state[key] = state[key].getvalue()
+        return state
         
     def __str__(self):
         """Print the result object in a clean way"""
@@ -719,48 +2415,295 @@ class HSPResult:
     
     @property
     def output(self):
-        """Return the standard output as a list of line"""
-        return self.stdout.split('\n')
+        """Return the standard output as a list of line
+        
+        The list is computed once and cached, unless the output is stored 
+        in a file (output_policy='spill'), in which case it is read each time.
+        """
+        if isinstance(self._stdout, _OutputBuffer) and self._stdout._file is not None:
+            return list(self.iter_output())
+        if not 'output' in self._parsed:
+            self._parsed['output'] = list(self.iter_output())
+        return self._parsed['output']
+    
+    @property
+    def table(self):
+        """The tabular output of ftlist option=T (or fdump), as a dict of 
+        {column_name: numpy array}
+        
+        Column values are converted to int or float when possible. Columns
+        with blank cells are numpy masked arrays, with the blank cells masked.
+        This is parsed once and cached. See parsers.parse_table.
+        
+        This needs numpy (pip install heasoftpy[numpy]).
+        """
+        if not 'table' in self._parsed:
+            import numpy as np
+            table = {}
+            for name, values in parsers.parse_table(self.iter_output()).items():
+                mask = [value is None for value in values]
+                for dtype, blank in [(np.int64, '0'), (np.float64, 'nan'), (str, '')]:
+                    try:
+                        column = np.array([blank if value is None else value for value in values],
+                                          dtype=dtype)
+                    except (ValueError, OverflowError):
+                        continue
+                    table[name] = np.ma.masked_array(column, mask=mask) if any(mask) else column
+                    break
+            self._parsed['table'] = table
+        return self._parsed['table']
+    
+    @property
+    def keywords(self):
+        """The header keywords printed by ftlist option=K or fkeyprint, as a
+        dict of {keyword: value}
+        
+        This is parsed once and cached. See parsers.parse_keywords.
+        """
+        if not 'keywords' in self._parsed:
+            self._parsed['keywords'] = parsers.parse_keywords(self.iter_output())
+        return self._parsed['keywords']
+    
+    def iter_output(self):
+        """Iterate over the lines of the standard output
+        
+        When the output is stored in a file (output_policy='spill'), this reads 
+        the file line by line, and does not load it all in memory.
+        """
+        if isinstance(self._stdout, _OutputBuffer):
+            return self._stdout.iter_lines()
+        return iter(self.stdout.split('\n'))
+    
+    
+class HSPStream:
+    """Iterator over the output lines of a running task; see HSPTask.stream"""
+    
+    def __init__(self, task, args=None, kwargs=None):
+        """Prepare the call to the task. It starts on the first iteration.
+        
+        Args:
+            task: the HSPTask to call
+            args, kwargs: the input to the task call
+        
+        """
+        self.task    = task
+        self.result  = None
+        self._args   = args
+        self._kwargs = {} if kwargs is None else kwargs
+        self._proc   = None
+        self._lines  = None
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._lines is None:
+            self._lines = self._iter_lines()
+        return next(self._lines)
     
+    def __enter__(self):
+        return self
     
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        """Stop iterating, killing the task if it is still running"""
+        if self._lines is None:
+            # nothing started; make any later iteration stop
+            self._lines = iter([])
+        else:
+            self._lines.close()
+    
+    
+    def _iter_lines(self):
+        """Generator that runs the task and yields its output lines"""
+        task = self.task
+        if not task._setup_call(self._args, self._kwargs):
+            return
+        start = task._start_call()
+        try:
+            yield from self._run_lines(start)
+        except BaseException:
+            # the post_call hooks see the failed call, unless they already ran
+            if self.result is None:
+                task._end_call(None, start)
+            raise
+    
+    
+    def _run_lines(self, start):
+        """The body of _iter_lines, after the pre_call hooks"""
+        task = self.task
+        
+        # a stored result, or up-to-date outputs; nothing is run
+        cache_key, result = task._lookup_result()
+        if result is None and task._incremental:
+            result = task._skip_up_to_date()
+        if not result is None:
+            self.result = task._end_call(result, start)
+            yield from self._result_lines()
+            return
+        
+        with task._phase('write_pfile'):
+            usr_pfile = task._write_user_pfile()
+        
+        if type(task).exec_task is not HSPTask.exec_task:
+            # python-only task; nothing to stream
+            self._end_lines(task.exec_task(), usr_pfile, cache_key, start)
+            yield from self._result_lines()
+            return
+        
+        stderr = subprocess.PIPE if task.stderr else subprocess.STDOUT
+        cmd_list, usr_params = task._exec_command()
+        if task.python_executor is not None and cmd_list[0] == 'python':
+            # python script run in the worker pool; nothing to stream
+            self._end_lines(task._exec_python_executor(cmd_list, usr_params), 
+                            usr_pfile, cache_key, start)
+            yield from self._result_lines()
+            return
+        
+        timing = getattr(task, '_timing', None)
+        with task._phase('popen'):
+            proc = self._proc = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, 
+                                                 stderr=stderr, env=task._task_env())
+        capture  = _OutputCapture(task.stderr, task._verbose, task._logfile, task._output_policy)
+        sources  = ('stdout', 'stderr')
+        decoders = [codecs.getincrementaldecoder('utf-8')(errors='replace') for _ in sources]
+        rest     = ['', '']
+        done     = False
+        try:
+            for is_err, chunk in HSPTask._read_io_stream(proc, task.stderr, capture):
+                if timing is not None and 'first_output' not in timing.marks:
+                    timing.mark('first_output')
+                lines = (rest[is_err] + decoders[is_err].decode(chunk)).split('\n')
+                rest[is_err] = lines.pop()
+                for line in lines:
+                    yield sources[is_err], line
+            for is_err in (False, True):
+                line = rest[is_err] + decoders[is_err].decode(b'', final=True)
+                if line:
+                    yield sources[is_err], line
+            done = True
+        finally:
+            # we get here at the end, or when the stream is closed early.
+            # A finished process is not polled, so timing.wait gets its rusage
+            if not done:
+                proc.kill()
+            if timing is None:
+                proc.wait()
+            else:
+                timing.wait(proc)
+            for fp in [proc.stdout, proc.stderr]:
+                if fp: fp.close()
+            capture.close()
+            proc_out, proc_err = capture.result()
+            result = HSPResult(proc.returncode, proc_out, proc_err, usr_params)
+            self._end_lines(result, usr_pfile, cache_key, start)
+    
+    
+    def _end_lines(self, result, usr_pfile, cache_key, start):
+        """Finish the call as _run_call does, and set self.result
+        
+        Args:
+            result: the HSPResult of the task
+            usr_pfile: the user .par file written for the call
+            cache_key: the key from _lookup_result
+            start: the start time from _start_call
+        
+        """
+        task = self.task
+        with task._phase('sync_pfile'):
+            result = task._sync_user_pfile(result, usr_pfile)
+        task._store_result(cache_key, result)
+        if task._incremental:
+            task._store_outputs(result)
+        self.result = task._end_call(result, start)
+    
+    
+    def _result_lines(self):
+        """Yield the output lines of self.result, for calls that do not stream"""
+        for source in ['stdout', 'stderr']:
+            text = getattr(self.result, source)
+            if text:
+                lines = text.split('\n')
+                if lines[-1] == '':
+                    lines.pop()
+                for line in lines:
+                    yield source, line
+    
+    
+# a field of a .par line, after its leading comma: text, "quoted" (possibly 
+# unclosed), 'quoted' text, or a lone apostrophe; see HSPParam.split_line
+_par_field_re = re.compile(''',((?:[^,'"]+|"[^"]*"?|'[^']*'|')*)''')
+
+
+# the fields of a parameter read from a .par file; these are shared by all the
+# copies of a parameter, so they are kept in an immutable tuple
+HSPParamSchema = namedtuple('HSPParamSchema', ['pname', 'type', 'mode', 'default', 
+                                               'min', 'max', 'prompt'])
+
+
+def _schema_property(field):
+    """A property to access a field of HSPParam.schema"""
+    def _get(self):
+        return getattr(self.schema, field)
+    def _set(self, value):
+        # the schema is shared, so changing a field replaces it for this parameter only
+        self.schema = self.schema._replace(**{field: value})
+    return property(_get, _set, doc=f'The {field} of the parameter, from the .par file')
+
+
 class HSPParam():
-    """Class for holding task parameters """
+    """Class for holding task parameters
+    
+    The fields read from the .par file (pname, type, mode, default, min, max, 
+    prompt) are in an immutable HSPParamSchema shared by all the copies of the 
+    parameter, and only value and isReq belong to each instance.
+    """
     
-    def __init__(self, line):
+    __slots__ = ('schema', 'value', 'isReq')
+    
+    pname   = _schema_property('pname')
+    type    = _schema_property('type')
+    mode    = _schema_property('mode')
+    default = _schema_property('default')
+    min     = _schema_property('min')
+    max     = _schema_property('max')
+    prompt  = _schema_property('prompt')
+    
+    def __init__(self, line=None, schema=None):
         """Initialize a parameter object with a line from the .par file
         
         Args:
             line: a line from the parameter file
+            schema: an HSPParamSchema to use instead of parsing line
             
         """
-        line = line.replace('\n', '')
-        info = line.strip().split(',')
-
-        # handle comma (,) in the prompt text
-        if len(info) > 6:
-            # if there is an unclosed " in the prompt. This should be fixed in the file
-            # but we add it here for generality
-            if line.count('"') % 2 != 0:
-                 line += '"'
-            # if any value contains ",", replace it with "^|_", split, then put it back
-            # assumes "^|_" is not going to appear anywhere
-            # - split the line so closed strings (with ' or ") are in separate parts
-            parts = re.split("('.*?'|\\\".*?\\\")", line)
-            # - replace , with ^|_ if , falls in one of the substrings with open/close ',"
-            parts = [p.replace(',', '^|_') if ('"' in p or "'" in p) else p.strip()
-                      for p in parts]
-            # - put things back together, and then split at , and remove ^|_
-            info  = [p.replace('^|_', ',') for p in ''.join(parts).split(',')]
+        if schema is None:
+            info = HSPParam.split_line(line.replace('\n', '').strip())
             
-        # extract information about the parameter
-        self.pname = info[0]
-        pkeys = ['type', 'mode', 'default', 'min', 'max', 'prompt']
-        for ikey,key in enumerate(pkeys):
-            setattr(self, key, info[ikey+1].strip().strip('"'))
-        
-        self.default = HSPParam.param_type(self.default, self.type)
-        self.value   = self.default 
-
+            # extract information about the parameter
+            if len(info) < 7:
+                info += [''] * (7 - len(info))
+            fields = [info[0].strip()] + [field.strip().strip('"') for field in info[1:7]]
+            fields[3] = HSPParam.param_type(fields[3], fields[1])
+            schema = HSPParamSchema(*fields)
+        
+        self.schema = schema
+        self.value  = schema.default
+        self.isReq  = False
+    
+    
+    def copy(self):
+        """A copy of the parameter, sharing the same schema"""
+        new = HSPParam.__new__(HSPParam)
+        new.schema = self.schema
+        new.value  = self.value
+        new.isReq  = self.isReq
+        return new
+    
+    __copy__ = copy
+    
     
     def __set__(self, obj, new_value):
         if obj is None:
@@ -805,6 +2748,30 @@ class HSPParam():
             except ValueError:
                 print(f'value {user_inp} cannot be processed. Try again!')
 
+    @staticmethod
+    def split_line(line):
+        """Split a line from a .par file into its comma-separated fields
+        
+        Commas inside quoted text ('...' or "...") do not separate fields. 
+        An unclosed " extends to the end of the line (this should be fixed in 
+        the file, but we handle it here for generality), while an unclosed '
+        is taken as a normal character (e.g. an apostrophe in a prompt).
+        
+        Lines without quotes (most of them) are split with a simple split.
+        Otherwise, the fields are tokenized in a single regex pass.
+        
+        Args:
+            line: a line from the parameter file
+        
+        Returns:
+            a list of str fields, with the quotes kept
+        
+        """
+        if not '"' in line and not "'" in line:
+            return line.split(',')
+        return _par_field_re.findall(',' + line)
+    
+    
     @staticmethod
     def param_type(value, inType):
         """Find the correct type from pfiles
@@ -1,9 +1,121 @@
+"""Python wrappers for the built-in heasoft tasks.
 
+Wrappers are resolved lazily, the first time they are accessed, from:
+- a module generated at installation in this directory, if it exists.
+- the task registry (_registry.json) written when installing in registry mode.
+- the task's .par file in $HEADAS/syspfiles otherwise.
+
+"""
 import os as _os
-import glob as _glob
-_modules = _glob.glob(_os.path.join(_os.path.dirname(__file__), '*.py'))
-_modules = [_os.path.basename(f)[:-3] for f in _modules if _os.path.isfile(f) 
-           and not f.endswith('__init__.py')]
+import json as _json
+import importlib as _importlib
+
+# index of the modules generated during installation; this is a single listing
+_fcn_dir = _os.path.dirname(__file__)
+_modules = {f[:-3] for f in _os.listdir(_fcn_dir)
+            if f.endswith('.py') and not f.startswith('__')}
+
+# task registry; see utils.generate_py_code. Loaded on first use
+_registry_file = _os.path.join(_fcn_dir, '_registry.json')
+_registry_docs = _os.path.join(_fcn_dir, '_registry_docs.txt')
+_registry = None
+
+# index of {pyname: taskname} from $HEADAS/syspfiles, built on first use
+_par_index = {}
+
+
+def _par_tasks():
+    """Return a dict of {pyname: taskname} for the .par files in $HEADAS/syspfiles"""
+    headas = _os.environ.get('HEADAS', None)
+    if headas is None:
+        return {}
+    if not headas in _par_index:
+        pfile_dir = _os.path.join(headas, 'syspfiles')
+        try:
+            names = [f[:-4] for f in _os.listdir(pfile_dir) if f.endswith('.par')]
+        except OSError:
+            names = []
+        _par_index.clear()
+        _par_index[headas] = {name.replace('-', '_'): name for name in names}
+    return _par_index[headas]
+
+
+def _registry_tasks():
+    """Return the task registry as a dict of {pyname: entry}"""
+    global _registry
+    if _registry is None:
+        if _os.path.exists(_registry_file):
+            with open(_registry_file) as fp:
+                tasks = _json.load(fp)['tasks']
+            _registry = {entry['pyname']: entry for entry in tasks.values()}
+        else:
+            _registry = {}
+    return _registry
+
+
+def _registry_doc(task_name):
+    """Read the docstring of a task from the registry docs file"""
+    offset, length = _registry_tasks()[task_name.replace('-', '_')]['doc']
+    with open(_registry_docs, 'rb') as fp:
+        fp.seek(offset)
+        return fp.read(length).decode()
+
+
+def _pfile_doc(task_name):
+    """Generate the docstring of a task from its .par file"""
+    from ..core import HSPTask
+    return HSPTask(name=task_name).__doc__
+
+
+class _TaskWrapper:
+    # A callable wrapper for a heasoft task. The docstring is only
+    # generated, by calling doc_loader, when __doc__ is accessed (e.g. by help)
+    
+    def __init__(self, task_name, doc_loader):
+        self.task_name    = task_name
+        self.__name__     = task_name.replace('-', '_')
+        self.__qualname__ = self.__name__
+        self.__module__   = __name__
+        self._doc_loader  = doc_loader
+        self._doc         = None
+    
+    @property
+    def __doc__(self):
+        if self._doc is None:
+            self._doc = self._doc_loader(self.task_name)
+        return self._doc
+    
+    def __call__(self, args=None, **kwargs):
+        from ..core import _task_pool
+        with _task_pool.task(self.task_name) as task:
+            return task(args, **kwargs)
+    
+    def __repr__(self):
+        return f'<heasoft task {self.__name__}>'
+
+
+def __getattr__(name):
+    """Load the wrapper for task `name` on first access"""
+    if name.startswith('_'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    
+    if name in _modules:
+        module = _importlib.import_module(f'.{name}', __name__)
+        fcn = getattr(module, name)
+    elif name in _registry_tasks():
+        fcn = _TaskWrapper(_registry_tasks()[name]['name'], _registry_doc)
+    else:
+        task_name = _par_tasks().get(name, None)
+
+        # python tools are provided by their own packages, as in utils.generate_py_code
+        if task_name is None or _os.path.exists(
+                _os.path.join(_os.environ['HEADAS'], 'bin', f'{task_name}.py')):
+            raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+        fcn = _TaskWrapper(task_name, _pfile_doc)
+
+    globals()[name] = fcn
+    return fcn
+
 
-for _m in _modules:
-    exec(f'from .{_m} import {_m}')
\ No newline at end of file
+def __dir__():
+    return sorted(set(globals()) | _modules | set(_registry_tasks()) | set(_par_tasks()))
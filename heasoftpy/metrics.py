@@ -0,0 +1,276 @@
+"""Counters and latency histograms of task calls, per task.
+
+HSPMetrics is a post_call hook (see core.HSPHooks) that counts, for each
+task, the calls, the failures (non-zero returncode, or an exception raised
+by the call) and the results that did
+not run the task (from HSPTask.result_cache or incremental=True), and keeps a
+histogram of the durations of the calls.
+
+>>> import heasoftpy as hsp
+>>> from heasoftpy.metrics import HSPMetrics
+>>> metrics = HSPMetrics().install()
+>>> result  = hsp.ftlist(infile='input.fits', option='T')
+>>> metrics.dump('heasoftpy_metrics.json')
+>>> metrics.dump('heasoftpy_metrics.prom', format='prometheus')
+
+The counts are kept in memory, and can be updated from several threads.
+Several processes (e.g. the workers of a pipeline, or separate scripts) can
+dump to the same file: the counts of each process are kept in the file next
+to their totals, and the file is updated under a lock (fcntl.flock), so
+dumping again replaces the counts of the process instead of adding them
+twice. A forked child process starts with empty counts.
+
+"""
+import os
+import json
+import time
+import fcntl
+import socket
+import bisect
+import weakref
+import tempfile
+import threading
+
+from .core import hooks, HSPTaskException
+
+
+class HSPMetrics:
+    """Per-task counters and latency histograms of task calls"""
+
+    # upper bounds of the histogram buckets, in seconds
+    buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600)
+
+    def __init__(self, buckets=None):
+        """Create an empty aggregator; install() adds it to the hooks
+
+        Args:
+            buckets: upper bounds of the histogram buckets in seconds. A last
+                bucket with no bound (+Inf) is always added.
+
+        """
+        if buckets is not None:
+            self.buckets = tuple(sorted([float(b) for b in buckets]))
+        self._reset()
+        _instances.add(self)
+
+
+    def _reset(self):
+        """Start with empty counts, e.g. in a forked process"""
+        self._lock   = threading.Lock()
+        self._tasks  = {}
+        self._source = f'{socket.gethostname()}:{os.getpid()}:{time.time_ns()}'
+
+
+    def install(self):
+        """Record all task calls, from now on
+
+        Returns:
+            self
+        """
+        hooks.add('post_call', self.record)
+        return self
+
+
+    def uninstall(self):
+        """Stop recording task calls"""
+        hooks.remove('post_call', self.record)
+
+
+    def record(self, taskname, params, result, elapsed):
+        """Record a task call; this is the post_call hook
+
+        Args:
+            taskname: name of the task
+            params: dict of the parameters of the call (not used)
+            result: the HSPResult of the call, or None if it raised an exception
+            elapsed: duration of the call in seconds
+
+        """
+        failed = getattr(result, 'returncode', -1) != 0
+        cached = bool(getattr(result, 'cached', False))
+        ibin   = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            entry = self._tasks.get(taskname, None)
+            if entry is None:
+                entry = self._tasks[taskname] = {
+                    'calls': 0, 'failures': 0, 'cached': 0, 'seconds': 0.0,
+                    'buckets': [0] * (len(self.buckets) + 1)}
+            entry['calls']    += 1
+            entry['failures'] += failed
+            entry['cached']   += cached
+            entry['seconds']  += elapsed
+            entry['buckets'][ibin] += 1
+
+
+    def snapshot(self):
+        """The counts of this process, as a json-serializable dict"""
+        with self._lock:
+            tasks = {name: dict(entry, buckets=list(entry['buckets']))
+                     for name, entry in self._tasks.items()}
+        return {'buckets': list(self.buckets), 'tasks': tasks}
+
+
+    def to_json(self):
+        """The counts of this process as json text"""
+        return json.dumps(self.snapshot(), indent=2)
+
+
+    def to_prometheus(self, data=None):
+        """The counts in the Prometheus text format
+
+        Args:
+            data: a dict as returned by snapshot or dump. Default is the
+                counts of this process.
+
+        Returns:
+            str
+        """
+        data = self.snapshot() if data is None else data
+        tasks = sorted(data['tasks'].items())
+        lines = []
+        for key, metric, help_text in [
+                ('calls', 'heasoftpy_task_calls_total', 'Number of task calls'),
+                ('failures', 'heasoftpy_task_failures_total', 'Number of task calls with a non-zero returncode'),
+                ('cached', 'heasoftpy_task_cached_total', 'Number of task calls that did not run the task')]:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{task="{_escape(name)}"}} {entry[key]}' for name, entry in tasks]
+
+        metric = 'heasoftpy_task_duration_seconds'
+        lines += [f'# HELP {metric} Duration of the task calls', f'# TYPE {metric} histogram']
+        bounds = [f'{b:g}' for b in data['buckets']] + ['+Inf']
+        for name, entry in tasks:
+            label, total = _escape(name), 0
+            for bound, count in zip(bounds, entry['buckets']):
+                total += count
+                lines.append(f'{metric}_bucket{{task="{label}",le="{bound}"}} {total}')
+            lines.append(f'{metric}_sum{{task="{label}"}} {entry["seconds"]!r}')
+            lines.append(f'{metric}_count{{task="{label}"}} {entry["calls"]}')
+        return '\n'.join(lines) + '\n'
+
+
+    def dump(self, filename, format=None, max_age=None):
+        """Write the counts to a file, merged with those of other processes
+
+        The counts of each process that dumped to the file are kept in it (in
+        a hidden .sources.json file next to it for the Prometheus format), and
+        the file has their totals. The counts of processes that have not dumped
+        for max_age seconds are added up into a single 'compacted' source, so 
+        the file does not grow with every process, and the totals are kept.
+
+        Args:
+            filename: name of the output file
+            format: 'json' or 'prometheus'. Default is 'prometheus' for file
+                names ending with .prom or .txt, and 'json' otherwise.
+            max_age: age in seconds after which the counts of a process are 
+                compacted. Default is to keep them all.
+
+        Returns:
+            the merged counts as a dict, with the counts of each process in 'sources'
+        """
+        if format is None:
+            format = 'prometheus' if filename.endswith(('.prom', '.txt')) else 'json'
+        if not format in ['json', 'prometheus']:
+            raise HSPTaskException("format has to be 'json' or 'prometheus'")
+
+        filename = os.path.abspath(filename)
+        if format == 'json':
+            state_file = filename
+        else:
+            dirname, basename = os.path.split(filename)
+            state_file = os.path.join(dirname, f'.{basename}.sources.json')
+
+        with open(f'{state_file}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            sources = {}
+            if os.path.exists(state_file):
+                try:
+                    with open(state_file) as fp:
+                        sources = json.load(fp).get('sources', {})
+                except ValueError:
+                    # not a file written by dump; it is replaced
+                    sources = {}
+            now = time.time()
+            sources[self._source] = dict(self.snapshot(), time=now)
+            if max_age is not None:
+                sources = _compact(sources, now - max_age)
+            data = dict(merge(sources.values()), sources=sources, time=time.time())
+            _write_atomic(state_file, json.dumps(data, indent=2))
+            if format == 'prometheus':
+                _write_atomic(filename, self.to_prometheus(data))
+        return data
+
+
+def merge(snapshots):
+    """Add up the counts of several snapshots
+
+    Args:
+        snapshots: a list of dicts, as returned by HSPMetrics.snapshot
+
+    Returns:
+        a dict like that of snapshot with the total counts
+    """
+    buckets, tasks = None, {}
+    for snap in snapshots:
+        if buckets is None:
+            buckets = snap['buckets']
+        elif snap['buckets'] != buckets:
+            raise HSPTaskException('Cannot merge metrics with different histogram buckets')
+        for name, entry in snap['tasks'].items():
+            total = tasks.get(name, None)
+            if total is None:
+                tasks[name] = dict(entry, buckets=list(entry['buckets']))
+                continue
+            for key in ['calls', 'failures', 'cached', 'seconds']:
+                total[key] += entry[key]
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+    return {'buckets': list(HSPMetrics.buckets) if buckets is None else buckets, 'tasks': tasks}
+
+
+def _compact(sources, before):
+    """Add up the sources last dumped before a time into one 'compacted' source
+
+    Args:
+        sources: dict of {source: snapshot with its dump time}, as kept by dump
+        before: time (as time.time) before which sources are compacted
+
+    Returns:
+        the new dict of sources
+    """
+    old = [name for name, snap in sources.items() 
+           if name != 'compacted' and snap.get('time', 0) < before]
+    if not old:
+        return sources
+    snaps = [sources[name] for name in old]
+    if 'compacted' in sources:
+        snaps.append(sources['compacted'])
+    compacted = dict(merge(snaps), time=max([snap.get('time', 0) for snap in snaps]))
+    sources = {name: snap for name, snap in sources.items() if not name in old}
+    sources['compacted'] = compacted
+    return sources
+
+
+def _escape(label):
+    """Escape a Prometheus label value"""
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(filename, text):
+    """Write text to a file, replacing it atomically"""
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(text)
+    # readable by other users, e.g. a metrics collector
+    os.chmod(tmpfile, 0o644)
+    os.replace(tmpfile, filename)
+
+
+# the counts of all the aggregators are reset in forked processes, so the
+# parent counts are not dumped twice
+_instances = weakref.WeakSet()
+
+def _after_fork():
+    for metrics in list(_instances):
+        metrics._reset()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
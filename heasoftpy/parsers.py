@@ -0,0 +1,147 @@
+"""Parsers for the text output of common heasoft tasks.
+
+These are used by HSPResult.table and HSPResult.keywords, and take a list
+of output lines, e.g. HSPResult.output.
+
+"""
+import re
+import bisect
+
+
+def parse_table(lines):
+    """Parse the tabular output of ftlist option=T (or fdump) into columns
+
+    The output is made of one or more blocks (wide tables are split into
+    several blocks of columns), each with a line of column names, an optional
+    line of units, and rows that start with the row number. Only scalar
+    columns with values that do not contain spaces are handled.
+
+    Rows are the lines that start with a row number, and the other lines
+    start a new block. In rows with blank cells, the values are matched to
+    the columns by their position, using the first complete row of the block
+    (or the column names if there is none yet), and the blank cells are None.
+
+    Args:
+        lines: a list of output lines
+
+    Returns:
+        dict of {column_name: list of str values, or None for blank cells},
+        in the order of the columns.
+
+    """
+    columns = {}
+    header  = None
+    ends    = None
+    row_end = None
+    in_rows = False
+    for line in lines:
+        tokens = [(m.end(), m.group()) for m in _token_re.finditer(line)]
+        if not tokens:
+            continue
+        if header is not None and tokens[0][1].isdigit():
+            row = int(tokens[0][1])
+            if len(tokens) == len(header) + 1:
+                if row_end is None:
+                    row_end = [end for end, _ in tokens[1:]]
+                values = [value for _, value in tokens[1:]]
+            else:
+                values = _blank_cells(tokens[1:], ends if row_end is None else row_end)
+            for name, value in zip(header, values):
+                columns[name][row] = value
+            in_rows = True
+        elif header is None or in_rows:
+            # a new block of columns
+            header  = [value for _, value in tokens]
+            ends    = [end for end, _ in tokens]
+            row_end = None
+            in_rows = False
+            for name in header:
+                columns.setdefault(name, {})
+        else:
+            # units line, between the column names and the rows
+            continue
+
+    # columns that got no rows were not column names
+    return {name: [col[row] for row in sorted(col)]
+            for name, col in columns.items() if col}
+
+
+_token_re = re.compile(r'\S+')
+
+
+def _blank_cells(tokens, ends):
+    """Match the values of a row with blank cells to the columns
+    
+    A value goes to the first column that ends after the value starts; this
+    handles both right-aligned (numbers) and left-aligned (strings) values.
+
+    Args:
+        tokens: a list of (end position, value) of the values of the row
+        ends: the end positions of the columns
+
+    Returns:
+        list of values, with None for the blank cells
+    """
+    values = [None] * len(ends)
+    icol   = 0
+    for end, value in tokens:
+        start = end - len(value)
+        icol  = max(icol, bisect.bisect_right(ends, start))
+        if icol >= len(ends):
+            break
+        values[icol] = value
+        icol += 1
+    return values
+
+
+def parse_keywords(lines):
+    """Parse FITS header cards, as printed by ftlist option=K or fkeyprint
+
+    Values are converted to bool, int or float when possible, and quotes are
+    removed from string values. Cards without a value (COMMENT, HISTORY) are
+    skipped, and for repeated keywords, the last value is kept.
+
+    Args:
+        lines: a list of output lines
+
+    Returns:
+        dict of {keyword: value}
+
+    """
+    keywords = {}
+    for line in lines:
+        match = _card_re.match(line)
+        if match is None:
+            continue
+        keywords[match.group(1)] = _card_value(match.group(2))
+    return keywords
+
+
+_card_re = re.compile(r'^\s*([A-Z0-9_-]{1,8})\s*=\s?(.*)$')
+
+
+def _card_value(text):
+    """Convert the value part of a header card (after the =) to python"""
+    text = text.strip()
+    if text.startswith("'"):
+        # string; '' is an escaped quote
+        match = re.match(r"'((?:[^']|'')*)'", text)
+        if match is None:
+            return text[1:].rstrip()
+        return match.group(1).replace("''", "'").rstrip()
+
+    # remove the comment
+    value = text.split('/', 1)[0].strip()
+    if value == 'T':
+        return True
+    if value == 'F':
+        return False
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        # fortran double precision exponents use D
+        return float(value.replace('D', 'E'))
+    except ValueError:
+        return value
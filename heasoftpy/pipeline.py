@@ -0,0 +1,345 @@
+"""Run a pipeline of heasoft tasks as a graph of dependent steps.
+
+Each step is a task call. The input and output files of a step are taken from
+its file parameters (type fw, or f named out*, for outputs, and the other f/fr
+for inputs; see HSPTask.file_params), and a step runs after the steps that
+produce its inputs. Independent steps (e.g. different detectors or energy bands) run
+concurrently, each in its own pfiles directory (see utils.pfiles_scope).
+
+>>> import heasoftpy as hsp
+>>> from heasoftpy.pipeline import HSPPipeline
+>>> evt  = 'obs1/xti/event_cl/ni1_0mpu7_cl.evt'
+>>> pipe = HSPPipeline('obs1', max_workers=4, state_file='obs1.state.json')
+>>> pipe.add('nicerl2', {'indir': 'obs1'}, name='calib', outputs=[evt])
+>>> for band, (pi1, pi2) in {'soft': (30, 200), 'hard': (200, 1200)}.items():
+>>>     pipe.add('ftcopy', {'infile': f'{evt}[PI={pi1}:{pi2}]', 
+>>>                         'outfile': f'{band}.evt'}, name=band)
+>>>     pipe.add('ftstat', {'infile': f'{band}.evt[events][col PI]'}, 
+>>>              name=f'{band}_stat', after=[band])
+>>> report = pipe.run(report='obs1.report.json')
+
+Files that are not in the file parameters can be given with inputs and 
+outputs, and other dependencies with after, as above.
+
+When a step fails, the steps that depend on it are not run, but independent
+branches continue. Running again with resume=True skips the steps that
+already succeeded with the same parameters, and whose outputs still exist.
+
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import concurrent.futures
+
+from .core import HSPTask, HSPTaskException, _pfiles_pool, _is_output_file, _file_names
+
+
+class HSPStep:
+    """A step of an HSPPipeline: a task call with its input and output files"""
+
+    def __init__(self, name, task, params, inputs, outputs, after, kwargs):
+        """Create a step; see HSPPipeline.add
+
+        Args:
+            name: unique name of the step
+            task: an HSPTask instance, used for its class and .par file
+            params: dict of task parameters
+            inputs, outputs: lists of files read and written by the step
+            after: list of names of steps that have to run before this one
+            kwargs: extra keywords for the task call (e.g. verbose)
+
+        """
+        self.name     = name
+        self.task     = task
+        self.params   = dict(params)
+        self.inputs   = inputs
+        self.outputs  = outputs
+        self.after    = list(after)
+        self.kwargs   = dict(kwargs)
+        self.depends  = []
+        self.status   = 'pending'
+        self.result   = None
+        self.error    = None
+        self.start    = None
+        self.end      = None
+
+    @property
+    def signature(self):
+        """A hash of the task and parameters, to check if a step changed since a previous run"""
+        text = json.dumps([self.task.taskname, sorted(self.params.items())], default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def report(self):
+        """Return the status of the step as a json-serializable dict"""
+        duration = None if self.start is None or self.end is None else self.end - self.start
+        res = self.result
+        return {
+            'task'       : self.task.taskname,
+            'params'     : {par: str(val) for par, val in self.params.items()},
+            'inputs'     : self.inputs,
+            'outputs'    : self.outputs,
+            'depends'    : self.depends,
+            'status'     : self.status,
+            'returncode' : None if res is None else res.returncode,
+            'start'      : self.start,
+            'end'        : self.end,
+            'duration'   : duration,
+            'error'      : self.error,
+            'signature'  : self.signature,
+        }
+
+
+class HSPPipeline:
+    """A graph of task calls, run in parallel where their files allow it"""
+
+    def __init__(self, name='pipeline', max_workers=None, executor='process', state_file=None):
+        """Create an empty pipeline
+
+        Args:
+            name: name of the pipeline, used in the report
+            max_workers: maximum number of steps running at the same time.
+                Default is the number of CPUs.
+            executor: 'process' to run the steps in a pool of processes, or
+                'thread' to run them in a pool of threads.
+            state_file: a json file where the status of the steps is saved after
+                every step, so a failed run can be resumed with run(resume=True)
+
+        """
+        if not executor in ['process', 'thread']:
+            raise HSPTaskException("executor has to be 'process' or 'thread'")
+        self.name        = name
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor    = executor
+        self.state_file  = state_file
+        self.steps       = {}
+
+
+    def add(self, task, params=None, name=None, after=None, inputs=None, outputs=None, **kwargs):
+        """Add a step to the pipeline
+
+        Args:
+            task: the name of a task, or an HSPTask instance (e.g. of a
+                python-only task subclassing HSPTask)
+            params: dict of task parameters. All the required parameters should
+                be given, as the steps run with noprompt=True.
+            name: unique name of the step. Default is the task name, with a
+                number added if needed.
+            after: list of names of steps that have to run before this one, in
+                addition to those producing its input files
+            inputs, outputs: lists of extra input and output files, e.g. files
+                that are not task parameters, or are given in parameters that
+                are not of type f/fr/fw.
+            **kwargs: extra keywords for the task call (e.g. verbose, stderr).
+
+        Returns:
+            the name of the step
+
+        """
+        if isinstance(task, str):
+            task = HSPTask(name=task)
+        if not isinstance(task, HSPTask):
+            raise HSPTaskException('task should be a task name or an HSPTask')
+        params = {} if params is None else dict(params)
+
+        if name is None:
+            name, count = task.taskname, 1
+            while name in self.steps:
+                count += 1
+                name = f'{task.taskname}_{count}'
+        if name in self.steps:
+            raise HSPTaskException(f'A step named {name} already exists')
+
+        # file parameters
+        step_inputs, step_outputs = [], []
+        for par_name in task.par_names:
+            if not par_name in params:
+                continue
+            par = getattr(task, par_name)
+            if _is_output_file(par):
+                step_outputs += _step_files(params[par_name])
+            elif par.type in ['f', 'fr']:
+                step_inputs += _step_files(params[par_name])
+        step_inputs  += [os.path.abspath(f) for f in (inputs or [])]
+        step_outputs += [os.path.abspath(f) for f in (outputs or [])]
+
+        self.steps[name] = HSPStep(name, task, params, step_inputs, step_outputs,
+                                   after or [], kwargs)
+        return name
+
+
+    def _resolve(self):
+        """Find the dependencies of the steps, and check the graph
+
+        Returns:
+            list of step names in a topological order
+
+        """
+        producers = {}
+        for step in self.steps.values():
+            for out in step.outputs:
+                if out in producers:
+                    raise HSPTaskException(f'{out} is an output of both {producers[out]} and {step.name}')
+                producers[out] = step.name
+
+        for step in self.steps.values():
+            depends = [producers[f] for f in step.inputs if f in producers and producers[f] != step.name]
+            for other in step.after:
+                if not other in self.steps:
+                    raise HSPTaskException(f'Step {step.name} runs after an unknown step {other}')
+                depends.append(other)
+            step.depends = list(dict.fromkeys(depends))
+
+        # topological order, keeping the order of insertion when possible
+        order, state = [], {}
+        def _visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise HSPTaskException(f'The pipeline has a cycle: {" -> ".join(path + [name])}')
+            state[name] = 'visiting'
+            for other in self.steps[name].depends:
+                _visit(other, path + [name])
+            state[name] = 'done'
+            order.append(name)
+        for name in self.steps:
+            _visit(name, [])
+        return order
+
+
+    def _read_state(self):
+        """Read the state file of a previous run; {step_name: report}"""
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as fp:
+            return json.load(fp).get('steps', {})
+
+
+    def run(self, resume=False, report=None):
+        """Run the pipeline
+
+        Args:
+            resume: if True, skip the steps that succeeded in the previous run
+                (recorded in state_file) with the same task and parameters, if
+                their output files still exist.
+            report: name of a json file where the report of the run is written
+
+        Returns:
+            the report as a dict. The HSPResult of each step is in
+            self.steps[name].result.
+
+        """
+        order    = self._resolve()
+        previous = self._read_state() if resume else {}
+        t0       = time.time()
+
+        for name in order:
+            step = self.steps[name]
+            step.status, step.result, step.error, step.start, step.end = 'pending', None, None, None, None
+            prev = previous.get(name, {})
+            if (prev.get('status') in ['done', 'resumed'] and prev.get('signature') == step.signature
+                    and all([os.path.exists(f) for f in step.outputs])):
+                step.status = 'resumed'
+
+        if self.executor == 'process':
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+        running = {}
+        try:
+            while True:
+                # submit the steps whose dependencies are done
+                for name in order:
+                    step = self.steps[name]
+                    if step.status != 'pending':
+                        continue
+                    dep_status = [self.steps[other].status for other in step.depends]
+                    if any([s in ['failed', 'blocked'] for s in dep_status]):
+                        step.status = 'blocked'
+                        step.error  = 'a step it depends on failed'
+                    elif all([s in ['done', 'resumed'] for s in dep_status]):
+                        step.status = 'running'
+                        step.start  = time.time()
+                        future = pool.submit(_run_step, type(step.task), step.task.taskname,
+                                             step.params, step.kwargs)
+                        running[future] = step
+
+                # in topological order, a pass leaves no step pending if none is running
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    step.end = time.time()
+                    try:
+                        step.result = future.result()
+                        if step.result.returncode == 0:
+                            step.status = 'done'
+                        else:
+                            step.status = 'failed'
+                            step.error  = f'returncode={step.result.returncode}'
+                    except Exception as exc:
+                        step.status = 'failed'
+                        step.error  = f'{type(exc).__name__}: {exc}'
+                    self._write_state(t0)
+        finally:
+            # cancel_futures of shutdown needs python 3.9
+            for future in running:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+        run_report = self._report(t0, time.time())
+        self._write_state(t0)
+        if report is not None:
+            _write_json(report, run_report)
+        return run_report
+
+
+    def _report(self, start, end=None):
+        """The report of the run as a dict"""
+        steps  = {name: step.report() for name, step in self.steps.items()}
+        counts = {}
+        for step in steps.values():
+            counts[step['status']] = counts.get(step['status'], 0) + 1
+        return {
+            'pipeline' : self.name,
+            'start'    : start,
+            'end'      : end,
+            'duration' : None if end is None else end - start,
+            'success'  : all([s['status'] in ['done', 'resumed'] for s in steps.values()]),
+            'counts'   : counts,
+            'steps'    : steps,
+        }
+
+
+    def _write_state(self, start):
+        """Save the status of the steps in state_file"""
+        if self.state_file is not None:
+            _write_json(self.state_file, self._report(start))
+
+
+def _run_step(task_class, taskname, params, kwargs):
+    """Run one step in a private pfiles directory; this runs in the executor"""
+    with _pfiles_pool.scope():
+        task = task_class(name=taskname)
+        call_kwargs = {'noprompt': True}
+        call_kwargs.update(kwargs)
+        return task(dict(params), **call_kwargs)
+
+
+def _step_files(value):
+    """The absolute paths of the files in the value of a file parameter; see
+    core._file_names. These may not exist yet when the pipeline is built."""
+    return [os.path.abspath(name) for name in (_file_names(value) or [])]
+
+
+def _write_json(filename, data):
+    """Write data to a json file atomically"""
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpfile = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(data, fp, indent=2, default=str)
+    os.replace(tmpfile, filename)
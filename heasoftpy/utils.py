@@ -2,8 +2,13 @@ import sys
 import os
 import subprocess
 import glob
+import json
+import time
+import hashlib
 import logging
-from .core import HSPTask, HSPTaskException
+import concurrent.futures
+from .core import HSPTask, HSPTaskException, _pfiles_pool
+from .version import __version__
     
 
 
@@ -34,7 +39,7 @@ def process_cmdLine(hspTask=None):
     return args
 
 
-def generate_py_code(tasks=None):
+def generate_py_code(tasks=None, registry=False, nworkers=1, outdir=None, incremental=False):
     """Generate python code for the built-in heasoft tools
     
     This is meant to run once when installing the software.
@@ -45,6 +50,19 @@ def generate_py_code(tasks=None):
     Args:
         tasks: a list of task names. If None, generate for all in 
             $HEASDAS/syspfiles/*par
+        registry: If True, instead of one python module per task, write 
+            a single registry of the tasks (heasoftpy/fcn/_registry.json)
+            and their docstrings (heasoftpy/fcn/_registry_docs.txt). The 
+            wrappers are then created at runtime by heasoftpy.fcn.
+        nworkers: number of tasks to generate concurrently. Most of the time
+            is spent waiting for fhelp, so this uses a pool of threads.
+            The generated files do not depend on nworkers.
+        outdir: output directory. If None, use heasoftpy/fcn.
+        incremental: If True, use the manifest of the previous run (_manifest.json
+            in outdir), which has the hashes of the .par and help files of every 
+            task, to only generate the new and modified tasks. When tasks is None,
+            the wrappers of tasks that no longer exist are removed. The wrappers
+            of tasks that became python tools are always removed.
     
     Return:
         None
@@ -63,36 +81,264 @@ def generate_py_code(tasks=None):
         
     
     # list of tasks
+    all_tasks = tasks is None
     if tasks is None:
         par_files = glob.glob(f'{pfile_dir}/*.par')
-        tasks     = [os.path.basename(file[:-4]) for file in par_files]
+        tasks     = sorted([os.path.basename(file[:-4]) for file in par_files])
     else:
         if not isinstance(tasks, (list, )) and not isinstance(tasks[0], str):
             msg = 'tasks has to be a list of task names'
             logger.error(msg)
             raise HSPTaskException(msg)
     
+    outDir = os.path.join(os.path.dirname(__file__), 'fcn') if outdir is None else outdir
     
-    ntasks = len(tasks)
-    logger.info(f'Installying python wrappers. There are {ntasks} tasks!')
+    # if it is already a python tool, skip
+    pytasks = [task_name for task_name in tasks 
+               if os.path.exists(os.path.join(os.environ['HEADAS'], 'bin', f'{task_name}.py'))]
+    tasks   = [task_name for task_name in tasks if not task_name in pytasks]
     
-    # loop through the tasks and generate and save the code #
-    outDir = os.path.join(os.path.dirname(__file__), 'fcn')
+    # compare with the manifest of the previous run #
+    manifest = {'version': __version__, 'registry': registry, 'tasks': {}}
+    old_manifest = _read_manifest(outDir) if incremental else None
+    if not old_manifest is None and (old_manifest.get('version', None) != __version__ or 
+                                     old_manifest.get('registry', None) != registry):
+        logger.info('heasoftpy version or install mode changed. Generating all wrappers.')
+        old_manifest = None
+    old_registry = _read_registry(outDir) if registry else {}
     
-    for it,task_name in enumerate(tasks):
-        logger.info(f'.. {it+1}/{ntasks} install {task_name} ... ')
-        
-        # if it is already a python tool, skip
-        pytask = os.path.join(os.environ['HEADAS'], 'bin', f'{task_name}.py')
-        if os.path.exists(pytask):
-            logger.info(f'.. skipping python tools ... ')
-            continue
-        
+    hashes  = _task_hashes(tasks) if incremental else {}
+    keep    = []
+    if not old_manifest is None:
+        for task_name in tasks:
+            if old_manifest['tasks'].get(task_name, None) != hashes[task_name]:
+                continue
+            if registry:
+                exists = task_name in old_registry
+            else:
+                exists = os.path.exists(os.path.join(outDir, task_name.replace('-', '_') + '.py'))
+            if exists:
+                keep.append(task_name)
+                manifest['tasks'][task_name] = hashes[task_name]
+    
+    # tasks no longer in HEADAS
+    removed = []
+    if not old_manifest is None and all_tasks:
+        removed = [task_name for task_name in old_manifest['tasks'] 
+                   if not task_name in tasks and not task_name in pytasks]
+        for task_name in removed:
+            old_registry.pop(task_name, None)
+            logger.info(f'.. removed {task_name}')
+    # keep other tasks in the manifest when generating a subset of tasks
+    if not old_manifest is None and not all_tasks:
+        for task_name, thash in old_manifest['tasks'].items():
+            if not task_name in tasks and not task_name in pytasks:
+                manifest['tasks'][task_name] = thash
+    # tasks that became python tools; their wrappers are removed below
+    for task_name in pytasks:
+        old_registry.pop(task_name, None)
+    
+    to_generate = [task_name for task_name in tasks if not task_name in keep]
+    ntasks = len(to_generate)
+    logger.info(f'Installying python wrappers. There are {ntasks} tasks to generate, '
+                f'{len(keep)} unchanged and {len(pytasks)} python tools!')
+    
+    # generate the code (or docs for the registry) of every task #
+    def _generate(task_name):
         hsp = HSPTask(task_name)
-        fcn = hsp.generate_fcn_code()
-        with open(f'{outDir}/{hsp.pytaskname}.py', 'w') as fp: 
-            fp.write(fcn)
-        logger.info('done!')
+        txt = hsp._generate_fcn_docs(fhelp=True) if registry else hsp.generate_fcn_code()
+        return hsp, txt
+    
+    results  = {}
+    failed   = {}
+    tstart   = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, nworkers)) as executor:
+        futures = {executor.submit(_generate, task_name): task_name for task_name in to_generate}
+        for it,future in enumerate(concurrent.futures.as_completed(futures)):
+            task_name = futures[future]
+            try:
+                results[task_name] = future.result()
+            except Exception as exc:
+                failed[task_name] = exc
+                logger.error(f'.. {it+1}/{ntasks} failed {task_name}: {exc}')
+                continue
+            logger.info(f'.. {it+1}/{ntasks} generated {task_name}')
+    
+    # save the code; this is done in the order of tasks #
+    done = [task_name for task_name in to_generate if task_name in results]
+    if registry:
+        if not all_tasks:
+            keep += [task_name for task_name in old_registry if not task_name in tasks]
+        write_registry({task_name: results[task_name][0] for task_name in done}, outDir,
+                       docs={task_name: results[task_name][1] for task_name in done},
+                       keep={task_name: old_registry[task_name] for task_name in keep})
+        logger.info(f'Task registry written to {outDir}')
+        # modules from an install in the other mode would take precedence
+        for pyname in _wrapper_modules(outDir):
+            os.remove(os.path.join(outDir, f'{pyname}.py'))
+    else:
+        for task_name in done:
+            hsp, fcn = results[task_name]
+            with open(f'{outDir}/{hsp.pytaskname}.py', 'w') as fp: 
+                fp.write(fcn)
+        # prune the modules of tasks that no longer have a wrapper: all those not
+        # in tasks for a full install (e.g. left by an older version), and those
+        # of python tools otherwise. Failed tasks keep their previous module.
+        pynames = {task_name.replace('-', '_') for task_name in tasks}
+        stale   = {task_name.replace('-', '_') for task_name in pytasks}
+        for pyname in _wrapper_modules(outDir):
+            if (all_tasks and not pyname in pynames) or pyname in stale:
+                os.remove(os.path.join(outDir, f'{pyname}.py'))
+                logger.info(f'.. removed {pyname}.py')
+        for filename in ['_registry.json', '_registry_docs.txt']:
+            if os.path.exists(os.path.join(outDir, filename)):
+                os.remove(os.path.join(outDir, filename))
+    
+    # write the manifest; failed tasks are not included, so they are tried again #
+    if incremental:
+        for task_name in done:
+            manifest['tasks'][task_name] = hashes[task_name]
+        with open(os.path.join(outDir, '_manifest.json'), 'w') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+    
+    # summary #
+    logger.info(f'Generated {len(done)} wrappers, kept {len(keep)}, removed {len(removed)}, '
+                f'skipped {len(pytasks)} python tools and failed {len(failed)} tasks '
+                f'in {time.time()-tstart:.1f} seconds')
+    if len(failed) != 0:
+        msg = 'Failed in generating wrappers for: ' + ', '.join(
+                [task_name for task_name in tasks if task_name in failed])
+        logger.error(msg)
+        raise HSPTaskException(msg)
+
+
+def _wrapper_modules(outDir):
+    """The names of the generated wrapper modules in outDir, as in heasoftpy.fcn"""
+    return sorted([f[:-3] for f in os.listdir(outDir)
+                   if f.endswith('.py') and not f.startswith('__')])
+
+
+def _task_hashes(tasks):
+    """Hash the .par file and the help files of tasks
+    
+    The help files are searched for in $LHEA_HELP and $HEADAS/help, 
+    which is where fhelp looks for them.
+    
+    Args:
+        tasks: a list of task names
+    
+    Return:
+        dict of {task_name: {'par': hash, 'help': hash}}
+    """
+    
+    # index the help files by name once; e.g. ftlist: [ftlist.html]
+    help_files = {}
+    help_dirs  = [os.environ.get('LHEA_HELP', None), os.path.join(os.environ['HEADAS'], 'help')]
+    for hdir in help_dirs:
+        if hdir is None or not os.path.isdir(hdir):
+            continue
+        for f in sorted(os.listdir(hdir)):
+            if not os.path.isfile(os.path.join(hdir, f)):
+                continue
+            help_files.setdefault(os.path.splitext(f)[0], []).append(os.path.join(hdir, f))
+    
+    def _hash(files):
+        sha = hashlib.sha256()
+        for file in files:
+            with open(file, 'rb') as fp:
+                sha.update(fp.read())
+        return sha.hexdigest()
+    
+    pfile_dir = os.path.join(os.environ['HEADAS'], 'syspfiles')
+    hashes = {}
+    for task_name in tasks:
+        hashes[task_name] = {
+            'par' : _hash([os.path.join(pfile_dir, f'{task_name}.par')]),
+            'help': _hash(help_files.get(task_name, []))
+        }
+    return hashes
+
+
+def _read_manifest(outDir):
+    """Read the manifest written by generate_py_code, or None if absent or invalid"""
+    manifest_file = os.path.join(outDir, '_manifest.json')
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file) as fp:
+            manifest = json.load(fp)
+        if not isinstance(manifest.get('tasks', None), dict):
+            raise ValueError
+    except ValueError:
+        return None
+    return manifest
+
+
+def _read_registry(outDir):
+    """Read the task registry from outDir
+
+    Return:
+        dict of {task_name: (entry, docs)}
+    """
+    registry_file = os.path.join(outDir, '_registry.json')
+    docs_file     = os.path.join(outDir, '_registry_docs.txt')
+    if not os.path.exists(registry_file) or not os.path.exists(docs_file):
+        return {}
+    with open(registry_file) as fp:
+        entries = json.load(fp)['tasks']
+    with open(docs_file, 'rb') as fp:
+        docs = fp.read()
+    registry = {}
+    for task_name, entry in entries.items():
+        offset, length = entry['doc']
+        registry[task_name] = (entry, docs[offset:offset+length].decode())
+    return registry
+
+
+def write_registry(hsp_tasks, outDir, docs=None, keep=None):
+    """Write a registry of tasks to be used by heasoftpy.fcn
+    
+    Two files are written:
+    - _registry.json: {'tasks': {task_name: entry}}, where entry is a dict
+        of the task's name, its pyname, and 'doc': the [offset, length] of 
+        the task's docstring in _registry_docs.txt. The parameters are not
+        stored; the wrappers read the .par files when called.
+    - _registry_docs.txt: the utf-8 docstrings of all tasks.
+    
+    Args:
+        hsp_tasks: a dict of {task_name: HSPTask}
+        outDir: output directory; typically heasoftpy/fcn
+        docs: a dict of {task_name: docstring}. If None, or a task is missing,
+            the docstring is generated with fhelp.
+        keep: a dict of {task_name: (entry, docstring)} of tasks from an 
+            existing registry to be written without change.
+    
+    Return:
+        None
+    """
+    
+    docs    = {} if docs is None else docs
+    keep    = {} if keep is None else keep
+    entries = {}
+    offset  = 0
+    with open(os.path.join(outDir, '_registry_docs.txt'), 'wb') as fp:
+        for task_name in sorted(set(hsp_tasks.keys()) | set(keep.keys())):
+            if task_name in hsp_tasks:
+                hsp   = hsp_tasks[task_name]
+                tdocs = docs[task_name] if task_name in docs else hsp._generate_fcn_docs(fhelp=True)
+                entry = {'name': task_name, 'pyname': hsp.pytaskname}
+            else:
+                entry, tdocs = keep[task_name]
+                entry = dict(entry)
+            
+            tdocs = tdocs.encode()
+            fp.write(tdocs)
+            entry['doc'] = [offset, len(tdocs)]
+            entries[task_name] = entry
+            offset += len(tdocs)
+    
+    with open(os.path.join(outDir, '_registry.json'), 'w') as fp:
+        json.dump({'tasks': entries}, fp, indent=0)
     
 
 def local_pfiles(par_dir=None):
@@ -101,6 +347,8 @@ def local_pfiles(par_dir=None):
     This is useful for scripting and running many tasks at the same time
     so that the tasks do not overwrite each other's pfiles.
     See https://heasarc.gsfc.nasa.gov/lheasoft/scripting.html.
+    This modifies os.environ for the whole process; for threads 
+    running tasks concurrently, use pfiles_scope instead.
     
     Args:
         par_dir: a user-specified directory. None means create a temporary
@@ -138,4 +386,24 @@ def local_pfiles(par_dir=None):
     # if we make here, things are good, so add pDir to PFILES
     sep = ':' if ';' in os.environ["PFILES"] else ';'
     os.environ['PFILES'] = f'{pDir}{sep}{os.environ["PFILES"]}'
-    return pDir
\ No newline at end of file
+    return pDir
+
+
+def pfiles_scope():
+    """Context manager to run tasks with a private pfiles directory
+    
+    Unlike local_pfiles, this does not modify os.environ and is thread-safe:
+    tasks called inside the scope, in the same thread (or asyncio task), 
+    write their user .par file in a private directory, which is passed to 
+    the task process as the user part of PFILES. The directories are 
+    emptied and reused when a scope ends.
+    
+    Example:
+        >>> with hsp.utils.pfiles_scope() as pdir:
+        >>>     result = hsp.ftlist(infile='input.fits', option='T')
+    
+    Returns:
+        A context manager that gives the path of the private pfiles directory
+    
+    """
+    return _pfiles_pool.scope()
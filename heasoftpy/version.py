@@ -14,6 +14,24 @@
 # 1.2      | TBD         | - Several bug fixes handling special cases in reading parameter files.
 #          |             | - Moved ixpe to main heaosft build, the final installation remains
 #          |             | under heasoftpy.
+#          |             | - Cache parsed .par files across HSPTask instances.
+#          |             | - Lazy loading of the task wrappers, and faster installation.
+#          |             | - Persistent cache of the fhelp text.
+#          |             | - Faster output capture in verbose mode; stderr is no longer
+#          |             | cut when stdout closes first.
+#          |             | - output_policy to spill large task output to disk, or keep
+#          |             | only its head and tail.
+#          |             | - HSPTask.stream; cached HSPResult.output, and parsed views
+#          |             | HSPResult.table and HSPResult.keywords.
+#          |             | - workers.HSPWorkerPool to run python tasks in warm processes.
+#          |             | - cache.HSPResultCache to reuse the results of read-only tasks.
+#          |             | - incremental=True to skip tasks with up-to-date outputs.
+#          |             | - pipeline.HSPPipeline to run dependent tasks as a graph.
+#          |             | - User .par files are written atomically, and only when changed.
+#          |             | - timing=True to record the phases of a call in HSPResult.timing.
+#          |             | - hooks run before and after task calls; metrics.HSPMetrics to
+#          |             | count calls and durations, with json and Prometheus export.
+#          |             | - Task wrappers reuse a task instance per thread.
 #
 
 __version__ = '1.2'
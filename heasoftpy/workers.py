@@ -0,0 +1,329 @@
+"""A pool of warm python processes to run python-only heasoft tasks.
+
+Python tasks installed as $HEADAS/bin/{task}.py are run by HSPTask.exec_task
+as `python {task}.py par=value ...`, and every call pays the start-up of the
+interpreter and the import of heasoftpy and its dependencies. HSPWorkerPool
+keeps worker processes alive with heasoftpy already imported, and runs the
+task scripts in them with runpy.
+
+To use it for all tasks:
+>>> import heasoftpy as hsp
+>>> from heasoftpy.workers import HSPWorkerPool
+>>> hsp.HSPTask.python_executor = HSPWorkerPool(max_workers=4)
+
+Each run uses the working directory and environment (including PFILES) of
+the call, and the output of the script, at the file-descriptor level, is
+captured and returned once it is done. A worker is replaced after running
+max_tasks scripts, or when its memory usage (max RSS) goes above max_rss.
+
+Unlike a task run in its own process:
+- the full output of a script is kept in memory (in the worker, then in the
+  caller) until it is done. output_policy and max_output only apply to the
+  returned HSPResult, after that, so tasks with a very large output should 
+  not use the pool.
+- modules imported by a script (and their state) stay loaded in the worker,
+  and are seen by the next scripts it runs. Scripts that rely on a fresh
+  interpreter need a pool with max_tasks=1.
+
+"""
+import os
+import sys
+import pickle
+import struct
+import atexit
+import logging
+import threading
+import subprocess
+import tempfile
+import runpy
+import resource
+
+from .core import HSPTaskException, HSPLogger
+
+
+_header = struct.Struct('<Q')
+
+
+def _send(fp, obj):
+    """Write a pickled message to the file object fp"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    fp.write(_header.pack(len(data)) + data)
+    fp.flush()
+
+
+def _recv(fp):
+    """Read a pickled message from the file object fp; None at EOF"""
+    header = fp.read(_header.size)
+    if len(header) < _header.size:
+        return None
+    size = _header.unpack(header)[0]
+    data = fp.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+
+class _Worker:
+    """A worker process, seen from the parent"""
+
+    def __init__(self, preload=()):
+        self.ntasks = 0
+        # make sure the worker imports this heasoftpy
+        env  = dict(os.environ)
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([path] + 
+                    ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        self.proc   = subprocess.Popen([sys.executable, '-m', 'heasoftpy.workers'] + list(preload),
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    def run(self, job):
+        """Send a job to the worker and return its reply"""
+        self.ntasks += 1
+        try:
+            _send(self.proc.stdin, job)
+            reply = _recv(self.proc.stdout)
+        except (OSError, ValueError):
+            reply = None
+        if reply is None:
+            self.stop()
+            raise HSPTaskException(f'The worker process running {job["script"]} died '
+                                   f'with code {self.proc.returncode}')
+        return reply
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        """Stop the worker; closing its input makes it exit"""
+        for fp in [self.proc.stdin, self.proc.stdout]:
+            try:
+                fp.close()
+            except OSError:
+                pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class HSPWorkerPool:
+    """A pool of warm python processes to run python task scripts
+
+    It can be set as HSPTask.python_executor, and is safe to use from
+    several threads (e.g. HSPTask.map).
+
+    """
+
+    def __init__(self, max_workers=None, max_tasks=100, max_rss=1024**3, 
+                 preload=('numpy', 'astropy.io.fits')):
+        """Create a pool. Workers are started when first needed.
+
+        Args:
+            max_workers: maximum number of worker processes. Default is the number of CPUs
+            max_tasks: replace a worker after it runs this number of tasks
+            max_rss: replace a worker when its max RSS goes above this number of bytes
+            preload: modules imported by the workers when they start, in addition 
+                to heasoftpy. Modules that are not installed are skipped.
+
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.preload     = tuple(preload)
+        self.max_tasks   = max_tasks
+        self.max_rss     = max_rss
+        self._idle       = []
+        self._nworkers   = 0
+        self._cond       = threading.Condition()
+        self._closed     = False
+        atexit.register(self.close)
+
+
+    def _acquire(self):
+        """Get an idle worker, starting one if possible, or wait for one"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise HSPTaskException('The worker pool is closed')
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive():
+                        return worker
+                    self._nworkers -= 1
+                if self._nworkers < self.max_workers:
+                    self._nworkers += 1
+                    break
+                self._cond.wait()
+        try:
+            return _Worker(self.preload)
+        except Exception:
+            with self._cond:
+                self._nworkers -= 1
+                self._cond.notify()
+            raise
+
+
+    def _release(self, worker, recycle):
+        """Return a worker to the pool, or stop it if recycle is True"""
+        with self._cond:
+            if recycle or self._closed or not worker.alive():
+                self._nworkers -= 1
+            else:
+                self._idle.append(worker)
+                worker = None
+            self._cond.notify()
+        if worker is not None:
+            worker.stop()
+
+
+    def run(self, script, args, env=None, cwd=None, stderr=False):
+        """Run a python script in a worker
+
+        Args:
+            script: path to the script
+            args: list of command line arguments
+            env: dict of environment variables. Default is os.environ
+            cwd: working directory. Default is the current directory
+            stderr: if True, capture stderr separately
+
+        Returns:
+            (returncode, stdout, stderr): the output is bytes; stderr is
+                None if not captured separately.
+
+        """
+        job = {'script': script, 'args': list(args),
+               'env': dict(os.environ if env is None else env),
+               'cwd': os.getcwd() if cwd is None else cwd, 'stderr': stderr}
+        worker = self._acquire()
+        recycle = True
+        try:
+            reply = worker.run(job)
+            recycle = (worker.ntasks >= self.max_tasks or reply['maxrss'] > self.max_rss)
+        finally:
+            self._release(worker, recycle)
+        return reply['returncode'], reply['stdout'], reply['stderr']
+
+
+    def close(self):
+        """Stop all the workers"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._nworkers -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ---------------------------------------- #
+# the worker side; python -m heasoftpy.workers
+# ---------------------------------------- #
+def _run_job(job):
+    """Run a job in the worker process, and return the reply"""
+
+    # isolate: working directory, environment and command line
+    old_cwd, old_env = os.getcwd(), dict(os.environ)
+    old_argv, old_path = sys.argv, list(sys.path)
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile() if job['stderr'] else out
+    old_fds = os.dup(1), os.dup(2)
+    returncode = 0
+    try:
+        os.chdir(job['cwd'])
+        os.environ.clear()
+        os.environ.update(job['env'])
+        sys.argv = [job['script']] + job['args']
+        sys.path.insert(0, os.path.dirname(job['script']))
+
+        # redirect at the file-descriptor level, so output of
+        # extensions and subprocesses is captured too
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            runpy.run_path(job['script'], run_name='__main__')
+        except SystemExit as exc:
+            code = exc.code
+            if code is None:
+                returncode = 0
+            elif isinstance(code, int):
+                returncode = code
+            else:
+                print(code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            returncode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(old_fds[0], 1)
+        os.dup2(old_fds[1], 2)
+        for fd in old_fds:
+            os.close(fd)
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+        sys.argv, sys.path[:] = old_argv, old_path
+        _reset_loggers()
+
+    reply = {'returncode': returncode, 'stdout': _read_all(out),
+             'stderr': _read_all(err) if job['stderr'] else None,
+             'maxrss': _maxrss()}
+    out.close()
+    err.close()
+    return reply
+
+
+def _maxrss():
+    """The max RSS of this process in bytes; ru_maxrss is in bytes on macOS, kB elsewhere"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _read_all(fp):
+    fp.seek(0)
+    return fp.read()
+
+
+def _reset_loggers():
+    """Remove the handlers set up by HSPLogger for a task, so they are not reused"""
+    for logger in list(logging.root.manager.loggerDict.values()):
+        if isinstance(logger, HSPLogger):
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            logger.isSetup = False
+
+
+def _worker_main():
+    """Main loop of a worker: read jobs from stdin, write replies to stdout"""
+    # keep the pipes to the parent, and hide them from the tasks
+    proto_in  = os.fdopen(os.dup(0), 'rb')
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    # import what the task scripts typically need
+    import heasoftpy
+    for module in sys.argv[1:]:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    while True:
+        job = _recv(proto_in)
+        if job is None:
+            break
+        _send(proto_out, _run_job(job))
+
+
+if __name__ == '__main__':
+    _worker_main()
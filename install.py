@@ -61,10 +61,19 @@ def _create_py_wrappers():
     from heasoftpy.utils import generate_py_code
     
     
+    # HEASOFTPY_INSTALL_MODE=registry installs a single registry of tasks
+    # instead of one python module per task in heasoftpy/fcn
+    registry = os.environ.get('HEASOFTPY_INSTALL_MODE', 'modules') == 'registry'
+    
+    # HEASOFTPY_NWORKERS sets the number of wrappers generated in parallel
+    nworkers = int(os.environ.get('HEASOFTPY_NWORKERS', os.cpu_count() or 1))
+    
     logger.info('-'*30)
-    logger.info('Creating python wrappers ...')
+    logger.info(f'Creating python wrappers {"registry " if registry else ""}...')
     try:
-        generate_py_code()
+        # only new or modified tasks are generated; `python setup.py clean` 
+        # removes the manifest to force generating all the wrappers
+        generate_py_code(registry=registry, nworkers=nworkers, incremental=True)
     except:
         logger.error('Failed in generating python wrappers')
         raise
@@ -26,6 +26,8 @@ class HSPCleanCommand(clean):
         fcn = os.path.join('heasoftpy', 'fcn')
         print(f'cleaning wrappers in {fcn}')
         filelist = [f for f in os.listdir(fcn) if '.py' == f[-3:] and not '__' in f]
+        filelist += [f for f in ['_registry.json', '_registry_docs.txt', '_manifest.json'] 
+                     if os.path.exists(os.path.join(fcn, f))]
         for f in filelist:
             file = os.path.join(fcn, f)
             print(f'removing {file}')
@@ -76,8 +78,11 @@ setup(
     url='https://heasarc.gsfc.nasa.gov/docs/software/heasoft',
     license=license,
     packages=find_packages(exclude=('tests', 'notebooks', 'template')),
+    package_data={'heasoftpy.fcn': ['_registry.json', '_registry_docs.txt']},
     python_requires=">=3.7",
     install_requires=build_requirements(),
+    # numpy is only needed by HSPResult.table
+    extras_require={'numpy': ['numpy']},
     
     cmdclass={
         'build_py': HSPInstallCommand,
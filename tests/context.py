@@ -2,6 +2,63 @@
 
 import sys
 import os
+import shutil
+import unittest
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import heasoftpy
+
+
+class HeadasTestCase(unittest.TestCase):
+    """A TestCase with a temporary HEADAS tree of stub tasks
+
+    The tree, /tmp/{pid}.{headas_name}.tmp, has syspfiles, bin and pfiles
+    directories. It is used as $HEADAS, with PFILES set to its pfiles and
+    syspfiles, for all the tests of the class. Subclasses add their stub
+    tasks in setUpHeadas, with add_task.
+    """
+
+    headas_name = 'headas'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.headas = os.environ['HEADAS']
+        cls.pfiles = os.environ['PFILES']
+
+        hDir = os.path.join('/tmp', f'{os.getpid()}.{cls.headas_name}.tmp')
+        for sub in ['syspfiles', 'bin', 'pfiles']:
+            os.makedirs(f'{hDir}/{sub}')
+        os.environ['HEADAS'] = hDir
+        os.environ['PFILES'] = f'{hDir}/pfiles;{hDir}/syspfiles'
+        cls.hDir = hDir
+        cls.setUpHeadas()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.hDir)
+        os.environ['HEADAS'] = cls.headas
+        os.environ['PFILES'] = cls.pfiles
+
+    @classmethod
+    def setUpHeadas(cls):
+        """Add the stub tasks of the tests; cls.hDir is the HEADAS tree"""
+        pass
+
+    @classmethod
+    def add_task(cls, name, par, script=None, filename=None):
+        """Add a task to the HEADAS tree
+
+        Args:
+            name: name of the task
+            par: text of its .par file
+            script: text of its executable in bin, if any
+            filename: name of the executable; default is name
+
+        """
+        with open(f'{cls.hDir}/syspfiles/{name}.par', 'w') as fp:
+            fp.write(par)
+        if script is not None:
+            exe = f'{cls.hDir}/bin/{filename or name}'
+            with open(exe, 'w') as fp:
+                fp.write(script)
+            os.chmod(exe, 0o755)
@@ -0,0 +1,201 @@
+
+from .context import heasoftpy, HeadasTestCase
+
+import unittest
+import os
+import shutil
+import time
+
+
+class TestDiskCache(unittest.TestCase):
+    """Tests for the persistent caches"""
+    
+    def setUp(self):
+        self.cDir = os.path.join('/tmp', str(os.getpid()) + '.cache.tmp')
+        self.cache = heasoftpy.cache.HSPDiskCache('test', max_size=1000, directory=self.cDir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.cDir, ignore_errors=True)
+    
+    # put and get
+    def test__disk_cache__put_get(self):
+        self.assertIsNone(self.cache.get('key1'))
+        self.cache.put('key1', b'value1')
+        self.assertEqual(self.cache.get('key1'), b'value1')
+        self.assertEqual(self.cache.info()['entries'], 1)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key1'))
+    
+    # least recently used entries are evicted first
+    def test__disk_cache__evict(self):
+        for ikey in range(4):
+            self.cache.put(f'key{ikey}', b'x'*200)
+            os.utime(self.cache._path(f'key{ikey}'), ns=(ikey*10**9, ikey*10**9))
+        # use key0, so key1 becomes the oldest
+        self.cache.get('key0')
+        self.cache.put('key4', b'x'*300)
+        self.assertIsNone(self.cache.get('key1'))
+        self.assertIsNotNone(self.cache.get('key0'))
+        self.assertIsNotNone(self.cache.get('key4'))
+        self.assertLessEqual(self.cache.info()['size'], 1000)
+    
+    # unusable directory
+    def test__disk_cache__no_dir(self):
+        cache = heasoftpy.cache.HSPDiskCache('test', directory='/proc/no-cache')
+        cache.put('key1', b'value1')
+        self.assertIsNone(cache.get('key1'))
+
+
+class TestDocsCache(HeadasTestCase):
+    """Tests for caching fhelp text"""
+    
+    headas_name = 'docs'
+    
+    @classmethod
+    def setUpHeadas(cls):
+        os.makedirs(f'{cls.hDir}/help')
+        # fhelp counts how many times it is called
+        cls.add_task('docstask', 'infile,s,a,,,,"Name"')
+        with open(f'{cls.hDir}/bin/fhelp', 'w') as fp:
+            fp.write(f'#!/bin/sh\necho called >> {cls.hDir}/fhelp.calls\necho "NAME $1"\n')
+        os.chmod(f'{cls.hDir}/bin/fhelp', 0o755)
+        
+        cls.docs_cache = heasoftpy.HSPTask.docs_cache
+        heasoftpy.HSPTask.docs_cache = heasoftpy.cache.HSPDiskCache(
+            'docs', directory=f'{cls.hDir}/cache')
+        
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        heasoftpy.HSPTask.docs_cache = cls.docs_cache
+    
+    def _ncalls(self):
+        with open(f'{self.hDir}/fhelp.calls') as fp:
+            return len(fp.readlines())
+    
+    # fhelp is called once, and again when the help file changes
+    def test__docs_cache__task_docs(self):
+        task = heasoftpy.HSPTask('docstask')
+        docs = task.task_docs()
+        self.assertIn('NAME task=docstask', docs)
+        self.assertEqual(task.task_docs(), docs)
+        self.assertEqual(self._ncalls(), 1)
+        
+        with open(f'{self.hDir}/help/docstask.html', 'w') as fp: fp.write('help')
+        self.assertEqual(task.task_docs(), docs)
+        self.assertEqual(self._ncalls(), 2)
+
+
+class TestResultCache(HeadasTestCase):
+    """Tests for caching task results"""
+    
+    headas_name = 'results'
+    
+    @classmethod
+    def setUpHeadas(cls):
+        hDir = cls.hDir
+        # readtask prints its input file, and counts how many times it is called
+        cls.add_task('readtask', 'infile,f,a,,,,"Input"\nvalue,s,h,"",,,"Output value"\n'
+                     'outfile,f,h,"-",,,"Output file, or - for the screen"',
+                     f'#!/bin/sh\necho called >> {hDir}/readtask.calls\n'
+                     f'infile=${{1#infile=}}\ncat ${{infile%%[*}}\n'
+                     f'sed -i "s/^value,s,h,[^,]*,/value,s,h,\\"done\\",/" {hDir}/pfiles/readtask.par\n'
+                     f'outfile=${{3#outfile=}}\ncase $outfile in -|STDOUT) ;; *) echo written > $outfile;; esac\n')
+    
+    def setUp(self):
+        self.cache = heasoftpy.cache.HSPResultCache(
+            tasks=['readtask'], directory=f'{self.hDir}/cache')
+        self.cache.clear()
+        heasoftpy.HSPTask.result_cache = self.cache
+        if os.path.exists(f'{self.hDir}/readtask.calls'):
+            os.remove(f'{self.hDir}/readtask.calls')
+        self.infile = f'{self.hDir}/input.txt'
+        self._write_input('content 1')
+    
+    def tearDown(self):
+        heasoftpy.HSPTask.result_cache = None
+    
+    def _write_input(self, text, mtime=1e9):
+        # old files, so they are not too recent to be trusted
+        with open(self.infile, 'w') as fp:
+            fp.write(text)
+        os.utime(self.infile, (mtime, mtime))
+    
+    def _ncalls(self):
+        if not os.path.exists(f'{self.hDir}/readtask.calls'):
+            return 0
+        with open(f'{self.hDir}/readtask.calls') as fp:
+            return len(fp.readlines())
+    
+    # a second identical call is returned from the cache, 
+    # with the parameters updated by the task
+    def test__result_cache__hit(self):
+        res1 = heasoftpy.HSPTask('readtask')(infile=self.infile)
+        self.assertEqual(res1.stdout, 'content 1')
+        self.assertFalse(res1.cached)
+        
+        task = heasoftpy.HSPTask('readtask')
+        os.remove(f'{self.hDir}/pfiles/readtask.par')
+        res2 = task(infile=self.infile)
+        self.assertTrue(res2.cached)
+        self.assertEqual(res2.stdout, res1.stdout)
+        self.assertEqual(res2.params, res1.params)
+        self.assertEqual(task.value.value, 'done')
+        self.assertTrue(os.path.exists(f'{self.hDir}/pfiles/readtask.par'))
+        self.assertEqual(self._ncalls(), 1)
+        
+        # extension specifications refer to the same file
+        res3 = heasoftpy.HSPTask('readtask')(infile=self.infile + '[1]')
+        self.assertFalse(res3.cached)
+        self.assertEqual(self._ncalls(), 2)
+        
+        # output to the screen is cached
+        heasoftpy.HSPTask('readtask')(infile=self.infile, outfile='STDOUT')
+        res4 = heasoftpy.HSPTask('readtask')(infile=self.infile, outfile='STDOUT')
+        self.assertTrue(res4.cached)
+        self.assertEqual(self._ncalls(), 3)
+        
+        # and so is that of a stream
+        with heasoftpy.HSPTask('readtask').stream(infile=self.infile, outfile='STDOUT') as stream:
+            self.assertEqual(list(stream), [('stdout', 'content 1')])
+        self.assertTrue(stream.result.cached)
+        self.assertEqual(self._ncalls(), 3)
+    
+    # calls writing an output file always run, so the file is written
+    def test__result_cache__output_file(self):
+        outfile = f'{self.hDir}/out.txt'
+        for _ in range(2):
+            res = heasoftpy.HSPTask('readtask')(infile=self.infile, outfile=outfile)
+            self.assertFalse(res.cached)
+            self.assertTrue(os.path.exists(outfile))
+            os.remove(outfile)
+        self.assertEqual(self._ncalls(), 2)
+    
+    # the task runs again when the input changes
+    def test__result_cache__input_changed(self):
+        heasoftpy.HSPTask('readtask')(infile=self.infile)
+        self._write_input('content 2', mtime=2e9)
+        res = heasoftpy.HSPTask('readtask')(infile=self.infile)
+        self.assertFalse(res.cached)
+        self.assertEqual(res.stdout, 'content 2')
+        
+        # recently modified files are not trusted
+        self._write_input('content 3', mtime=time.time())
+        heasoftpy.HSPTask('readtask')(infile=self.infile)
+        res = heasoftpy.HSPTask('readtask')(infile=self.infile)
+        self.assertFalse(res.cached)
+        self.assertEqual(self._ncalls(), 4)
+    
+    # tasks not in the allowlist are not cached
+    def test__result_cache__allowlist(self):
+        self.cache.tasks = {'readtask': lambda params: params.get('infile') != self.infile}
+        heasoftpy.HSPTask('readtask')(infile=self.infile)
+        res = heasoftpy.HSPTask('readtask')(infile=self.infile)
+        self.assertFalse(res.cached)
+        self.assertEqual(self._ncalls(), 2)
+        self.assertFalse(self.cache.allows('ftcopy', {}))
+        self.assertTrue(heasoftpy.cache.HSPResultCache().allows('ftlist', {}))
+
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,484 @@
+
+from .context import heasoftpy, HeadasTestCase
+
+import unittest
+import unittest.mock
+import os
+import time
+import threading
+import concurrent.futures
+import subprocess
+import sys
+import asyncio
+
+
+class TestExec(HeadasTestCase):
+    """Tests for running tasks, using a HEADAS tree with stub executables"""
+    
+    headas_name = 'exec'
+    
+    @classmethod
+    def setUpHeadas(cls):
+        # echotask prints PFILES and its arguments
+        cls.add_task('echotask', 'infile,s,a,,,,"Name"\nnumber,i,h,1,,,"Number"\nmode,s,h,"ql",,,',
+                     '#!/bin/sh\necho "PFILES=$PFILES"\nfor a in "$@"; do echo "$a"; done\n')
+        
+        # errtask writes to both stdout and stderr
+        cls.add_task('errtask', 'infile,s,h,"none",,,"Name"',
+                     '#!/bin/sh\necho "to stdout"\necho "to stderr" 1>&2\nexit 3\n')
+        
+        # latetask closes stdout, then writes multi-byte text to stderr
+        cls.add_task('latetask', 'infile,s,h,"none",,,"Name"',
+                     '#!/bin/sh\necho "to stdout"\nexec 1>&-\nsleep 0.2\n'
+                     'i=0; while [ $i -lt 20000 ]; do echo "été → $i" 1>&2; i=$((i+1)); done\n')
+        
+        # pytask is a python script, printing its pid, cwd, PFILES and arguments
+        cls.add_task('pytask', 'infile,s,a,,,,"Name"\nretcode,i,h,0,,,"Exit code"',
+                     'import os, sys\nprint(os.getpid())\nprint(os.getcwd())\n'
+                     'print(os.environ["PFILES"])\nprint(*sys.argv[1:])\n'
+                     'print("to stderr", file=sys.stderr)\nos.system("echo from child")\n'
+                     'sys.exit(int(sys.argv[2].split("=")[1]))\n', filename='pytask.py')
+        
+        # copytask copies infile to outfile
+        cls.add_task('copytask', 'infile,f,a,,,,"Input"\noutfile,fw,a,,,,"Output"',
+                     '#!/bin/sh\necho copying\ncp ${1#infile=} ${2#outfile=}\n')
+        
+        # settask rewrites its user .par file in place, with a value of the same size
+        cls.add_task('settask', 'value,s,a,,,,"Value"\nmode,s,h,"ql",,,',
+                     '#!/bin/sh\nprintf \'value,s,a,bbb,,,"Value"\\nmode,s,h,ql,,,""\\n\' '
+                     '> ${PFILES%%;*}/settask.par\n')
+        
+        # notask has a .par file but no executable
+        cls.add_task('notask', 'infile,s,a,,,,"Name"')
+    
+    def setUp(self):
+        # start each test with no user .par files
+        for f in os.listdir(f'{self.hDir}/pfiles'):
+            os.remove(f'{self.hDir}/pfiles/{f}')
+    
+    # run a task
+    def test__exec__simple(self):
+        task = heasoftpy.HSPTask('echotask')
+        res  = task(infile='IN_FILE', number=3)
+        self.assertEqual(res.returncode, 0)
+        self.assertIn('infile=IN_FILE', res.output)
+        self.assertIn('number=3', res.output)
+    
+    # map runs in order, with a private pfiles directory
+    def test__exec__map(self):
+        task = heasoftpy.HSPTask('echotask')
+        params = [{'infile': f'file{i}', 'number': i} for i in range(8)]
+        results = task.map(params, max_workers=4, noprompt=True)
+        self.assertEqual(len(results), 8)
+        for i, res in enumerate(results):
+            self.assertEqual(res.returncode, 0)
+            self.assertIn(f'infile=file{i}', res.output)
+            pfiles = res.output[0][len('PFILES='):]
+            self.assertNotIn(f'{self.hDir}/pfiles', pfiles)
+            self.assertTrue(pfiles.endswith(f';{self.hDir}/syspfiles'))
+        # the user .par file is not touched
+        self.assertFalse(os.path.exists(f'{self.hDir}/pfiles/echotask.par'))
+    
+    # map failures are returned, or raised
+    def test__exec__map_errors(self):
+        task = heasoftpy.HSPTask('notask')
+        results = task.map([{'infile': 'file1'}])
+        self.assertEqual(results[0].returncode, -1)
+        self.assertIsInstance(results[0].custom['exception'], heasoftpy.HSPTaskException)
+        with self.assertRaises(heasoftpy.HSPTaskException):
+            task.map([{'infile': 'file1'}], raise_errors=True)
+
+    
+    # tasks in a pfiles scope use a private directory
+    def test__exec__pfiles_scope(self):
+        task = heasoftpy.HSPTask('echotask')
+        with heasoftpy.utils.pfiles_scope() as pdir:
+            res = task(infile='IN_FILE')
+            self.assertTrue(os.path.exists(f'{pdir}/echotask.par'))
+        self.assertEqual(res.output[0], f'PFILES={pdir};{self.hDir}/syspfiles')
+        self.assertEqual(os.environ['PFILES'], f'{self.hDir}/pfiles;{self.hDir}/syspfiles')
+        self.assertFalse(os.path.exists(f'{self.hDir}/pfiles/echotask.par'))
+        
+        # directories are emptied and reused
+        self.assertEqual(os.listdir(pdir), [])
+        with heasoftpy.utils.pfiles_scope() as pdir2:
+            self.assertEqual(pdir, pdir2)
+    
+    # concurrent scopes use different directories
+    def test__exec__pfiles_scope_threads(self):
+        pdirs = []
+        barrier = threading.Barrier(4)
+        def _run():
+            with heasoftpy.utils.pfiles_scope() as pdir:
+                barrier.wait()
+                res = heasoftpy.HSPTask('echotask')(infile=pdir)
+                pdirs.append((pdir, res.output[0]))
+        threads = [threading.Thread(target=_run) for _ in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEqual(len(set([p[0] for p in pdirs])), 4)
+        for pdir, out in pdirs:
+            self.assertEqual(out, f'PFILES={pdir};{self.hDir}/syspfiles')
+
+    
+    # acall gives the same results as a call
+    def test__exec__acall(self):
+        async def _run():
+            tasks = [heasoftpy.HSPTask('echotask') for _ in range(5)]
+            return await asyncio.gather(*[task.acall(infile=f'file{i}', number=i) 
+                                          for i,task in enumerate(tasks)])
+        results = asyncio.run(_run())
+        for i, res in enumerate(results):
+            sres = heasoftpy.HSPTask('echotask')(infile=f'file{i}', number=i)
+            self.assertEqual(res.returncode, 0)
+            self.assertEqual(res.stdout, sres.stdout)
+            self.assertEqual(res.params, sres.params)
+        
+        # concurrent calls write their .par file in their own scope
+        async def _scoped(i):
+            with heasoftpy.utils.pfiles_scope() as pdir:
+                res = await heasoftpy.HSPTask('echotask').acall(infile=f'file{i}', number=i)
+                with open(f'{pdir}/echotask.par') as fp:
+                    return pdir, res.returncode, f'file{i}' in fp.read()
+        async def _run_scoped():
+            return await asyncio.gather(*[_scoped(i) for i in range(5)])
+        results = asyncio.run(_run_scoped())
+        self.assertEqual([res[1:] for res in results], [(0, True)] * 5)
+        self.assertEqual(len({res[0] for res in results}), 5)
+    
+    # acall with separate stderr and a logfile
+    def test__exec__acall_stderr(self):
+        task = heasoftpy.HSPTask('errtask')
+        logfile = f'{self.hDir}/errtask.log'
+        res = asyncio.run(task.acall(stderr=True, verbose=20, logfile=logfile))
+        self.assertEqual(res.returncode, 3)
+        self.assertEqual(res.stdout, 'to stdout\n')
+        self.assertEqual(res.stderr, 'to stderr\n')
+        with open(logfile) as fp:
+            self.assertEqual(sorted(fp.readlines()), ['to stderr\n', 'to stdout\n'])
+
+    # asyncio is only imported by acall
+    def test__exec__acall_import(self):
+        code = 'import sys, heasoftpy; print("asyncio" in sys.modules)'
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(heasoftpy.__file__)))
+        self.assertEqual(out.stdout, 'False\n')
+
+
+    # stderr is read until its end, after stdout is closed, with 
+    # multi-byte characters split between chunks
+    def test__exec__io_stream(self):
+        expected = ''.join([f'été → {i}\n' for i in range(20000)])
+        logfile  = f'{self.hDir}/latetask.log'
+        for verbose in [0, 20]:
+            task = heasoftpy.HSPTask('latetask')
+            res  = task(stderr=True, verbose=verbose, logfile=logfile)
+            self.assertEqual(res.returncode, 0)
+            self.assertEqual(res.stdout, 'to stdout\n')
+            self.assertEqual(res.stderr, expected)
+        with open(logfile, encoding='utf-8') as fp:
+            self.assertEqual(fp.read(), 'to stdout\n' + expected)
+        os.remove(logfile)
+    
+    # the text printed to the screen is decoded incrementally
+    def test__exec__output_capture(self):
+        import io
+        from heasoftpy.core import _OutputCapture
+        screen = io.StringIO()
+        capture = _OutputCapture(False, 1, None)
+        capture._screens = (screen, screen)
+        data = 'é→x'.encode() * 1000
+        for i in range(0, len(data), 7):
+            capture.add(data[i:i+7])
+        capture.close()
+        self.assertEqual(screen.getvalue(), data.decode())
+        self.assertEqual(capture.result(), (data.decode(), None))
+
+    
+    # output_policy='spill' writes the output to a file beyond max_output
+    def test__exec__output_spill(self):
+        expected = ''.join([f'été → {i}\n' for i in range(20000)])
+        task = heasoftpy.HSPTask('latetask')
+        res  = task(output_policy='spill', max_output=1000)
+        self.assertEqual(res.returncode, 0)
+        self.assertIsNotNone(res._stdout._file)
+        self.assertEqual(res.stdout, 'to stdout\n' + expected)
+        self.assertEqual(res.output, res.stdout.split('\n'))
+        self.assertEqual(list(res.iter_output()), res.output)
+        
+        res = asyncio.run(task.acall(stderr=True, output_policy='spill', max_output=1000))
+        self.assertEqual(res.stdout, 'to stdout\n')
+        self.assertEqual(res.stderr, expected)
+    
+    # output_policy='head_tail' keeps the start and end of the output
+    def test__exec__output_head_tail(self):
+        task = heasoftpy.HSPTask('latetask')
+        res  = task(stderr=True, output_policy='head_tail', max_output=200)
+        self.assertEqual(res.stdout, 'to stdout\n')
+        err = res.stderr.split('\n')
+        self.assertEqual(err[0], 'été → 0')
+        self.assertRegex(res.stderr, r'\n\[\.\.\. \d+ bytes skipped \.\.\.\]\n')
+        self.assertEqual(err[-2], 'été → 19999')
+        self.assertLess(len(res.stderr.encode()), 300)
+        
+        with self.assertRaises(heasoftpy.HSPTaskException):
+            task(output_policy='none')
+
+    
+    # stream yields the output lines, then the result is available
+    def test__exec__stream(self):
+        task = heasoftpy.HSPTask('echotask')
+        with task.stream(infile='IN_FILE', number=3) as stream:
+            lines = list(stream)
+        self.assertEqual(stream.result.returncode, 0)
+        self.assertEqual([line for _,line in lines], stream.result.output[:-1])
+        self.assertIn(('stdout', 'infile=IN_FILE'), lines)
+        
+        stream = heasoftpy.HSPTask('latetask').stream(stderr=True)
+        lines  = list(stream)
+        self.assertEqual(lines[0], ('stdout', 'to stdout'))
+        self.assertEqual(lines[1], ('stderr', 'été → 0'))
+        self.assertEqual(len(lines), 20001)
+        self.assertEqual(stream.result.stderr.count('\n'), 20000)
+    
+    # closing a stream early kills the task
+    def test__exec__stream_close(self):
+        with heasoftpy.HSPTask('latetask').stream(stderr=True) as stream:
+            for source, line in stream:
+                if source == 'stderr':
+                    break
+        self.assertIsNotNone(stream.result)
+        self.assertIsNotNone(stream._proc.returncode)
+        self.assertEqual(list(stream), [])
+
+    
+    # python tasks run in the warm workers of HSPWorkerPool
+    def test__exec__worker_pool(self):
+        from heasoftpy.workers import HSPWorkerPool
+        task = heasoftpy.HSPTask('pytask')
+        res  = task(infile='IN_FILE', retcode=0)
+        self.assertEqual(res.returncode, 0)
+        
+        cwd = os.getcwd()
+        with HSPWorkerPool(max_workers=1, max_tasks=2, preload=()) as pool:
+            heasoftpy.HSPTask.python_executor = pool
+            try:
+                out = []
+                for i in range(3):
+                    res = task(infile=f'file{i}', retcode=i, stderr=True)
+                    self.assertEqual(res.returncode, i)
+                    self.assertEqual(res.stderr, 'to stderr\n')
+                    self.assertIn(f'infile=file{i}', res.stdout)
+                    self.assertIn('from child', res.stdout)
+                    out.append(res.output)
+                
+                # the same worker for max_tasks, then a new one
+                self.assertEqual(out[0][0], out[1][0])
+                self.assertNotEqual(out[1][0], out[2][0])
+                self.assertEqual(out[0][1], cwd)
+                
+                # cwd and PFILES follow the caller
+                os.chdir(self.hDir)
+                with heasoftpy.utils.pfiles_scope():
+                    res = task(infile='x', retcode=0)
+                os.chdir(cwd)
+                self.assertEqual(res.output[1], self.hDir)
+                self.assertNotEqual(res.output[2], os.environ['PFILES'])
+                self.assertEqual(task(infile='x', retcode=0).output[2], os.environ['PFILES'])
+                
+                # also from acall
+                async def _acall():
+                    with heasoftpy.utils.pfiles_scope() as pdir:
+                        return pdir, await task.acall(infile='x', retcode=0)
+                pdir, res = asyncio.run(_acall())
+                self.assertEqual(res.output[2], f'{pdir};{self.hDir}/syspfiles')
+                
+                # and from stream, which yields the lines at the end
+                with unittest.mock.patch.object(task, '_exec_python_executor', 
+                                                wraps=task._exec_python_executor) as mexec:
+                    with task.stream(infile='y', retcode=0) as stream:
+                        lines = list(stream)
+                mexec.assert_called_once()
+                self.assertEqual([line for _,line in lines], stream.result.output[:-1])
+                self.assertIn(('stdout', 'infile=y retcode=0 mode=ql'), lines)
+                
+                # concurrent runs
+                results = task.map([{'infile': f'f{i}', 'retcode': 0} for i in range(4)], 
+                                   max_workers=4, noprompt=True)
+                self.assertEqual([r.returncode for r in results], [0]*4)
+            finally:
+                os.chdir(cwd)
+                heasoftpy.HSPTask.python_executor = None
+
+    
+    # incremental=True skips the task when the outputs are newer than the inputs
+    def test__exec__incremental(self):
+        infile, outfile = f'{self.hDir}/in.txt', f'{self.hDir}/out.txt'
+        with open(infile, 'w') as fp:
+            fp.write('data')
+        os.utime(infile, (1e9, 1e9))
+        outputs_cache = heasoftpy.HSPTask.outputs_cache
+        heasoftpy.HSPTask.outputs_cache = heasoftpy.cache.HSPDiskCache(
+            'outputs', directory=f'{self.hDir}/outputs')
+        self.addCleanup(setattr, heasoftpy.HSPTask, 'outputs_cache', outputs_cache)
+        task = heasoftpy.HSPTask('copytask')
+        self.assertEqual(task.file_params(), {'infile': ''})
+        self.assertEqual(task.file_params(output=True), {'outfile': ''})
+        
+        res = task(infile=infile, outfile=outfile, incremental=True)
+        self.assertFalse(res.cached)
+        self.assertEqual(res.stdout, 'copying\n')
+        self.assertTrue(task.outputs_up_to_date())
+        
+        res = task(infile=infile, outfile=outfile, incremental=True)
+        self.assertTrue(res.cached)
+        self.assertEqual(res.returncode, 0)
+        self.assertEqual(res.stdout, '')
+        
+        # not incremental, or a newer input
+        self.assertFalse(task(infile=infile, outfile=outfile).cached)
+        os.utime(infile, None)
+        os.utime(outfile, (1e9, 1e9))
+        self.assertFalse(task.outputs_up_to_date())
+        self.assertFalse(task(infile=infile, outfile=outfile, incremental=True).cached)
+        
+        # missing output
+        os.remove(outfile)
+        self.assertFalse(task(infile=infile, outfile=outfile, incremental=True).cached)
+        self.assertTrue(os.path.exists(outfile))
+        
+        # outputs of a run with other parameters, or of an unknown run
+        self.assertTrue(task(infile=infile, outfile=outfile, incremental=True).cached)
+        self.assertFalse(task(infile=infile, outfile=outfile, incremental=True, 
+                              mode='h').cached)
+        heasoftpy.HSPTask.outputs_cache.clear()
+        self.assertFalse(task(infile=infile, outfile=outfile, incremental=True).cached)
+        self.assertTrue(task(infile=infile, outfile=outfile, incremental=True).cached)
+        
+        # also when streaming
+        with task.stream(infile=infile, outfile=outfile, incremental=True) as stream:
+            self.assertEqual(list(stream), [])
+        self.assertTrue(stream.result.cached)
+        os.utime(outfile, (1e9, 1e9))
+        with task.stream(infile=infile, outfile=outfile, incremental=True) as stream:
+            self.assertEqual(list(stream), [('stdout', 'copying')])
+        self.assertFalse(stream.result.cached)
+        self.assertTrue(task(infile=infile, outfile=outfile, incremental=True).cached)
+        for f in [infile, outfile]:
+            os.remove(f)
+
+    
+    # the user .par file is not rewritten if unchanged, and re-read only if the task changed it
+    def test__exec__pfile_write(self):
+        task  = heasoftpy.HSPTask('echotask')
+        pfile = f'{self.hDir}/pfiles/echotask.par'
+        t0    = time.time()
+        task(infile='IN_FILE', noprompt=True)
+        st1 = os.stat(pfile)
+        # the mtime is that of the write
+        self.assertGreater(st1.st_mtime, t0 - 1)
+        task(infile='IN_FILE', noprompt=True)
+        st2 = os.stat(pfile)
+        self.assertEqual((st1.st_ino, st1.st_mtime_ns), (st2.st_ino, st2.st_mtime_ns))
+        with open(pfile) as fp:
+            self.assertIn('infile,s,a,IN_FILE,', fp.read())
+        task(infile='OTHER', noprompt=True)
+        self.assertNotEqual(os.stat(pfile).st_ino, st2.st_ino)
+        self.assertEqual(sorted(os.listdir(f'{self.hDir}/pfiles')), ['echotask.par'])
+        
+        # a change in the same mtime tick as the last write is seen later
+        with open(pfile) as fp:
+            ptxt = fp.read()
+        st = os.stat(pfile)
+        with open(pfile, 'r+') as fp:
+            fp.write(ptxt.replace('OTHER', 'OTHR2'))
+        os.utime(pfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+        with unittest.mock.patch('heasoftpy.core._RACY_WINDOW_NS', 0):
+            self.assertFalse(task._pfile_unchanged(pfile, ptxt))
+        
+        task = heasoftpy.HSPTask('settask')
+        task(value='aaa', noprompt=True)
+        self.assertEqual(task.value.value, 'bbb')
+    
+    # timing=True records the phases of the call, and the resource usage of the process
+    def test__exec__timing(self):
+        task = heasoftpy.HSPTask('errtask')
+        res  = task(timing=True)
+        self.assertEqual(res.returncode, 3)
+        self.assertIn('to stdout', res.output)
+        timing = res.timing
+        self.assertIsInstance(timing, heasoftpy.HSPTiming)
+        for name in ['find_pfile', 'read_pfile', 'build_params', 'write_pfile', 'popen', 'sync_pfile']:
+            self.assertIn(name, timing.phases)
+        phases = timing.phases
+        self.assertTrue(phases['write_pfile'][1] <= phases['popen'][0] <= timing.marks['first_output']
+                        <= timing.marks['exit'] <= phases['sync_pfile'][0])
+        self.assertGreater(timing.rusage['maxrss'], 0)
+        self.assertGreater(timing.durations['run'], 0)
+        
+        with task.stream(timing=True) as stream:
+            list(stream)
+        timing = stream.result.timing
+        for name in ['write_pfile', 'popen', 'sync_pfile']:
+            self.assertIn(name, timing.phases)
+        self.assertTrue(timing.phases['popen'][0] <= timing.marks['first_output']
+                        <= timing.marks['exit'] <= timing.phases['sync_pfile'][0])
+        self.assertGreater(timing.rusage['maxrss'], 0)
+        
+        res = asyncio.run(task.acall(timing=True))
+        self.assertEqual(res.returncode, 3)
+        self.assertIn('exit', res.timing.marks)
+        self.assertIsNone(task().timing)
+        
+        # for tasks with a timing parameter, py_timing is used
+        with open(f'{self.hDir}/syspfiles/timetask.par', 'w') as fp:
+            fp.write('timing,b,h,no,,,"Timing"\nmode,s,h,"ql",,,')
+        os.symlink(f'{self.hDir}/bin/echotask', f'{self.hDir}/bin/timetask')
+        try:
+            task = heasoftpy.HSPTask('timetask')
+            res  = task(timing=True)
+            self.assertIsNone(res.timing)
+            self.assertIn('timing=yes', res.output)
+            self.assertIsNotNone(task(py_timing=True).timing)
+        finally:
+            os.remove(f'{self.hDir}/syspfiles/timetask.par')
+            os.remove(f'{self.hDir}/bin/timetask')
+    
+    # the wrappers reuse a task instance per thread, reset to the state of a new one
+    def test__exec__wrapper_pool(self):
+        from heasoftpy.core import _task_pool
+        def state(task):
+            return ([(p, getattr(task, p).schema, getattr(task, p).value) for p in task.par_names],
+                    task.default_params, task.params)
+        
+        wrapper = heasoftpy.fcn.echotask
+        res = wrapper(infile='a b', number=3, noprompt=True)
+        self.assertIn('number=3', res.output)
+        task = _task_pool._local.tasks['echotask']
+        for infile in ['c', 'c', 'd']:
+            res = wrapper(infile=infile, noprompt=True)
+            self.assertIs(_task_pool._local.tasks['echotask'], task)
+            self.assertIn(f'infile={infile}', res.output)
+            self.assertNotIn('number=3', res.output)
+            task.reset()
+            self.assertEqual(state(task), state(heasoftpy.HSPTask('echotask')))
+        
+        # the .par file phases are those of the reset before the call
+        t0  = time.perf_counter()
+        res = wrapper(infile='e', noprompt=True, timing=True)
+        phases = res.timing.phases
+        self.assertTrue(t0 <= phases['find_pfile'][0] <= phases['read_pfile'][1] 
+                        <= phases['build_params'][0])
+        
+        # each thread has its own instance
+        def run(ithread):
+            return [wrapper(infile=f'file{ithread}.{i}', noprompt=True) for i in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(run, range(4)))
+        for ithread, res in enumerate(results):
+            for i in range(4):
+                self.assertIn(f'infile=file{ithread}.{i}', res[i].output)
+    
+
+if __name__ == '__main__':
+    unittest.main()
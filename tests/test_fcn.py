@@ -0,0 +1,149 @@
+
+from .context import heasoftpy, HeadasTestCase
+
+import unittest
+import os
+import shutil
+
+
+class TestFcn(HeadasTestCase):
+    """Tests for the lazy loading of task wrappers"""
+    
+    @classmethod
+    def setUpHeadas(cls):
+        # a task with a .par file, and a python tool
+        cls.add_task('lazy-task', 'infile,s,a,,,,"Name"\nnumber,r,h,2.0,,,"Fraction"')
+        cls.add_task('pylazytask', 'infile,s,a,,,,"Name"', '', filename='pylazytask.py')
+        
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for name in ['lazy_task']:
+            vars(heasoftpy).pop(name, None)
+            vars(heasoftpy.fcn).pop(name, None)
+    
+    # a wrapper is created from the .par file
+    def test__fcn__from_pfile(self):
+        fcn = heasoftpy.fcn.lazy_task
+        self.assertEqual(fcn.__name__, 'lazy_task')
+        self.assertIn('number', fcn.__doc__)
+        self.assertIs(heasoftpy.lazy_task, fcn)
+        res = fcn(infile='IN_FILE', do_exec=False)
+        self.assertIsNone(res)
+    
+    # tasks appear in dir() before they are loaded
+    def test__fcn__dir(self):
+        self.assertIn('lazy_task', dir(heasoftpy.fcn))
+        self.assertIn('lazy_task', dir(heasoftpy))
+    
+    # unknown tasks and python tools are not available
+    def test__fcn__missing(self):
+        with self.assertRaises(AttributeError):
+            heasoftpy.no_such_task
+        with self.assertRaises(AttributeError):
+            heasoftpy.fcn.pylazytask
+
+    
+    # wrappers from a task registry
+    def test__fcn__registry(self):
+        fcn = heasoftpy.fcn
+        task = heasoftpy.HSPTask('lazy-task')
+        heasoftpy.utils.write_registry({'lazy-task': task}, self.hDir)
+        
+        registry = (fcn._registry_file, fcn._registry_docs, fcn._registry)
+        fcn._registry_file = f'{self.hDir}/_registry.json'
+        fcn._registry_docs = f'{self.hDir}/_registry_docs.txt'
+        fcn._registry = None
+        try:
+            entry = fcn._registry_tasks()['lazy_task']
+            self.assertEqual(entry['name'], 'lazy-task')
+            self.assertEqual(entry['pyname'], 'lazy_task')
+            wrapper = fcn._TaskWrapper('lazy-task', fcn._registry_doc)
+            self.assertIsNone(wrapper._doc)
+            self.assertEqual(wrapper.__doc__, task._generate_fcn_docs(fhelp=True))
+        finally:
+            fcn._registry_file, fcn._registry_docs, fcn._registry = registry
+
+    
+    # parallel generation; failures are reported after all tasks are done
+    def test__fcn__generate_parallel(self):
+        oDir = f'{self.hDir}/out'
+        os.mkdir(oDir)
+        with open(f'{self.hDir}/syspfiles/badtask.par', 'w') as fp:
+            fp.write('infile,x,a,,,,"Name"')
+        try:
+            with self.assertRaises(heasoftpy.HSPTaskException) as cm:
+                heasoftpy.utils.generate_py_code(nworkers=4, outdir=oDir)
+            self.assertIn('badtask', str(cm.exception))
+            self.assertEqual(sorted(os.listdir(oDir)), ['lazy_task.py'])
+            
+            heasoftpy.utils.generate_py_code(['lazy-task', 'pylazytask'], registry=True,
+                                             nworkers=2, outdir=oDir)
+            with open(f'{oDir}/_registry.json') as fp: txt1 = fp.read()
+            heasoftpy.utils.generate_py_code(['pylazytask', 'lazy-task'], registry=True,
+                                             nworkers=1, outdir=oDir)
+            with open(f'{oDir}/_registry.json') as fp: txt2 = fp.read()
+            self.assertEqual(txt1, txt2)
+            self.assertNotIn('pylazytask', txt1)
+            
+            # the files of the other install mode are removed
+            self.assertFalse(os.path.exists(f'{oDir}/lazy_task.py'))
+            heasoftpy.utils.generate_py_code(['lazy-task'], outdir=oDir)
+            self.assertEqual(sorted(os.listdir(oDir)), ['lazy_task.py'])
+        finally:
+            os.remove(f'{self.hDir}/syspfiles/badtask.par')
+            shutil.rmtree(oDir)
+
+    
+    # incremental generation only generates modified tasks
+    def test__fcn__generate_incremental(self):
+        oDir = f'{self.hDir}/out'
+        os.mkdir(oDir)
+        for task in ['inctask1', 'inctask2']:
+            with open(f'{self.hDir}/syspfiles/{task}.par', 'w') as fp:
+                fp.write('infile,s,a,,,,"Name"')
+        # only the files in the help directories are hashed
+        os.makedirs(f'{self.hDir}/help/inctask1')
+        try:
+            for registry in [False, True]:
+                tasks = ['inctask1', 'inctask2']
+                heasoftpy.utils.generate_py_code(tasks, registry=registry, outdir=oDir, incremental=True)
+                manifest = heasoftpy.utils._read_manifest(oDir)
+                self.assertEqual(sorted(manifest['tasks'].keys()), tasks)
+                
+                # modify one file, and remove one of the outputs
+                with open(f'{self.hDir}/syspfiles/inctask1.par', 'a') as fp:
+                    fp.write('\nnumber,r,h,2.0,,,"Fraction"')
+                mtimes = {f: os.stat(f'{oDir}/{f}').st_mtime_ns for f in os.listdir(oDir)}
+                heasoftpy.utils.generate_py_code(tasks, registry=registry, outdir=oDir, incremental=True)
+                if registry:
+                    reg = heasoftpy.utils._read_registry(oDir)
+                    self.assertIn('Fraction', reg['inctask1'][1])
+                    self.assertNotIn('Fraction', reg['inctask2'][1])
+                else:
+                    with open(f'{oDir}/inctask1.py') as fp:
+                        self.assertIn('Fraction', fp.read())
+                    self.assertEqual(os.stat(f'{oDir}/inctask2.py').st_mtime_ns, mtimes['inctask2.py'])
+                
+                # a task that became a python tool loses its wrapper
+                with open(f'{self.hDir}/bin/inctask2.py', 'w') as fp:
+                    fp.write('')
+                heasoftpy.utils.generate_py_code(tasks, registry=registry, outdir=oDir, incremental=True)
+                self.assertNotIn('inctask2', heasoftpy.utils._read_manifest(oDir)['tasks'])
+                self.assertNotIn('inctask2', heasoftpy.utils._read_registry(oDir))
+                self.assertFalse(os.path.exists(f'{oDir}/inctask2.py'))
+                os.remove(f'{self.hDir}/bin/inctask2.py')
+                
+                with open(f'{self.hDir}/syspfiles/inctask1.par', 'w') as fp:
+                    fp.write('infile,s,a,,,,"Name"')
+                shutil.rmtree(oDir)
+                os.mkdir(oDir)
+        finally:
+            for task in ['inctask1', 'inctask2']:
+                os.remove(f'{self.hDir}/syspfiles/{task}.par')
+            shutil.rmtree(f'{self.hDir}/help')
+            shutil.rmtree(oDir)
+
+        
+if __name__ == '__main__':
+    unittest.main()
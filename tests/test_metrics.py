@@ -0,0 +1,127 @@
+from .context import heasoftpy, HeadasTestCase
+from heasoftpy.metrics import HSPMetrics
+
+import unittest
+import os
+import sys
+import asyncio
+import json
+import time
+
+
+class TestMetrics(HeadasTestCase):
+    """Tests for the call hooks and the metrics aggregator"""
+
+    headas_name = 'metrics'
+
+    @classmethod
+    def setUpHeadas(cls):
+        os.makedirs(f'{cls.hDir}/out')
+        # exittask exits with the code it is given
+        cls.add_task('exittask', 'code,i,a,0,,,"Exit code"', '#!/bin/sh\nexit ${1#code=}\n')
+
+    def tearDown(self):
+        heasoftpy.hooks.clear()
+
+    # pre and post call hooks get the task name, parameters and result
+    def test__hooks(self):
+        calls = []
+        heasoftpy.hooks.add('pre_call', lambda name, params: calls.append(('pre', name, params['code'])))
+        unused = heasoftpy.hooks.add('pre_call', lambda name, params: calls.append('unused'))
+        heasoftpy.hooks.remove('pre_call', unused)
+        def post(name, params, result, elapsed):
+            calls.append(('post', name, result.returncode, elapsed > 0))
+        heasoftpy.hooks.add('post_call', post)
+        heasoftpy.HSPTask('exittask')(code=2, noprompt=True)
+        self.assertEqual(calls, [('pre', 'exittask', 2), ('post', 'exittask', 2, True)])
+
+        # a failing hook does not stop the call
+        heasoftpy.hooks.add('pre_call', lambda name, params: 1/0)
+        with self.assertLogs('heasoftpy.hooks', level='ERROR'):
+            res = heasoftpy.HSPTask('exittask')(code=0, noprompt=True)
+        self.assertEqual(res.returncode, 0)
+
+        with self.assertRaises(heasoftpy.HSPTaskException):
+            heasoftpy.hooks.add('no_event', post)
+        
+        # post_call hooks also run when the call raises an exception
+        class FailTask(heasoftpy.HSPTask):
+            def exec_task(self):
+                raise RuntimeError('no task')
+        heasoftpy.hooks.clear()
+        errors = []
+        heasoftpy.hooks.add('post_call', lambda name, params, result, elapsed: 
+                            errors.append((result, sys.exc_info()[0])))
+        metrics = HSPMetrics().install()
+        for call in [lambda task: task(code=0, noprompt=True),
+                     lambda task: asyncio.run(task.acall(code=0, noprompt=True)),
+                     lambda task: list(task.stream(code=0, noprompt=True))]:
+            with self.assertRaises(RuntimeError):
+                call(FailTask('exittask'))
+        metrics.uninstall()
+        self.assertEqual(errors, [(None, RuntimeError)] * 3)
+        self.assertEqual(metrics.snapshot()['tasks']['exittask']['failures'], 3)
+
+    # counts and histograms per task, from several threads
+    def test__metrics(self):
+        metrics = HSPMetrics(buckets=[0.5, 1]).install()
+        task = heasoftpy.HSPTask('exittask')
+        task.map([{'code': i % 2} for i in range(6)], max_workers=3, noprompt=True)
+        metrics.uninstall()
+        task(code=0, noprompt=True)
+        for elapsed in [0.7, 0.2]:
+            metrics.record('other', {}, heasoftpy.HSPResult(0, ''), elapsed)
+
+        tasks = metrics.snapshot()['tasks']
+        self.assertEqual((tasks['exittask']['calls'], tasks['exittask']['failures']), (6, 3))
+        self.assertEqual(tasks['other']['buckets'], [1, 1, 0])
+
+        text = metrics.to_prometheus()
+        self.assertIn('heasoftpy_task_calls_total{task="exittask"} 6', text)
+        self.assertIn('heasoftpy_task_duration_seconds_bucket{task="other",le="1"} 2', text)
+        self.assertIn('heasoftpy_task_duration_seconds_bucket{task="other",le="+Inf"} 2', text)
+
+    # dumps from several processes are merged, and a process replaces its own counts
+    def test__metrics__dump(self):
+        outfile = f'{self.hDir}/out/metrics.prom'
+        metrics = HSPMetrics()
+        metrics.record('exittask', {}, heasoftpy.HSPResult(1, ''), 0.1)
+        metrics.dump(outfile)
+        metrics.dump(outfile)
+
+        pid = os.fork()
+        if pid == 0:
+            # the child starts with no counts
+            code = 1 if metrics.snapshot()['tasks'] else 0
+            metrics.record('exittask', {}, heasoftpy.HSPResult(0, ''), 0.1)
+            metrics.dump(outfile)
+            os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+        data = metrics.dump(outfile)
+        self.assertEqual(len(data['sources']), 2)
+        self.assertEqual(data['tasks']['exittask']['calls'], 2)
+        self.assertEqual(data['tasks']['exittask']['failures'], 1)
+        with open(outfile) as fp:
+            self.assertIn('heasoftpy_task_calls_total{task="exittask"} 2', fp.read())
+
+        # old sources are compacted into one, with the same totals
+        time.sleep(0.01)
+        data = metrics.dump(outfile, max_age=0.005)
+        self.assertEqual(sorted(data['sources']), ['compacted', metrics._source])
+        self.assertEqual(data['sources']['compacted']['tasks']['exittask']['calls'], 1)
+        self.assertEqual(data['tasks']['exittask']['calls'], 2)
+        other = HSPMetrics()
+        data  = other.dump(outfile, max_age=0)
+        self.assertEqual(sorted(data['sources']), ['compacted', other._source])
+        self.assertEqual(data['tasks']['exittask']['failures'], 1)
+
+        jsonfile = f'{self.hDir}/out/metrics.json'
+        metrics.dump(jsonfile)
+        with open(jsonfile) as fp:
+            self.assertEqual(json.load(fp)['tasks']['exittask']['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
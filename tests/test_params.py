@@ -2,6 +2,7 @@
 from .context import heasoftpy
 
 import unittest
+import unittest.mock
 import os
 import re
 
@@ -88,6 +89,37 @@ class TestPFile(unittest.TestCase):
         pfile  = heasoftpy.HSPTask.find_pfile('fdump', return_user=True)
         pfile2 = os.path.join(re.split(';|:', os.environ['PFILES'])[0], 'fdump.par')
         self.assertEqual(pfile, pfile2)
+    
+    # read and write pfiles from a single lookup
+    def test__resolve_pfile__both(self):
+        pfiles = os.environ['PFILES']
+        pDir = os.path.join('/tmp', str(os.getpid()) + '.resolve.tmp')
+        os.mkdir(pDir)
+        with open(f'{pDir}/resolvetask.par', 'w') as fp: fp.write('infile,s,a,,,,"Name"')
+        os.environ['PFILES'] = f'{os.getcwd()}:{pDir};{pfiles}'
+        try:
+            pread, pwrite = heasoftpy.HSPTask.resolve_pfile('resolvetask')
+            self.assertEqual(pread, f'{pDir}/resolvetask.par')
+            self.assertEqual(pwrite, f'{os.getcwd()}/resolvetask.par')
+            
+            # pDir was just modified; it is not listed again on every lookup
+            with unittest.mock.patch('os.listdir', side_effect=AssertionError('listed')):
+                self.assertEqual(heasoftpy.HSPTask.find_pfile('resolvetask'), pread)
+            
+            # a new file in an earlier directory is found
+            with open('resolvetask.par', 'w') as fp: fp.write('infile,s,a,,,,"Name"')
+            pfile = heasoftpy.HSPTask.find_pfile('resolvetask')
+            self.assertEqual(pfile, f'{os.getcwd()}/resolvetask.par')
+            os.remove('resolvetask.par')
+            
+            # changing PFILES resets the lookup
+            os.environ['PFILES'] = f'{pDir};{pfiles}'
+            pread, pwrite = heasoftpy.HSPTask.resolve_pfile('resolvetask')
+            self.assertEqual(pwrite, f'{pDir}/resolvetask.par')
+        finally:
+            os.environ['PFILES'] = pfiles
+            os.remove(f'{pDir}/resolvetask.par')
+            os.rmdir(pDir)
 
 
 class TestReadPFile(unittest.TestCase):
@@ -133,6 +165,31 @@ class TestReadPFile(unittest.TestCase):
         self.assertEqual(pars[0].pname, 'filtlist')
         self.assertEqual(pars[0].prompt, 'Name of file, and stuff')
         os.remove(tmpfile)
+    
+    # quotes of both types, and apostrophes
+    def test__param_split_line(self):
+        split = heasoftpy.HSPParam.split_line
+        self.assertEqual(split('a,s,h,"x,y",,,"p, q"'), ['a', 's', 'h', '"x,y"', '', '', '"p, q"'])
+        self.assertEqual(split("a,s,h,'x,y',,,\"it's, ok\""), ['a', 's', 'h', "'x,y'", '', '', '"it\'s, ok"'])
+        self.assertEqual(split("a,s,h,x,,,it's, ok, really"), ['a', 's', 'h', 'x', '', '', "it's", ' ok', ' really'])
+        self.assertEqual(split('a,s,h,x,,,"p, q'), ['a', 's', 'h', 'x', '', '', '"p, q'])
+        self.assertEqual(split('a,s,h,",",",",",","p"'), ['a', 's', 'h', '","', '","', '","', '"p"'])
+        self.assertEqual(split('cols,s,h,"a,b",,'), ['cols', 's', 'h', '"a,b"', '', ''])
+        par = heasoftpy.HSPParam("mode,s,h,\"ql\",,,\"Don't, ask\"")
+        self.assertEqual([par.pname, par.mode, par.default, par.prompt], ['mode', 'h', 'ql', "Don't, ask"])
+    
+    # copies share the schema, and have their own value
+    def test__param_copy(self):
+        par = heasoftpy.HSPParam('number,r,a,2.5,0,10,"A number"')
+        self.assertEqual(par.schema, ('number', 'r', 'a', 2.5, '0', '10', 'A number'))
+        self.assertFalse(hasattr(par, '__dict__'))
+        par2 = par.copy()
+        self.assertIs(par2.schema, par.schema)
+        par2.value = 3.0
+        par2.prompt = 'Another prompt'
+        self.assertEqual(par.value, 2.5)
+        self.assertEqual(par.prompt, 'A number')
+        self.assertEqual(par2.prompt, 'Another prompt')
         
 class TestWritePFile(unittest.TestCase):
     """Tests for write_pfile"""
@@ -303,6 +360,67 @@ class TestWritePFile(unittest.TestCase):
         
         
 
+class TestPfileCache(unittest.TestCase):
+    """Tests for the cache of parsed .par files"""
+    
+    def setUp(self):
+        self.taskname = 'cachetask'
+        self.pfiles = os.environ['PFILES']
+        sep = ':' if ';' in os.environ["PFILES"] else ';'
+        os.environ['PFILES'] = os.getcwd() + sep + os.environ['PFILES']
+        self._write('infile,s,a,,,,"Name"\nnumber,r,h,2.0,,,"Fraction"')
+        heasoftpy.HSPTask.clear_pfile_cache()
+    
+    def tearDown(self):
+        os.remove(f'{self.taskname}.par')
+        os.environ['PFILES'] = self.pfiles
+        heasoftpy.HSPTask.clear_pfile_cache()
+        
+    def _write(self, wTxt, age=10):
+        # back-date the file, so it is not too recent to be cached
+        with open(f'{self.taskname}.par', 'w') as fp: fp.write(wTxt)
+        mtime = os.stat(f'{self.taskname}.par').st_mtime - age
+        os.utime(f'{self.taskname}.par', (mtime, mtime))
+    
+    # the second task uses the cache
+    def test__pfile_cache__hit(self):
+        heasoftpy.HSPTask(self.taskname)
+        heasoftpy.HSPTask(self.taskname)
+        info = heasoftpy.HSPTask.pfile_cache_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 1)
+        self.assertIn(os.path.abspath(f'{self.taskname}.par'), info['files'])
+    
+    # tasks from the cache do not share parameters
+    def test__pfile_cache__copy(self):
+        hsp1 = heasoftpy.HSPTask(self.taskname)
+        hsp2 = heasoftpy.HSPTask(self.taskname)
+        hsp1.number = 5.0
+        self.assertEqual(hsp2.number.value, 2.0)
+        self.assertIsNot(hsp1.number, hsp2.number)
+    
+    # a modified file is parsed again
+    def test__pfile_cache__modified(self):
+        heasoftpy.HSPTask(self.taskname)
+        self._write('infile,s,a,,,,"Name"\nnumber,r,h,30.0,,,"Fraction"', age=5)
+        hsp = heasoftpy.HSPTask(self.taskname)
+        self.assertEqual(hsp.number.value, 30.0)
+        self.assertEqual(heasoftpy.HSPTask.pfile_cache_info()['misses'], 2)
+    
+    # recently modified files are not cached
+    def test__pfile_cache__racy(self):
+        self._write('infile,s,a,,,,"Name"\nnumber,r,h,2.0,,,"Fraction"', age=0)
+        heasoftpy.HSPTask(self.taskname)
+        self.assertEqual(heasoftpy.HSPTask.pfile_cache_info()['files'], [])
+    
+    # cache size is bounded
+    def test__pfile_cache__maxsize(self):
+        heasoftpy.HSPTask.clear_pfile_cache(maxsize=0)
+        heasoftpy.HSPTask(self.taskname)
+        self.assertEqual(heasoftpy.HSPTask.pfile_cache_info()['files'], [])
+        heasoftpy.HSPTask.clear_pfile_cache(maxsize=256)
+    
+
 class TestParamExtra(unittest.TestCase):
     """Some additional tests for handling parameters"""
     
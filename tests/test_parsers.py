@@ -0,0 +1,107 @@
+
+from .context import heasoftpy
+from heasoftpy import parsers
+
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# output of ftlist option=T, with the table split in two blocks
+TABLE_TXT = """
+        TIME               RATE
+                           count/s
+      1  1.000000000000E+00  2.3000000E+00
+      2  2.000000000000E+00  4.5000000E+00
+      3  3.000000000000E+00  1.0000000E+00
+
+        ERROR          CCDNR NAME
+        count/s
+      1  1.0000000E-01     1 src
+      2  2.0000000E-01     2 bkg
+      3  1.0000000E-01     7 src
+"""
+
+# a table with blank cells
+BLANK_TXT = """
+        NAME      FLAG   COUNTS
+      1 src          1       10
+      2              0       20
+      3 bkg                  30
+      4 sky          1         
+"""
+
+# output of ftlist option=K
+KEYS_TXT = """
+XTENSION= 'BINTABLE'           / binary table extension
+NAXIS2  =                    3 / number of rows in table
+TSTART  =  1.2345000000000D+08 / start time
+OBJECT  = 'it''s a source'     / object name
+CLOCKAPP=                    T / clock correction applied
+COMMENT   this is a comment
+"""
+
+
+class TestParsers(unittest.TestCase):
+    """Tests for parsing the output of tasks"""
+
+    def test__parse_table(self):
+        table = parsers.parse_table(TABLE_TXT.split('\n'))
+        self.assertEqual(list(table.keys()), ['TIME', 'RATE', 'ERROR', 'CCDNR', 'NAME'])
+        self.assertEqual(table['NAME'], ['src', 'bkg', 'src'])
+        self.assertEqual(table['CCDNR'], ['1', '2', '7'])
+        self.assertEqual(table['RATE'][1], '4.5000000E+00')
+
+    # rows with blank cells are not taken as column names
+    def test__parse_table__blank(self):
+        table = parsers.parse_table(BLANK_TXT.split('\n'))
+        self.assertEqual(table, {'NAME': ['src', None, 'bkg', 'sky'], 
+                                 'FLAG': ['1', '0', None, '1'],
+                                 'COUNTS': ['10', '20', '30', None]})
+        
+        # without a complete row, the positions of the column names are used
+        lines = BLANK_TXT.split('\n')
+        table = parsers.parse_table(lines[:2] + lines[3:])
+        self.assertEqual(table['FLAG'], ['0', None, '1'])
+        self.assertEqual(table['COUNTS'], ['20', '30', None])
+
+    def test__parse_keywords(self):
+        keys = parsers.parse_keywords(KEYS_TXT.split('\n'))
+        self.assertEqual(keys, {'XTENSION': 'BINTABLE', 'NAXIS2': 3, 'TSTART': 1.2345e8,
+                                'OBJECT': "it's a source", 'CLOCKAPP': True})
+
+    # HSPResult.output is computed once, and reset when stdout changes
+    def test__result__output_cached(self):
+        res = heasoftpy.HSPResult(0, 'a\nb\n')
+        self.assertIs(res.output, res.output)
+        self.assertEqual(res.output, ['a', 'b', ''])
+        res.stdout = 'c'
+        self.assertEqual(res.output, ['c'])
+
+    def test__result__keywords(self):
+        res = heasoftpy.HSPResult(0, KEYS_TXT)
+        self.assertEqual(res.keywords['NAXIS2'], 3)
+        self.assertIs(res.keywords, res.keywords)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test__result__table(self):
+        res   = heasoftpy.HSPResult(0, TABLE_TXT)
+        table = res.table
+        self.assertIs(table, res.table)
+        self.assertEqual(table['CCDNR'].dtype, np.int64)
+        self.assertEqual(table['TIME'].dtype, np.float64)
+        self.assertTrue(np.allclose(table['ERROR'], [0.1, 0.2, 0.1]))
+        self.assertEqual(list(table['NAME']), ['src', 'bkg', 'src'])
+        
+        table = heasoftpy.HSPResult(0, BLANK_TXT).table
+        self.assertEqual(table['FLAG'].dtype, np.int64)
+        self.assertEqual(list(table['FLAG'].mask), [False, False, True, False])
+        self.assertEqual(table['COUNTS'].sum(), 60)
+        self.assertIsInstance(table['NAME'], np.ma.MaskedArray)
+
+
+if __name__ == '__main__':
+    unittest.main()
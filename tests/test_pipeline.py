@@ -0,0 +1,128 @@
+from .context import heasoftpy, HeadasTestCase
+from heasoftpy.pipeline import HSPPipeline
+
+import unittest
+import os
+import json
+
+
+class TestPipeline(HeadasTestCase):
+    """Tests for running pipelines of tasks"""
+    
+    headas_name = 'pipeline'
+    
+    @classmethod
+    def setUpHeadas(cls):
+        os.makedirs(f'{cls.hDir}/data')
+        
+        # copytask copies infile to outfile, and fails if infile contains 'fail'
+        cls.add_task('copytask', 'infile,f,a,,,,"Input"\noutfile,fw,a,,,,"Output"',
+                     f'#!/bin/sh\necho "$1" >> {cls.hDir}/calls\n'
+                     'f=${1#infile=}; f=${f%%\\[*}; o=${2#outfile=}; o=${o#!}\n'
+                     'grep -q fail $f && exit 2\ncp $f $o\n')
+        # listtask has an output file of type f, like ftlist
+        cls.add_task('listtask', 'infile,f,a,,,,"Input"\noutfile,f,h,"-",,,"Output"')
+    
+    def setUp(self):
+        for f in os.listdir(f'{self.hDir}/data'):
+            os.remove(f'{self.hDir}/data/{f}')
+        if os.path.exists(f'{self.hDir}/calls'):
+            os.remove(f'{self.hDir}/calls')
+        with open(f'{self.hDir}/data/in.txt', 'w') as fp:
+            fp.write('data')
+    
+    def _calls(self):
+        with open(f'{self.hDir}/calls') as fp:
+            return [line.strip()[len('infile='):] for line in fp]
+    
+    def _pipeline(self, executor, fail=False):
+        d = f'{self.hDir}/data'
+        pipe = HSPPipeline('test', max_workers=3, executor=executor, state_file=f'{d}/state.json')
+        # b and c come after a; d comes after c; e is independent
+        pipe.add('copytask', {'infile': f'{d}/b.txt', 'outfile': f'{d}/c.txt'}, name='c')
+        pipe.add('copytask', {'infile': f'{d}/a.txt[1]', 'outfile': f'!{d}/b.txt'}, name='b')
+        pipe.add('copytask', {'infile': f'{d}/in.txt', 'outfile': f'{d}/a.txt'}, name='a')
+        pipe.add('copytask', {'infile': f'{d}/c.txt', 'outfile': f'{d}/d.txt'}, name='d')
+        pipe.add('copytask', {'infile': f'{d}/in.txt', 'outfile': f'{d}/e.txt'})
+        return pipe
+    
+    # steps run after the steps producing their input
+    def test__pipeline__run(self):
+        for executor in ['thread', 'process']:
+            self.setUp()
+            pipe   = self._pipeline(executor)
+            report = pipe.run(report=f'{self.hDir}/data/report.json')
+            self.assertTrue(report['success'])
+            self.assertEqual(pipe.steps['c'].depends, ['b'])
+            self.assertEqual(pipe.steps['b'].depends, ['a'])
+            self.assertEqual(report['counts'], {'done': 5})
+            calls = [os.path.basename(f) for f in self._calls()]
+            self.assertLess(calls.index('in.txt'), calls.index('a.txt[1]'))
+            self.assertLess(calls.index('a.txt[1]'), calls.index('b.txt'))
+            self.assertLess(calls.index('b.txt'), calls.index('c.txt'))
+            self.assertTrue(os.path.exists(f'{self.hDir}/data/d.txt'))
+            self.assertEqual(pipe.steps['d'].result.returncode, 0)
+            with open(f'{self.hDir}/data/report.json') as fp:
+                self.assertEqual(json.load(fp)['steps']['copytask']['status'], 'done')
+    
+    # a failure blocks the steps after it; resume runs only what is left
+    def test__pipeline__resume(self):
+        with open(f'{self.hDir}/data/in.txt', 'w') as fp:
+            fp.write('fail')
+        pipe   = self._pipeline('thread')
+        report = pipe.run()
+        self.assertFalse(report['success'])
+        self.assertEqual(report['steps']['a']['status'], 'failed')
+        self.assertEqual(report['steps']['d']['status'], 'blocked')
+        self.assertEqual(report['steps']['copytask']['status'], 'failed')
+        
+        with open(f'{self.hDir}/data/in.txt', 'w') as fp:
+            fp.write('data')
+        os.remove(f'{self.hDir}/calls')
+        report = self._pipeline('thread').run(resume=True)
+        self.assertTrue(report['success'])
+        self.assertEqual(len(self._calls()), 5)
+        
+        os.remove(f'{self.hDir}/calls')
+        os.remove(f'{self.hDir}/data/d.txt')
+        report = self._pipeline('thread').run(resume=True)
+        self.assertEqual(report['counts'], {'resumed': 4, 'done': 1})
+        self.assertEqual(self._calls(), [f'{self.hDir}/data/c.txt'])
+    
+    # f parameters named out* are outputs
+    def test__pipeline__f_outputs(self):
+        pipe = HSPPipeline(executor='thread')
+        pipe.add('copytask', {'infile': 'x.txt', 'outfile': 'y.txt'}, name='copy')
+        pipe.add('listtask', {'infile': 'y.txt', 'outfile': 'z.txt'}, name='list')
+        pipe.add('listtask', {'infile': 'z.txt', 'outfile': '-'}, name='screen')
+        self.assertEqual(pipe.steps['list'].outputs, [os.path.abspath('z.txt')])
+        self.assertEqual(pipe.steps['screen'].outputs, [])
+        self.assertEqual(pipe._resolve(), ['copy', 'list', 'screen'])
+        self.assertEqual(pipe.steps['screen'].depends, ['list'])
+    
+    # cfitsio extensions (file+1) and the files in @list files are inputs
+    def test__pipeline__file_specs(self):
+        d = f'{self.hDir}/data'
+        with open(f'{d}/files.txt', 'w') as fp:
+            fp.write(f'{d}/b.txt[1]\n\n{d}/c.txt+2\n')
+        pipe = HSPPipeline(executor='thread')
+        pipe.add('copytask', {'infile': f'{d}/in.txt', 'outfile': f'{d}/a.txt'}, name='a')
+        pipe.add('copytask', {'infile': f'{d}/a.txt+1', 'outfile': f'{d}/b.txt'}, name='b')
+        pipe.add('copytask', {'infile': f'{d}/in.txt', 'outfile': f'{d}/c.txt'}, name='c')
+        pipe.add('listtask', {'infile': f'@{d}/files.txt'}, name='list')
+        self.assertEqual(pipe.steps['list'].inputs, [f'{d}/files.txt', f'{d}/b.txt', f'{d}/c.txt'])
+        pipe._resolve()
+        self.assertEqual(pipe.steps['b'].depends, ['a'])
+        self.assertEqual(pipe.steps['list'].depends, ['b', 'c'])
+    
+    # cycles are detected
+    def test__pipeline__cycle(self):
+        pipe = HSPPipeline(executor='thread')
+        pipe.add('copytask', {'infile': 'x.txt', 'outfile': 'y.txt'})
+        pipe.add('copytask', {'infile': 'y.txt', 'outfile': 'x.txt'})
+        with self.assertRaises(heasoftpy.HSPTaskException):
+            pipe.run()
+
+
+if __name__ == '__main__':
+    unittest.main()